@@ -0,0 +1,325 @@
+"""
+列式内存分析（可选，ANALYTICS_MODE=1 开启，需要 numpy）
+把 records 的统计相关列加载为 numpy 数组：日期为 int32 天数（date.toordinal()）、类型为 int8 编码、
+分类为 int16（即 category_id）、金额为 int64 分，并在此基础上维护 (天, 类型, 分类) 的金额/条数立方体。
+/api/stats、/api/year-stats 的分类汇总、日统计、月/年汇总改为对立方体切片求和，耗时只与天数和分类数有关，
+与记录条数无关，也不再查询数据库。
+
+同步通过账本版本（changelog.py）增量进行：每次统计前读取一次 ledger_meta 的版本号，有变化时用
+changes_since 取回新增、修改的记录和删除墓碑，减去旧值、加上新值。其他 gunicorn worker 或导入脚本的写入
+同样会被取回。1000 万条记录约占 230 MB 内存（列数组）加上立方体（天数 × 类型数 × 分类数 × 12 字节）。
+"""
+import threading
+from datetime import date
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+
+import changelog
+import partitions
+from models import Record, get_session
+
+# 每次增量同步从 changes_since 取回的最多记录数
+SYNC_BATCH = 100000
+# 首次加载时每次从服务端游标取出的行数
+LOAD_BATCH = 100000
+# 已删除的行超过总行数的这个比例时压缩数组
+COMPACT_RATIO = 0.25
+# 类型编码，其他类型在遇到时追加；-1 表示已删除的行
+BASE_TYPES = ('expense', 'income')
+
+def available():
+    return np is not None
+
+class ColumnarLedger:
+    """records 的列式快照和按天预聚合的立方体，线程安全
+
+    bind() 返回加载和同步使用的引擎（主库，不随请求切换到只读副本）；background 为 True 时首次使用
+    在后台线程加载，加载完成前 current() 返回 None，调用方走 SQL。
+    """
+
+    def __init__(self, bind=None, background=True):
+        if np is None:
+            raise RuntimeError('分析模式需要 numpy：pip install numpy')
+        self.bind = bind
+        self.background = background
+        self.engine = None
+        self.version = None
+        self.types = list(BASE_TYPES)
+        self._lock = threading.Lock()
+        self._loading = None
+        self._reset()
+
+    def _reset(self):
+        self.n = 0
+        self.dead = 0
+        self.ids = np.empty(0, np.int64)
+        self.day = np.empty(0, np.int32)
+        self.type = np.empty(0, np.int8)
+        self.cat = np.empty(0, np.int16)
+        self.cents = np.empty(0, np.int64)
+        # 立方体：base_day 起的天 × 类型 × 分类 id
+        self.base_day = 0
+        self.cube_cents = np.zeros((0, len(self.types), 1), np.int64)
+        self.cube_count = np.zeros((0, len(self.types), 1), np.int32)
+
+    # ------------------------------------------------------------------
+    # 加载与同步
+    # ------------------------------------------------------------------
+
+    def current(self):
+        """同步到最新版本后返回自身；仍在后台加载时返回 None"""
+        engine = self.bind()
+        if self.engine is not engine:
+            with self._lock:
+                if self.engine is not engine:
+                    self.engine = engine
+                    self.version = None
+                    self._loading = None
+        if self.version is None:
+            if not self.background:
+                self.load(engine)
+            else:
+                with self._lock:
+                    # 加载失败（如数据库暂时不可用）的线程已退出，下次请求重试
+                    if self._loading is None or not self._loading.is_alive():
+                        self._loading = threading.Thread(target=self._load_in_background, args=(engine,), name='columnar-load',
+                                                         daemon=True)
+                        self._loading.start()
+                return None
+        session = get_session(engine)
+        try:
+            self.sync(session)
+        finally:
+            session.close()
+        return self
+
+    def load(self, engine):
+        """从数据库全量加载；先读版本号再读记录，期间提交的写入会在下次同步时重复应用，结果不变"""
+        session = get_session(engine)
+        try:
+            version = changelog.current_version(session)
+            chunks = []
+            # 已归档年份的记录在各自的表中（见 partitions.py）
+            tables = partitions.tables(session)
+            for table in tables:
+                c = table.c
+                stmt = select(c.id, c.date, c.type, c.category_id, c.amount_cents).order_by(c.id)
+                result = session.execute(stmt, execution_options={'yield_per': LOAD_BATCH})
+                for rows in result.partitions():
+                    chunks.append(self._columns(rows))
+        finally:
+            session.close()
+        with self._lock:
+            if self.engine is not engine:
+                return
+            self._reset()
+            if chunks:
+                ids, day, typ, cat, cents = (np.concatenate(c) for c in zip(*chunks))
+                if len(tables) > 1:
+                    order = np.argsort(ids)
+                    ids, day, typ, cat, cents = ids[order], day[order], typ[order], cat[order], cents[order]
+                self._append(ids, day, typ, cat, cents)
+            self.version = version
+
+    def _load_in_background(self, engine):
+        try:
+            self.load(engine)
+        except SQLAlchemyError as e:
+            print(f'✗ 加载列式快照失败，统计仍查询数据库: {e}')
+
+    def sync(self, session):
+        """取回版本 self.version 之后的变更并应用"""
+        latest = changelog.current_version(session)
+        if latest <= self.version:
+            return
+        with self._lock:
+            columns = [Record.id, Record.date, Record.type, Record.category_id, Record.amount_cents, Record.version]
+            more = True
+            while more and self.version < latest:
+                version, rows, deleted, more = changelog.changes_since(session, self.version, SYNC_BATCH, columns)
+                self._apply(rows, [rid for rid, _ in deleted])
+                self.version = version
+
+    def _type_code(self, t):
+        try:
+            return self.types.index(t)
+        except ValueError:
+            self.types.append(t)
+            return len(self.types) - 1
+
+    def _columns(self, rows):
+        ids = np.fromiter((r[0] for r in rows), np.int64, len(rows))
+        day = np.fromiter((r[1].toordinal() for r in rows), np.int32, len(rows))
+        typ = np.fromiter((self._type_code(r[2]) for r in rows), np.int8, len(rows))
+        cat = np.fromiter((r[3] for r in rows), np.int16, len(rows))
+        cents = np.fromiter((r[4] for r in rows), np.int64, len(rows))
+        return ids, day, typ, cat, cents
+
+    def _positions(self, ids):
+        """ids 在快照中的位置，不存在的为 -1"""
+        if not self.n:
+            return np.full(len(ids), -1, np.int64)
+        pos = np.searchsorted(self.ids[:self.n], ids)
+        clipped = np.minimum(pos, self.n - 1)
+        return np.where(self.ids[clipped] == ids, clipped, -1)
+
+    def _apply(self, rows, deleted_ids):
+        # 先删除再写入：SQLite 会复用被删除的最大 id，同一批变更中可能既有旧记录的墓碑又有同 id 的新记录
+        if deleted_ids:
+            p = self._positions(np.asarray(deleted_ids, np.int64))
+            p = p[p >= 0]
+            p = p[self.type[p] >= 0]
+            if len(p):
+                self._accumulate(p, -1)
+                self.type[p] = -1
+                self.dead += len(p)
+        if rows:
+            ids, day, typ, cat, cents = self._columns(rows)
+            pos = self._positions(ids)
+            old = pos >= 0
+            if old.any():
+                p = pos[old]
+                self._accumulate(p, -1)
+                self.dead -= int((self.type[p] < 0).sum())
+                self.day[p], self.type[p], self.cat[p], self.cents[p] = day[old], typ[old], cat[old], cents[old]
+                self._accumulate(p, 1)
+            new = ~old
+            if new.any():
+                self._append(ids[new], day[new], typ[new], cat[new], cents[new])
+        if self.dead > self.n * COMPACT_RATIO:
+            self._compact()
+
+    def _append(self, ids, day, typ, cat, cents):
+        start = self.n
+        sorted_tail = not start or ids.min() > self.ids[start - 1]
+        need = start + len(ids)
+        if need > len(self.ids):
+            # 按 1.5 倍扩容，追加的均摊开销为常数
+            capacity = max(need, int(len(self.ids) * 1.5), 1024)
+            for name in ('ids', 'day', 'type', 'cat', 'cents'):
+                arr = getattr(self, name)
+                grown = np.empty(capacity, arr.dtype)
+                grown[:start] = arr[:start]
+                setattr(self, name, grown)
+        order = np.argsort(ids, kind='stable')
+        for name, values in (('ids', ids), ('day', day), ('type', typ), ('cat', cat), ('cents', cents)):
+            getattr(self, name)[start:need] = values[order]
+        self.n = need
+        if not sorted_tail:
+            # 并发事务的提交顺序与 id 顺序不一致时，新 id 可能小于已有的最大 id，整体重新排序
+            order = np.argsort(self.ids[:need], kind='stable')
+            for name in ('ids', 'day', 'type', 'cat', 'cents'):
+                arr = getattr(self, name)
+                arr[:need] = arr[:need][order]
+            positions = np.searchsorted(self.ids[:need], ids)
+        else:
+            positions = np.arange(start, need)
+        self._accumulate(positions, 1)
+
+    def _compact(self):
+        keep = self.type[:self.n] >= 0
+        for name in ('ids', 'day', 'type', 'cat', 'cents'):
+            setattr(self, name, getattr(self, name)[:self.n][keep].copy())
+        self.n = len(self.ids)
+        self.dead = 0
+
+    def _ensure_cube(self, day_min, day_max, cat_max):
+        days, types, cats = self.cube_cents.shape
+        if days == 0:
+            base, days = day_min, 0
+        else:
+            base = self.base_day
+        lo = min(base, day_min)
+        hi = max(base + days - 1, day_max)
+        new_shape = (hi - lo + 1, len(self.types), max(cats, cat_max + 1))
+        if new_shape == self.cube_cents.shape and lo == base:
+            return
+        # 日期方向多留一年，避免每天的新记录都触发扩容
+        if hi - lo + 1 > days:
+            pad = 366 if days else 0
+            lo = min(lo, base - pad) if day_min < base else lo
+            hi = max(hi, base + days - 1 + pad) if day_max > base + days - 1 else hi
+            new_shape = (hi - lo + 1,) + new_shape[1:]
+        cube_cents = np.zeros(new_shape, np.int64)
+        cube_count = np.zeros(new_shape, np.int32)
+        if days:
+            offset = base - lo
+            cube_cents[offset:offset + days, :types, :cats] = self.cube_cents
+            cube_count[offset:offset + days, :types, :cats] = self.cube_count
+        self.cube_cents, self.cube_count, self.base_day = cube_cents, cube_count, lo
+
+    def _accumulate(self, positions, sign):
+        """把 positions 处的行按 sign（+1 / -1）累加到立方体，已删除的行跳过"""
+        positions = positions[self.type[positions] >= 0]
+        if not len(positions):
+            return
+        day = self.day[positions]
+        cat = self.cat[positions]
+        self._ensure_cube(int(day.min()), int(day.max()), int(cat.max()))
+        index = (day - self.base_day, self.type[positions], cat)
+        # 整数 add.at 求和没有浮点误差（bincount 的 weights 会转为 float64）
+        np.add.at(self.cube_cents, index, sign * self.cents[positions])
+        if len(positions) * 8 > self.cube_count.size:
+            # 全量加载时行数远大于立方体格数，bincount 一次算出所有格的条数
+            flat = np.ravel_multi_index(index, self.cube_count.shape)
+            counts = np.bincount(flat, minlength=self.cube_count.size).astype(np.int32)
+            self.cube_count.reshape(-1)[:] += sign * counts
+        else:
+            np.add.at(self.cube_count, index, sign)
+
+    # ------------------------------------------------------------------
+    # 查询：金额均为整数分
+    # ------------------------------------------------------------------
+
+    def _slice(self, start, end):
+        """[start, end] 闭区间对应的立方体切片，None 表示不限"""
+        days = self.cube_cents.shape[0]
+        d0 = 0 if start is None else max(0, start.toordinal() - self.base_day)
+        d1 = days if end is None else min(days, end.toordinal() - self.base_day + 1)
+        d1 = max(d0, d1)
+        return slice(d0, d1)
+
+    def range_stats(self, start, end):
+        """返回 ([(分类 id, 类型, 金额), ...], {日期: {类型: 金额}})，与 SQL 按 (分类, 类型) / (日期, 类型) 分组的结果相同"""
+        with self._lock:
+            window = self._slice(start, end)
+            cents = self.cube_cents[window]
+            counts = self.cube_count[window]
+            by_cat_cents = cents.sum(axis=0)
+            by_cat_count = counts.sum(axis=0)
+            cats, types = np.nonzero(by_cat_count.T)
+            by_category = [(c, self.types[t], total) for c, t, total in
+                           zip(cats.tolist(), types.tolist(), by_cat_cents[types, cats].tolist())]
+            day_cents = cents.sum(axis=2)
+            day_count = counts.sum(axis=2)
+            days, types = np.nonzero(day_count)
+            first = self.base_day + window.start
+            daily = {}
+            for d, t, total in zip(days.tolist(), types.tolist(), day_cents[days, types].tolist()):
+                daily.setdefault(date.fromordinal(first + d), {})[self.types[t]] = total
+        return by_category, daily
+
+    def totals_by_type(self, start, end_exclusive):
+        """[start, end_exclusive) 区间的 (收入, 支出)"""
+        with self._lock:
+            window = self._slice(start, date.fromordinal(end_exclusive.toordinal() - 1))
+            totals = self.cube_cents[window].sum(axis=(0, 2))
+            return int(totals[1]), int(totals[0])
+
+    def monthly_totals(self, year):
+        """{月份: {'income', 'expense'}}"""
+        months = {}
+        with self._lock:
+            for m in range(1, 13):
+                first = date(year, m, 1)
+                last = date(year + 1, 1, 1) if m == 12 else date(year, m + 1, 1)
+                window = self._slice(first, date.fromordinal(last.toordinal() - 1))
+                totals = self.cube_cents[window].sum(axis=(0, 2))
+                months[m] = {'income': int(totals[1]), 'expense': int(totals[0])}
+        return months
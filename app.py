@@ -1,7 +1,32 @@
-from flask import Flask, render_template, request, jsonify
-from datetime import datetime
-from models import Record, get_engine, get_session
-from sqlalchemy import func
+from flask import Flask, Response, g, has_request_context, make_response, render_template, request, jsonify
+from flask.globals import app_ctx
+from datetime import datetime, timedelta
+import analytics
+import base64
+import csv
+import functools
+import hashlib
+import io
+import json
+import queue
+import threading
+import time
+import weakref
+import writebehind
+from models import Record, DailyTotal, SessionFactory, get_engine, get_session, writer_engine
+from cache import create_cache
+from events import Broadcaster, format_event
+import categories
+import changelog
+import ingest
+import metrics
+import partitions
+from money import format_cents, to_cents
+from profiling import Profiler
+import rollup
+import search
+from sqlalchemy import func, or_, extract
+from sqlalchemy.orm import scoped_session
 
 app = Flask(__name__)
 
@@ -20,248 +45,1094 @@ except Exception as e:
     print("将使用 SQLite 作为备用数据库")
     engine = get_engine('sqlite:///records.db')
 
-def record_to_dict(r):
-    return {
-        'id': r.id,
-        'type': r.type,
-        'amount': r.amount,
-        'category': r.category,
-        'date': r.date.strftime('%Y-%m-%d'),
-        'note': r.note or ''
-    }
+# 只读副本：未配置时为 None，所有请求使用主库
+replica_engine = None
+if app.config.get('REPLICA_DATABASE_URI'):
+    replica_engine = get_engine(app.config['REPLICA_DATABASE_URI'])
+    print("✓ 读请求使用只读副本")
+
+# 写请求成功后设置的 cookie，有效期内该客户端的读请求也走主库（读到自己的写入）
+PIN_COOKIE = 'ledger_primary'
+# 总是读主库的接口：/api/changes 在收到 SSE 变更通知后立即调用，副本落后时会漏掉这次变更
+PRIMARY_ENDPOINTS = {'list_changes'}
+
+# 请求内共用的会话：以应用上下文（每个请求一个）为作用域，同一请求中多次调用返回同一个会话，
+# 请求结束时由 teardown 关闭并归还连接
+db_session = scoped_session(SessionFactory, scopefunc=lambda: id(app_ctx._get_current_object()))
+
+# 只读的请求方法，其余请求的会话绑定到写引擎（SQLite 时为单个写连接，见 models.writer_engine）
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+def read_engine():
+    """读请求使用的引擎：配置了副本、且客户端不在写入后的固定期内时为副本"""
+    if (replica_engine is not None and has_request_context() and not request.cookies.get(PIN_COOKIE)
+            and request.endpoint not in PRIMARY_ENDPOINTS):
+        return replica_engine
+    return engine
+
+def request_session():
+    """当前请求的会话，首次调用时绑定：写请求为 engine 的写引擎，读请求见 read_engine()"""
+    if not db_session.registry.has():
+        writes = has_request_context() and request.method not in READ_METHODS
+        bind = writer_engine(engine) if writes else read_engine()
+        metrics.instrument_pool(bind.pool, pool_wait)
+        db_session.registry.set(SessionFactory(bind=bind))
+    return db_session()
+
+@app.teardown_appcontext
+def remove_session(exc=None):
+    db_session.remove()
+
+@app.after_request
+def pin_to_primary(response):
+    if replica_engine is not None and request.method not in READ_METHODS and response.status_code < 400:
+        response.set_cookie(PIN_COOKIE, '1', max_age=app.config.get('REPLICA_PIN_SECONDS', 5),
+                            httponly=True, samesite='Lax')
+    return response
+
+# 统计和记录列表接口的缓存，写接口按日期失效；多 worker 部署时使用 shared 后端
+api_cache = create_cache(
+    app.config.get('CACHE_BACKEND', 'memory'),
+    maxsize=app.config.get('STATS_CACHE_SIZE', 256),
+    ttl=app.config.get('STATS_CACHE_TTL', 60),
+    path=app.config.get('CACHE_SHARED_PATH')
+)
+
+# 请求剖析：Server-Timing 响应头、慢查询日志、cProfile 采样，默认关闭
+profiler = Profiler(
+    app,
+    slow_ms=app.config.get('SLOW_QUERY_MS', 200),
+    slow_log=app.config.get('SLOW_QUERY_LOG'),
+    sample_rate=app.config.get('PROFILE_SAMPLE_RATE', 0),
+    profile_dir=app.config.get('PROFILE_DIR'),
+    keep=app.config.get('PROFILE_KEEP', 20)
+)
+if app.config.get('PROFILE_REQUESTS'):
+    profiler.enable()
+
+# 运行指标（GET /metrics）：按线程分片计数，抓取时合并；多 worker 时通过 METRICS_DIR 汇总各进程
+metrics_registry = metrics.Registry()
+http_requests = metrics_registry.counter('ledger_http_requests_total', '按路由、方法和状态码统计的请求数')
+http_duration = metrics_registry.histogram(
+    'ledger_http_request_duration_seconds', '按路由统计的请求耗时（流式响应只计到开始发送）')
+pool_wait = metrics_registry.histogram(
+    'ledger_db_pool_wait_seconds', '从连接池取出连接的等待时间',
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+rows_returned = metrics_registry.histogram(
+    'ledger_db_rows_returned', '每次查询返回的行数',
+    buckets=(1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000))
+metrics_store = None
+if app.config.get('METRICS_DIR'):
+    metrics_store = metrics.MultiProcessStore(
+        metrics_registry, app.config['METRICS_DIR'], app.config.get('METRICS_FLUSH_INTERVAL', 5))
+
+@metrics_registry.collector('ledger_cache_lookups_total', 'counter', '接口缓存查找次数，result 为 hit 或 miss')
+def collect_cache_lookups():
+    stats = api_cache.stats()
+    return [((('result', 'hit'),), stats['hits']), ((('result', 'miss'),), stats['misses'])]
+
+metrics_registry.describe('ledger_cache_hit_ratio', 'gauge', '接口缓存命中率（所有 worker 合计）')
+
+@metrics_registry.collector('ledger_cache_evictions_total', 'counter', '接口缓存因容量淘汰的条目数')
+def collect_cache_evictions():
+    return [((), api_cache.stats()['evictions'])]
+
+@metrics_registry.collector('ledger_write_queue_depth', 'gauge', '后台组提交队列中等待写入的记录数')
+def collect_write_queue_depth():
+    return [((), write_behind.depth())] if write_behind is not None else []
+
+@metrics_registry.collector('ledger_write_batches_total', 'counter', '后台组提交的事务数')
+def collect_write_batches():
+    return [((), write_behind.batches)] if write_behind is not None else []
+
+@metrics_registry.collector('ledger_db_pool_checked_out', 'gauge', '当前借出的数据库连接数')
+def collect_pool_checked_out():
+    checkedout = getattr(engine.pool, 'checkedout', None)
+    return [((), checkedout())] if checkedout else []
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if metrics_store is not None:
+        # gunicorn fork 出的 worker 在第一个请求时启动自己的写出线程
+        metrics_store.start()
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_requests.inc((('route', route), ('method', request.method), ('status', str(response.status_code))))
+        http_duration.observe(time.perf_counter() - start, (('route', route),))
+    return response
+
+# 分类名称与 id 的进程内缓存，遇到其他进程新建的分类时从当前 engine 重新加载
+category_cache = categories.cache
+category_cache.bind = lambda: engine
+
+# 列式内存分析（ANALYTICS_MODE=1，需要 numpy）：为 None 时统计查询日汇总表
+columnar = None
+if app.config.get('ANALYTICS_MODE'):
+    if analytics.available():
+        columnar = analytics.ColumnarLedger(lambda: engine)
+    else:
+        print('✗ ANALYTICS_MODE 需要 numpy，统计仍查询数据库')
+
+# 新增记录的后台组提交（WRITE_BEHIND=1，见 writebehind.py）：为 None 时每个请求自己提交
+def write_behind_committed(span):
+    api_cache.invalidate_range(*span)
+    broadcaster.notify()
+
+write_behind = None
+if app.config.get('WRITE_BEHIND'):
+    write_behind = writebehind.GroupCommitWriter(
+        lambda: writer_engine(engine),
+        max_batch=app.config.get('WRITE_BEHIND_BATCH', 200),
+        max_delay=app.config.get('WRITE_BEHIND_DELAY_MS', 2) / 1000,
+        max_queue=app.config.get('WRITE_BEHIND_QUEUE', 10000),
+        put_timeout=app.config.get('WRITE_BEHIND_PUT_TIMEOUT', 1.0),
+        on_commit=write_behind_committed
+    )
+
+def columnar_snapshot():
+    """同步到最新账本版本的列式快照；未开启或仍在后台加载时返回 None"""
+    return columnar.current() if columnar is not None else None
+
+# 记录列表分页参数
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# 导出时每次从服务端游标取出的行数，也是 CSV 每次写出的行数和 columnar 格式每个行组的大小
+EXPORT_CHUNK_SIZE = 2000
+
+# 按行流式读取的请求体类型
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonl')
+CSV_MIMETYPES = ('text/csv', 'application/csv')
+
+# 每个字段对应的序列化方式，fields= 投影时只输出其中一部分
+RECORD_FIELDS = {
+    'id': lambda r: r.id,
+    'type': lambda r: r.type,
+    'amount': lambda r: format_cents(r.amount_cents),
+    'category': lambda r: category_cache.name(r.category_id),
+    'date': lambda r: r.date.isoformat(),
+    'note': lambda r: r.note or '',
+}
+
+# 字段名与列名不同的字段：金额在库中以分存储，输出时转换为两位小数的字符串；分类在库中为 id
+FIELD_COLUMNS = {'amount': 'amount_cents', 'category': 'category_id'}
+
+def record_to_dict(r, fields=None):
+    """r 可以是 Record 实例，也可以是只含部分列的查询结果行"""
+    fields = fields or RECORD_FIELDS
+    return {f: RECORD_FIELDS[f](r) for f in fields}
+
+def parse_date(s):
+    """解析 YYYY-MM-DD，为空或格式错误时返回 None（忽略该过滤条件）"""
+    if not s:
+        return None
+    try:
+        return datetime.strptime(s, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+def encode_cursor(d, rid):
+    """将 (date, id) 编码为不透明的分页游标"""
+    raw = f"{d.strftime('%Y-%m-%d')}|{rid}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def encode_offset_cursor(offset):
+    """搜索结果按相关度排序，游标为结果中的偏移量"""
+    return base64.urlsafe_b64encode(f'@{offset}'.encode()).decode().rstrip('=')
+
+def decode_offset_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded).decode()
+        if not raw.startswith('@'):
+            raise ValueError
+        return int(raw[1:])
+    except Exception:
+        raise ValueError('无效的游标')
+
+def decode_cursor(cursor):
+    """encode_cursor 的逆操作，游标无效时抛出 ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        date_s, rid = base64.urlsafe_b64decode(padded).decode().split('|')
+        return datetime.strptime(date_s, '%Y-%m-%d').date(), int(rid)
+    except Exception:
+        raise ValueError('无效的游标')
+
+def parse_fields(fields_s):
+    """解析 fields=id,amount,date 形式的投影参数，未指定时返回全部字段"""
+    if not fields_s:
+        return list(RECORD_FIELDS)
+    fields = [f.strip() for f in fields_s.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in RECORD_FIELDS]
+    if unknown or not fields:
+        raise ValueError(f"未知字段: {','.join(unknown)}")
+    return fields
+
+def replica_behind(session):
+    """session 读的是副本且副本的账本版本落后于主库时返回 True
+
+    先读主库版本、再读副本版本：副本追上时，之后在同一事务中的查询至少包含主库此刻已提交的写入。
+    结果保存在 session.info 中，同一请求的条件请求和接口缓存只比较一次。
+    """
+    if replica_engine is None or session.get_bind() is not replica_engine:
+        return False
+    behind = session.info.get('replica_behind')
+    if behind is None:
+        primary = get_session(engine)
+        try:
+            latest = changelog.current_version(primary)
+        finally:
+            primary.close()
+        behind = session.info['replica_behind'] = changelog.current_version(session) < latest
+    return behind
+
+def cached(session, key, ranges, compute):
+    """从接口缓存读取，未命中时调用 compute() 计算并写入；ranges 为结果依赖的日期范围
+
+    从落后于主库的副本算出的结果照常返回，但不写入缓存，以免失效之后又缓存旧数据。
+    """
+    data = api_cache.get(key)
+    if data is None:
+        generation = api_cache.generation()
+        stale = replica_behind(session)
+        data = compute()
+        if not stale:
+            api_cache.set(key, data, ranges, generation)
+    return data
+
+def query_columns(fields):
+    """records_query 实际查询的列名，分页游标总是需要 id 和 date"""
+    return list(dict.fromkeys(['id', 'date'] + [FIELD_COLUMNS.get(f, f) for f in fields]))
+
+# 接口缓存对象 -> 已对齐到的账本版本，见 sync_api_cache()
+_cache_versions = weakref.WeakKeyDictionary()
+_cache_versions_lock = threading.Lock()
+
+def sync_api_cache(session, version):
+    """数据库中的账本版本比接口缓存已对齐的版本新时，按这些变更的日期范围使缓存失效
+
+    本进程的写接口提交后自己失效缓存；其他 worker（CACHE_BACKEND=memory 时）、命令行导入等不经过本进程的
+    写入只能从账本版本发现。外部修改把记录移到其他日期时旧日期的缓存不会失效，最多保留到缓存过期（ttl）。
+    """
+    cache = api_cache
+    with _cache_versions_lock:
+        seen = _cache_versions.get(cache)
+        if seen is not None and version <= seen:
+            return
+        _cache_versions[cache] = version
+    if seen is None:
+        # 缓存创建后第一次读取，其中还没有更早版本的结果
+        return
+    summary = changelog.change_summary(session, seen, max_ids=0)
+    if summary['start'] is not None:
+        cache.invalidate_range(summary['start'], summary['end'])
+
+def conditional(view):
+    """读接口的条件请求
+
+    ETag 由数据库中的账本版本（每个写事务递增，见 changelog.py）和请求路径、查询参数生成，
+    其他 worker 或不经过本进程的写入同样会改变 ETag；客户端带 If-None-Match 且账本未变化时
+    只查询一次版本号就返回 304，不执行查询也不序列化。
+    读的是落后于主库的副本时不返回 ETag 也不返回 304，并禁止缓存响应：副本上的旧结果不能被当作当前版本保存。
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        session = request_session()
+        if replica_behind(session):
+            resp = make_response(view(*args, **kwargs))
+            resp.headers['Cache-Control'] = 'no-store'
+            return resp
+        # 在查询之前取版本：查询期间发生写操作时，下次请求的 ETag 不同，不会误返回 304
+        version = changelog.current_version(session)
+        sync_api_cache(session, version)
+        raw = f'{version}|{request.full_path}'
+        etag = hashlib.sha1(raw.encode()).hexdigest()[:20]
+        if request.if_none_match.contains_weak(etag):
+            resp = make_response('', 304)
+        else:
+            resp = make_response(view(*args, **kwargs))
+            if resp.status_code != 200:
+                return resp
+        resp.set_etag(etag)
+        # 允许浏览器保存响应，但每次使用前都要带 ETag 向服务器确认
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp
+    return wrapper
+
+def records_query(session, s, e, category, cursor, fields, table=None, text=None):
+    """按过滤条件和游标构造记录查询，只查询需要的列，避免构造完整的 Record 对象
+
+    table 为要查询的记录表，默认 records；已归档的年份见 partitions.tables()。
+    text 为搜索词时只返回全文索引匹配的记录，多查询一列 score，按相关度倒序（见 search.py）。
+    SQLite 上没有日期范围时只对最新的 SEARCH_WINDOW 条匹配记录（按 id）计算相关度：FTS5 对每条匹配记录计算 bm25，
+    常见词在百万条的账本中有数万条匹配，全部计算要 200 毫秒以上；有日期范围时只计算范围内的记录，不再限制。
+    """
+    t = (Record.__table__ if table is None else table).c
+    q = session.query(*[t[c] for c in query_columns(fields)])
+    if s:
+        q = q.filter(t.date >= s)
+    if e:
+        q = q.filter(t.date <= e)
+    if category:
+        # 按整数 id 过滤；不存在的分类没有记录
+        q = q.filter(t.category_id == category_cache.id(session, category, create=False))
+    if cursor:
+        cd, cid = cursor
+        # date <= cd 让数据库可以直接在索引上定位起点，而不是从头扫描
+        q = q.filter(t.date <= cd, or_(t.date < cd, t.id < cid))
+    if text:
+        fts, condition, score = search.match_clause(session, text)
+        q = q.add_columns(score.label('score')).join(fts, fts.c.record_id == t.id).filter(condition)
+        window = app.config.get('SEARCH_WINDOW', 10000)
+        if window and not (s or e) and session.get_bind().dialect.name == 'sqlite':
+            # 第 window 新的匹配记录的 id，FTS5 按 rowid 倒序读取匹配结果，读到第 window 条即停止；
+            # 再以 rowid 下限过滤，bm25 只对下限之上的记录计算。匹配不足 window 条时不限制
+            newest = (q.with_entities(fts.c.record_id).order_by(fts.c.record_id.desc())
+                      .offset(window - 1).limit(1).scalar())
+            if newest is not None:
+                q = q.filter(fts.c.record_id >= newest)
+        return q.order_by(score.desc(), t.date.desc(), t.id.desc())
+    return q.order_by(t.date.desc(), t.id.desc())
+
+def records_tables(session, s, e, cursor=None):
+    """与查询区间有交集的记录表，从新到旧；游标之后的记录不晚于游标日期"""
+    if cursor and (e is None or cursor[0] < e):
+        e = cursor[0]
+    return partitions.tables(session, s, e)
+
+def records_page(session, s, e, category, cursor, limit, fields):
+    """一页记录及下一页游标，结果会被缓存（单页大小有上限，完整列表不缓存）"""
+    def compute():
+        # 多取一行用于判断是否还有下一页；当前表不够一页时接着查更早年份的表
+        rows = []
+        for table in records_tables(session, s, e, cursor):
+            rows += records_query(session, s, e, category, cursor, fields, table).limit(limit + 1 - len(rows)).all()
+            if len(rows) > limit:
+                break
+        rows_returned.observe(len(rows), (('query', 'records'),))
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].date, rows[-1].id)
+        return {
+            'items': [record_to_dict(r, fields) for r in rows],
+            'next_cursor': next_cursor,
+            'limit': limit
+        }
+    return cached(session, ('records', s, e, category, cursor, limit, tuple(fields)), [(s, e)], compute)
+
+def search_page(session, s, e, category, text, offset, limit, fields):
+    """按相关度排序的一页搜索结果及下一页游标，结果会被缓存"""
+    def compute():
+        tables = records_tables(session, s, e)
+        if len(tables) == 1:
+            rows = records_query(session, s, e, category, None, fields, tables[0], text).offset(offset).limit(limit + 1).all()
+        else:
+            # 各表分别取前 offset + limit + 1 条，合并后按同样的顺序截取
+            rows = [r for table in tables
+                    for r in records_query(session, s, e, category, None, fields, table, text).limit(offset + limit + 1)]
+            rows = sorted(rows, key=lambda r: (-r.score, -r.date.toordinal(), -r.id))[offset:offset + limit + 1]
+        rows_returned.observe(len(rows), (('query', 'search'),))
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_offset_cursor(offset + limit)
+        return {
+            'items': [record_to_dict(r, fields) for r in rows],
+            'next_cursor': next_cursor,
+            'limit': limit
+        }
+    return cached(session, ('search', text, s, e, category, offset, limit, tuple(fields)), [(s, e)], compute)
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/api/records', methods=['GET'])
+@conditional
 def list_records():
-    session = get_session(engine)
-    start = request.args.get('start')
-    end = request.args.get('end')
-    category = request.args.get('category')
-    q = session.query(Record)
-    if start:
-        try:
-            s = datetime.strptime(start, '%Y-%m-%d').date()
-            q = q.filter(Record.date >= s)
-        except:
-            pass
-    if end:
-        try:
-            e = datetime.strptime(end, '%Y-%m-%d').date()
-            q = q.filter(Record.date <= e)
-        except:
-            pass
-    if category:
-        q = q.filter(Record.category == category)
-    rows = q.order_by(Record.date.desc()).all()
-    data = [record_to_dict(r) for r in rows]
-    session.close()
+    """记录列表，按 (date, id) 倒序
+
+    传入 limit 或 cursor 时启用游标分页，返回 {'items': [...], 'next_cursor': ...}；
+    否则保持原有行为，直接返回完整列表。fields= 可只查询需要的列。
+    q= 按备注和分类名称全文搜索（多个词以空格分隔，需全部出现），结果按相关度排序并总是分页，
+    可与 start/end/category 组合。
+    """
+    args = request.args
+    text = args.get('q', '').strip()
+    paginate = 'limit' in args or 'cursor' in args or bool(text)
+    try:
+        fields = parse_fields(args.get('fields'))
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        if text:
+            if not search.terms(text):
+                raise ValueError('搜索词不能为空')
+            offset = decode_offset_cursor(args['cursor']) if args.get('cursor') else 0
+        else:
+            cursor = decode_cursor(args['cursor']) if args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({'error': '参数错误', 'detail': str(e)}), 400
+
+    s = parse_date(args.get('start'))
+    e = parse_date(args.get('end'))
+    category = args.get('category')
+
+    session = request_session()
+    if not paginate:
+        rows = [r for table in records_tables(session, s, e)
+                for r in records_query(session, s, e, category, None, fields, table).all()]
+        rows_returned.observe(len(rows), (('query', 'records'),))
+        return jsonify([record_to_dict(r, fields) for r in rows])
+
+    if text:
+        data = search_page(session, s, e, category, text, offset, limit, fields)
+    else:
+        data = records_page(session, s, e, category, cursor, limit, fields)
     return jsonify(data)
 
+def export_chunks(s, e, category, fields, chunk_size):
+    """通过服务端游标逐块读取记录，每块最多 chunk_size 行，内存占用与导出总量无关
+
+    生成器在响应发送过程中执行，此时请求已结束，因此使用自己的会话并在结束（包括客户端断开）时关闭。
+    """
+    session = get_session(engine)
+    try:
+        for table in records_tables(session, s, e):
+            stmt = records_query(session, s, e, category, None, fields, table).statement
+            result = session.execute(stmt, execution_options={'yield_per': chunk_size})
+            for rows in result.partitions():
+                yield rows
+    finally:
+        session.close()
+
+def export_csv(chunks, fields):
+    # 带 BOM，Excel 可以直接打开中文；导出的文件可以原样用 /api/import 导回
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write('\ufeff')
+    writer.writerow(fields)
+    # 除金额和分类外各列的 str() 与 RECORD_FIELDS 的输出一致（日期为 YYYY-MM-DD，None 写为空），
+    # 直接按位置取值，不必逐个字段调用格式化函数
+    columns = query_columns(fields)
+    positions = [columns.index(FIELD_COLUMNS.get(f, f)) for f in fields]
+    convert = {i: format_cents if f == 'amount' else category_cache.name
+               for f, i in zip(fields, positions) if f in FIELD_COLUMNS}
+    for rows in chunks:
+        writer.writerows([convert[i](r[i]) if i in convert else r[i] for i in positions] for r in rows)
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+def export_ndjson(chunks, fields):
+    for rows in chunks:
+        yield ''.join(json.dumps(record_to_dict(r, fields), ensure_ascii=False) + '\n' for r in rows).encode()
+
+def export_columnar(chunks, fields):
+    """按列存储的行组，类似 Parquet：第一行是字段列表，之后每行是一个行组 {rows, columns: {字段: [值, ...]}}"""
+    yield (json.dumps({'format': 'columnar', 'fields': fields}) + '\n').encode()
+    for rows in chunks:
+        columns = {f: [RECORD_FIELDS[f](r) for r in rows] for f in fields}
+        yield (json.dumps({'rows': len(rows), 'columns': columns}, ensure_ascii=False) + '\n').encode()
+
+EXPORT_FORMATS = {
+    'csv': (export_csv, 'text/csv', 'csv'),
+    'ndjson': (export_ndjson, 'application/x-ndjson', 'ndjson'),
+    'columnar': (export_columnar, 'application/x-ndjson', 'columnar.ndjson'),
+}
+
+@app.route('/api/export', methods=['GET'])
+def export_records():
+    """流式导出记录，format=csv|ndjson|columnar，过滤条件与 /api/records 相同，按 (date, id) 倒序
+
+    行从服务端游标分块读出后立即写入响应，第一个字节不必等待全部查询完成，
+    worker 内存占用与账本大小无关。fields= 可只导出部分字段。
+    """
+    args = request.args
+    fmt = args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': '参数错误', 'detail': f'不支持的导出格式: {fmt}'}), 400
+    try:
+        fields = parse_fields(args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': '参数错误', 'detail': str(e)}), 400
+    s = parse_date(args.get('start'))
+    e = parse_date(args.get('end'))
+    category = args.get('category')
+
+    writer, mimetype, ext = EXPORT_FORMATS[fmt]
+    chunks = export_chunks(s, e, category, fields, EXPORT_CHUNK_SIZE)
+    return Response(writer(chunks, fields), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=records.{ext}',
+        # 让反向代理（如 nginx）边收边发，不缓冲整个响应
+        'X-Accel-Buffering': 'no',
+    })
+
+# 增量同步每次最多返回的记录数
+DEFAULT_CHANGES_LIMIT = 1000
+MAX_CHANGES_LIMIT = 5000
+
+@app.route('/api/changes', methods=['GET'])
+@conditional
+def list_changes():
+    """增量同步：返回账本版本 since 之后新增、修改和删除的记录
+
+    返回 {'version', 'records', 'deleted', 'more'}。records 带各自的 version；deleted 为
+    [{'id', 'version'}]，客户端按版本先后应用（墓碑版本大于本地副本版本时才删除）。
+    下次请求以返回的 version 作为 since；more 为 true 时说明还有未返回的变更，应立即继续请求。
+    since 为 0 或缺省时返回全部记录，可用于首次加载。
+    """
+    try:
+        since = int(request.args.get('since', 0))
+        limit = int(request.args.get('limit', DEFAULT_CHANGES_LIMIT))
+        limit = max(1, min(limit, MAX_CHANGES_LIMIT))
+    except ValueError as e:
+        return jsonify({'error': '参数错误', 'detail': str(e)}), 400
+    fields = list(RECORD_FIELDS)
+    columns = [getattr(Record, c) for c in query_columns(fields)] + [Record.version]
+    session = request_session()
+    version, rows, deleted, more = changelog.changes_since(session, since, limit, columns)
+    rows_returned.observe(len(rows), (('query', 'changes'),))
+    return jsonify({
+        'version': version,
+        'records': [dict(record_to_dict(r, fields), version=r.version) for r in rows],
+        'deleted': [{'id': rid, 'version': v} for rid, v in deleted],
+        'more': more
+    })
+
 @app.route('/api/record', methods=['POST'])
 def add_record():
     payload = request.json or {}
     try:
-        t = payload.get('type')
-        amount = float(payload.get('amount'))
-        category = payload.get('category') or '未分类'
-        date_s = payload.get('date')
-        d = datetime.strptime(date_s, '%Y-%m-%d').date() if date_s else datetime.today().date()
-    except Exception as e:
+        values = ingest.parse_record(payload)
+    except ValueError as e:
         return jsonify({'error': '参数错误', 'detail': str(e)}), 400
-    note = payload.get('note')
-    session = get_session(engine)
-    rec = Record(type=t, amount=amount, category=category, date=d, note=note)
+    if write_behind is not None:
+        # 等待所在批次提交后再返回，提交失败时异常在这里抛出
+        try:
+            rec = write_behind.submit(values).result()
+        except writebehind.QueueFull as e:
+            return jsonify({'error': '服务繁忙', 'detail': str(e)}), 503, {'Retry-After': '1'}
+        except ValueError as e:
+            # 写入线程中的校验（如已归档的年份）
+            return jsonify({'error': '参数错误', 'detail': str(e)}), 400
+        return jsonify(record_to_dict(rec)), 201
+    session = request_session()
+    try:
+        partitions.check_writable(session, values['date'])
+    except ValueError as e:
+        return jsonify({'error': '参数错误', 'detail': str(e)}), 400
+    category = values.pop('category')
+    values['category_id'] = category_cache.id(session, category)
+    rec = Record(**values, version=changelog.next_version(session))
     session.add(rec)
+    rollup.record_added(session, rec)
+    session.flush()
+    search.add_to_index(session, [(rec.id, rec.note, category)])
     session.commit()
+    api_cache.invalidate(rec.date)
+    broadcaster.notify()
     data = record_to_dict(rec)
-    session.close()
     return jsonify(data), 201
 
+def iter_bulk_payloads():
+    """逐条产出批量请求中的 (序号, 记录)，NDJSON 请求体按行流式读取，不整体载入内存"""
+    if request.mimetype in NDJSON_MIMETYPES:
+        index = 0
+        # request.stream 按行迭代时逐字节读取，套一层缓冲
+        for line in io.BufferedReader(request.stream, 1 << 16):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield index, json.loads(line)
+            except ValueError as e:
+                yield index, e
+            index += 1
+        return
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, list):
+        raise ValueError('请求体应为 JSON 数组或 NDJSON')
+    yield from enumerate(payload)
+
+@app.route('/api/records/bulk', methods=['POST'])
+def bulk_add_records():
+    """批量新增记录，请求体为 JSON 数组或 NDJSON（Content-Type: application/x-ndjson）
+
+    每行按 add_record 的规则校验，校验失败的行记入 errors 并跳过，不影响其他行；
+    通过校验的行每 BULK_CHUNK_SIZE 条用一次 executemany 写入并提交一个事务，全文索引在最后一批之后一次补齐。
+    """
+    chunk_size = app.config.get('BULK_CHUNK_SIZE', 20000)
+    inserted = 0
+    errors = []
+    chunk, chunk_index = [], []
+    # 先查出已归档的年份并结束事务，逐行检查时不再访问数据库，解析请求体期间不占用写锁
+    session = request_session()
+    partitions.archived(session)
+    after = ingest.last_record_id(session)
+    session.commit()
+
+    def flush():
+        nonlocal inserted
+        session = request_session()
+        try:
+            span = ingest.insert_batch(session, chunk, index=False)
+            session.commit()
+        except ValueError as e:
+            session.rollback()
+            errors.extend({'index': i, 'error': str(e)} for i in chunk_index)
+            return
+        except Exception:
+            # 数据库异常的文本包含 SQL 和整批参数，只写入日志
+            session.rollback()
+            app.logger.exception('批量写入失败（%d 条）', len(chunk))
+            errors.extend({'index': i, 'error': '写入失败'} for i in chunk_index)
+            return
+        inserted += len(chunk)
+        api_cache.invalidate_range(*span)
+        broadcaster.notify()
+
+    try:
+        for index, item in iter_bulk_payloads():
+            try:
+                if isinstance(item, Exception):
+                    raise ValueError(str(item))
+                values = ingest.parse_record(item)
+                partitions.check_writable(session, values['date'])
+                chunk.append(values)
+                chunk_index.append(index)
+            except ValueError as e:
+                errors.append({'index': index, 'error': str(e)})
+                continue
+            if len(chunk) >= chunk_size:
+                flush()
+                chunk, chunk_index = [], []
+    except ValueError as e:
+        return jsonify({'error': '参数错误', 'detail': str(e)}), 400
+    if chunk:
+        flush()
+    if inserted:
+        session = request_session()
+        try:
+            ingest.index_pending(session, after)
+            session.commit()
+        except Exception:
+            # 记录已经提交，只是暂时搜索不到；重新执行 migrate.py 会补齐索引
+            session.rollback()
+            app.logger.exception('批量写入后补齐全文索引失败')
+
+    return jsonify({'inserted': inserted, 'failed': len(errors), 'errors': errors})
+
+@app.route('/api/import', methods=['POST'])
+def import_records():
+    """流式导入 CSV / NDJSON 文件（银行流水等），请求体为文件原始内容
+
+    参数：format=csv|ndjson（缺省时按 Content-Type 判断），source 断点名称（默认 api），
+    resume=1 从该 source 上次提交的位置继续（需重新上传完整文件，已导入部分只读取不解析），
+    encoding 文件编码（默认 utf-8）。请求体逐行读取，每 BULK_CHUNK_SIZE 条一个事务。
+    """
+    args = request.args
+    fmt = args.get('format')
+    if not fmt:
+        fmt = 'csv' if request.mimetype in CSV_MIMETYPES else 'ndjson' if request.mimetype in NDJSON_MIMETYPES else None
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'error': '参数错误', 'detail': '请通过 format=csv|ndjson 或 Content-Type 指定文件格式'}), 400
+
+    def on_batch(result, span):
+        if span:
+            api_cache.invalidate_range(*span)
+            broadcaster.notify()
+        app.logger.info('导入 %s：已提交 %d 条，偏移 %d，%d 行/秒',
+                        result['source'], result['inserted'], result['offset'], result['rows_per_sec'])
+
+    try:
+        result = ingest.import_stream(
+            writer_engine(engine), io.BufferedReader(request.stream, 1 << 16), fmt,
+            source=args.get('source') or 'api',
+            resume=args.get('resume') == '1',
+            batch_size=app.config.get('BULK_CHUNK_SIZE', 20000),
+            encoding=args.get('encoding') or 'utf-8',
+            on_batch=on_batch
+        )
+    except (LookupError, UnicodeDecodeError) as e:
+        return jsonify({'error': '导入中断', 'detail': f'文件编码错误: {e}，已提交的部分可用 resume=1 继续'}), 400
+    except Exception:
+        # 数据库异常的文本包含 SQL 和参数，只写入日志
+        app.logger.exception('导入 %s 中断', args.get('source') or 'api')
+        return jsonify({'error': '导入中断', 'detail': '写入失败，已提交的部分可用 resume=1 继续'}), 500
+    return jsonify(result)
+
+def writable_record(session, rid):
+    """修改、删除前取出记录，返回 (记录, 错误响应)；已归档年份的记录不能修改"""
+    rec = session.get(Record, rid)
+    year = partitions.archived_year_of(session, rid) if rec is None else rec.date.year
+    if rec is None and year is None:
+        return None, (jsonify({'error': '记录未找到'}), 404)
+    try:
+        partitions.check_writable(session, datetime(year, 1, 1).date())
+    except ValueError as e:
+        return None, (jsonify({'error': '参数错误', 'detail': str(e)}), 400)
+    return rec, None
+
 @app.route('/api/record/<int:rid>', methods=['PUT'])
 def update_record(rid):
     payload = request.json or {}
-    session = get_session(engine)
-    rec = session.get(Record, rid)
-    if not rec:
-        session.close()
-        return jsonify({'error': '记录未找到'}), 404
+    session = request_session()
+    rec, error = writable_record(session, rid)
+    if error:
+        return error
+    old = rollup.snapshot(rec)
     if 'type' in payload:
         rec.type = payload['type']
     if 'amount' in payload:
-        rec.amount = float(payload['amount'])
+        try:
+            rec.amount_cents = to_cents(payload['amount'])
+        except ValueError as e:
+            return jsonify({'error': '参数错误', 'detail': str(e)}), 400
+    # 新建的分类提交后才进入缓存，修改了分类时全文索引使用请求中的名称
+    category = None
     if 'category' in payload:
-        rec.category = payload['category']
+        category = payload['category'] or '未分类'
+        rec.category_id = category_cache.id(session, category)
     if 'date' in payload:
-        rec.date = datetime.strptime(payload['date'], '%Y-%m-%d').date()
+        new_date = datetime.strptime(payload['date'], '%Y-%m-%d').date()
+        try:
+            partitions.check_writable(session, new_date)
+        except ValueError as e:
+            return jsonify({'error': '参数错误', 'detail': str(e)}), 400
+        rec.date = new_date
     if 'note' in payload:
         rec.note = payload['note']
+    rec.version = changelog.next_version(session)
+    rollup.record_updated(session, old, rec)
+    if 'note' in payload or 'category' in payload:
+        category = category or category_cache.name(rec.category_id)
+        search.add_to_index(session, [(rid, rec.note, category)], replace=True)
     session.commit()
+    api_cache.invalidate(old['date'], rec.date)
+    broadcaster.notify()
     data = record_to_dict(rec)
-    session.close()
     return jsonify(data)
 
 @app.route('/api/record/<int:rid>', methods=['DELETE'])
 def delete_record(rid):
-    session = get_session(engine)
-    rec = session.get(Record, rid)
-    if not rec:
-        session.close()
-        return jsonify({'error': '记录未找到'}), 404
+    session = request_session()
+    rec, error = writable_record(session, rid)
+    if error:
+        return error
+    rollup.record_removed(session, rec)
+    changelog.record_deleted(session, rec, changelog.next_version(session))
     session.delete(rec)
     session.commit()
-    session.close()
+    api_cache.invalidate(rec.date)
+    broadcaster.notify()
     return jsonify({'result': 'deleted'})
 
-@app.route('/api/stats', methods=['GET'])
-def stats():
-    # 返回按分类的支出/收入汇总，以及月度结余（简单示例）
-    session = get_session(engine)
-    start = request.args.get('start')
-    end = request.args.get('end')
-    
-    # 构建基础查询
-    q = session.query(Record)
-    if start:
-        try:
-            s = datetime.strptime(start, '%Y-%m-%d').date()
-            q = q.filter(Record.date >= s)
-        except:
-            pass
-    if end:
-        try:
-            e = datetime.strptime(end, '%Y-%m-%d').date()
-            q = q.filter(Record.date <= e)
-        except:
-            pass
-    
-    # 按分类求和（包含类型）
-    cat_rows = session.query(
-        Record.category, 
-        Record.type,
-        func.sum(Record.amount).label('total')
-    )
-    if start:
-        try:
-            s = datetime.strptime(start, '%Y-%m-%d').date()
-            cat_rows = cat_rows.filter(Record.date >= s)
-        except: pass
-    if end:
-        try:
-            e = datetime.strptime(end, '%Y-%m-%d').date()
-            cat_rows = cat_rows.filter(Record.date <= e)
-        except: pass
-    
-    cat_rows = cat_rows.group_by(Record.category, Record.type).all()
-    categories = [{'category': r[0], 'type': r[1], 'total': r[2]} for r in cat_rows]
-    
-    # 按日期统计
-    daily_rows = session.query(
-        Record.date,
-        Record.type,
-        func.sum(Record.amount).label('total')
-    )
-    if start:
-        try:
-            s = datetime.strptime(start, '%Y-%m-%d').date()
-            daily_rows = daily_rows.filter(Record.date >= s)
-        except: pass
-    if end:
-        try:
-            e = datetime.strptime(end, '%Y-%m-%d').date()
-            daily_rows = daily_rows.filter(Record.date <= e)
-        except: pass
-    
-    daily_rows = daily_rows.group_by(Record.date, Record.type).all()
-    daily_stats = {}
-    for row in daily_rows:
-        date_str = row[0].strftime('%Y-%m-%d')
-        if date_str not in daily_stats:
-            daily_stats[date_str] = {'income': 0, 'expense': 0}
-        if row[1] == 'income':
-            daily_stats[date_str]['income'] = row[2]
-        else:
-            daily_stats[date_str]['expense'] = row[2]
-    
-    # 月度结余（当前月份为示例）
-    today = datetime.today()
-    year = int(request.args.get('year', today.year))
-    month = int(request.args.get('month', today.month))
+def month_range(year, month):
+    """返回某月的 [第一天, 下月第一天)"""
     start_m = datetime(year, month, 1).date()
     if month == 12:
         next_first = datetime(year+1, 1, 1).date()
     else:
         next_first = datetime(year, month+1, 1).date()
-    
-    month_rows = session.query(Record).filter(Record.date >= start_m, Record.date < next_first).all()
-    income = sum(r.amount for r in month_rows if r.type == 'income')
-    expense = sum(r.amount for r in month_rows if r.type == 'expense')
-    balance = income - expense
-    
-    session.close()
-    
-    return jsonify({
-        'by_category': categories,
+    return start_m, next_first
+
+def totals_by_type(session, start, end_exclusive):
+    """在 SQL 中按类型汇总 [start, end_exclusive) 区间的金额（分），最多返回两行"""
+    snapshot = columnar_snapshot()
+    if snapshot is not None:
+        return snapshot.totals_by_type(start, end_exclusive)
+    rows = session.query(
+        DailyTotal.type,
+        func.sum(DailyTotal.total_cents)
+    ).filter(
+        DailyTotal.date >= start,
+        DailyTotal.date < end_exclusive
+    ).group_by(DailyTotal.type).all()
+    # MySQL 对整数列 SUM 返回 DECIMAL，统一转为 int
+    totals = {t: int(total or 0) for t, total in rows}
+    return totals.get('income', 0), totals.get('expense', 0)
+
+def monthly_totals(session, year):
+    """按 (月份, 类型) 分组汇总全年金额（分），最多 24 行，返回 {月份: {'income', 'expense'}}"""
+    # 已归档的年份读取归档时冻结的汇总
+    frozen = partitions.frozen_monthly_totals(session, year)
+    if frozen is not None:
+        return frozen
+    snapshot = columnar_snapshot()
+    if snapshot is not None:
+        return snapshot.monthly_totals(year)
+    month_col = extract('month', DailyTotal.date)
+    rows = session.query(
+        month_col,
+        DailyTotal.type,
+        func.sum(DailyTotal.total_cents)
+    ).filter(
+        DailyTotal.date >= datetime(year, 1, 1).date(),
+        DailyTotal.date < datetime(year+1, 1, 1).date()
+    ).group_by(month_col, DailyTotal.type).all()
+    months = {m: {'income': 0, 'expense': 0} for m in range(1, 13)}
+    for m, t, total in rows:
+        if t in ('income', 'expense'):
+            months[int(m)][t] = int(total or 0)
+    return months
+
+def range_stats(session, s, e):
+    """筛选区间内按分类和按日期的汇总，读取日汇总表"""
+    def compute():
+        snapshot = columnar_snapshot()
+        if snapshot is not None:
+            return columnar_range_stats(snapshot, s, e)
+        # 按分类 id 求和（包含类型），输出时换成名称
+        cat_rows = session.query(
+            DailyTotal.category_id,
+            DailyTotal.type,
+            func.sum(DailyTotal.total_cents).label('total')
+        )
+        if s:
+            cat_rows = cat_rows.filter(DailyTotal.date >= s)
+        if e:
+            cat_rows = cat_rows.filter(DailyTotal.date <= e)
+        
+        cat_rows = cat_rows.group_by(DailyTotal.category_id, DailyTotal.type).all()
+        rows_returned.observe(len(cat_rows), (('query', 'stats_by_category'),))
+        by_category = [{'category': category_cache.name(r[0]), 'type': r[1], 'total': format_cents(r[2])}
+                       for r in cat_rows]
+        
+        # 按日期统计
+        daily_rows = session.query(
+            DailyTotal.date,
+            DailyTotal.type,
+            func.sum(DailyTotal.total_cents).label('total')
+        )
+        if s:
+            daily_rows = daily_rows.filter(DailyTotal.date >= s)
+        if e:
+            daily_rows = daily_rows.filter(DailyTotal.date <= e)
+        
+        daily_rows = daily_rows.group_by(DailyTotal.date, DailyTotal.type).all()
+        rows_returned.observe(len(daily_rows), (('query', 'stats_daily'),))
+        daily_stats = {}
+        for row in daily_rows:
+            date_str = row[0].strftime('%Y-%m-%d')
+            if date_str not in daily_stats:
+                daily_stats[date_str] = {'income': '0.00', 'expense': '0.00'}
+            if row[1] == 'income':
+                daily_stats[date_str]['income'] = format_cents(row[2])
+            else:
+                daily_stats[date_str]['expense'] = format_cents(row[2])
+        return {'by_category': by_category, 'daily_stats': daily_stats}
+    return cached(session, ('range-stats', s, e), [(s, e)], compute)
+
+def columnar_range_stats(snapshot, s, e):
+    """range_stats 的列式实现，输出格式与 SQL 版本相同"""
+    by_category, daily = snapshot.range_stats(s, e)
+    daily_stats = {}
+    for day, totals in sorted(daily.items()):
+        daily_stats[day.strftime('%Y-%m-%d')] = {
+            'income': format_cents(totals.get('income', 0)),
+            # 与 SQL 版本一致：非 income 的类型都记在 expense 下
+            'expense': format_cents(next((v for t, v in totals.items() if t != 'income'), 0)),
+        }
+    return {
+        'by_category': [{'category': category_cache.name(c), 'type': t, 'total': format_cents(total)}
+                        for c, t, total in by_category],
         'daily_stats': daily_stats,
-        'month_summary': {
+    }
+
+def month_summary(session, year, month):
+    """某月的收入、支出和结余"""
+    start_m, next_first = month_range(year, month)
+    def compute():
+        income, expense = totals_by_type(session, start_m, next_first)
+        return {
             'year': year, 
             'month': month, 
-            'income': income, 
-            'expense': expense, 
-            'balance': balance
+            'income': format_cents(income), 
+            'expense': format_cents(expense), 
+            'balance': format_cents(income - expense)
         }
-    })
+    return cached(session, ('month-summary', year, month), [(start_m, next_first - timedelta(days=1))], compute)
+
+def compute_year_stats(session, year):
+    """某年的收支汇总及每月明细（不经过缓存）"""
+    # 按月统计，全年汇总由各月相加得到；以分为单位求和，输出时才转为字符串
+    months = monthly_totals(session, year)
+    monthly_stats = {}
+    for m, totals in months.items():
+        monthly_stats[m] = {
+            'income': format_cents(totals['income']),
+            'expense': format_cents(totals['expense']),
+            'balance': format_cents(totals['income'] - totals['expense'])
+        }
+    income = sum(t['income'] for t in months.values())
+    expense = sum(t['expense'] for t in months.values())
+    return {
+        'year': year,
+        'income': format_cents(income),
+        'expense': format_cents(expense),
+        'balance': format_cents(income - expense),
+        'monthly_stats': monthly_stats
+    }
+
+def year_summary(session, year):
+    """某年的收支汇总及每月明细"""
+    return cached(session, ('year-stats', year), [(datetime(year, 1, 1).date(), datetime(year, 12, 31).date())],
+                  lambda: compute_year_stats(session, year))
+
+@app.route('/api/stats', methods=['GET'])
+@conditional
+def stats():
+    # 返回按分类的支出/收入汇总，以及月度结余（简单示例）
+    s = parse_date(request.args.get('start'))
+    e = parse_date(request.args.get('end'))
+    today = datetime.today()
+    year = int(request.args.get('year', today.year))
+    month = int(request.args.get('month', today.month))
+    
+    # 各部分命中缓存时只有 conditional 读取账本版本的一次查询
+    session = request_session()
+    data = dict(range_stats(session, s, e))
+    data['month_summary'] = month_summary(session, year, month)
+    return jsonify(data)
 
 @app.route('/api/year-stats', methods=['GET'])
+@conditional
 def year_stats():
     """年度统计"""
-    session = get_session(engine)
     today = datetime.today()
     year = int(request.args.get('year', today.year))
-    
-    # 该年度的所有记录
-    start_year = datetime(year, 1, 1).date()
-    end_year = datetime(year, 12, 31).date()
-    
-    year_rows = session.query(Record).filter(
-        Record.date >= start_year, 
-        Record.date <= end_year
-    ).all()
-    
-    income = sum(r.amount for r in year_rows if r.type == 'income')
-    expense = sum(r.amount for r in year_rows if r.type == 'expense')
-    balance = income - expense
-    
-    # 按月统计
-    monthly_stats = {}
-    for m in range(1, 13):
-        if m == 12:
-            next_first = datetime(year+1, 1, 1).date()
+    session = request_session()
+    data = year_summary(session, year)
+    return jsonify(data)
+
+@app.route('/api/dashboard', methods=['GET'])
+@conditional
+def dashboard():
+    """首页一次刷新所需的全部数据，替代分别请求记录、区间统计、月度结余和年度统计
+
+    参数：start/end 筛选区间，month=YYYY-MM 月度结余的月份，year 年度统计的年份，
+    limit 记录首页条数。所有部分在同一个会话中计算，并复用各自的缓存。
+    version 为当前账本版本，之后可通过 /api/changes 增量更新记录。
+    """
+    args = request.args
+    today = datetime.today()
+    try:
+        year = int(args.get('year', today.year))
+        if args.get('month'):
+            m = datetime.strptime(args['month'], '%Y-%m')
+            month_year, month = m.year, m.month
         else:
-            next_first = datetime(year, m+1, 1).date()
-        start_m = datetime(year, m, 1).date()
-        
-        month_rows = [r for r in year_rows if start_m <= r.date < next_first]
-        m_income = sum(r.amount for r in month_rows if r.type == 'income')
-        m_expense = sum(r.amount for r in month_rows if r.type == 'expense')
-        monthly_stats[m] = {
-            'income': m_income,
-            'expense': m_expense,
-            'balance': m_income - m_expense
-        }
-    
-    session.close()
-    
+            month_year, month = today.year, today.month
+        limit = max(1, min(int(args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE))
+    except ValueError as e:
+        return jsonify({'error': '参数错误', 'detail': str(e)}), 400
+    s = parse_date(args.get('start'))
+    e = parse_date(args.get('end'))
+
+    session = request_session()
+    data = range_stats(session, s, e)
+    year_data = year_summary(session, year)
+    if month_year == year:
+        # 同一年的月度结余直接取年度统计中的该月，不再单独查询
+        month_data = dict(year_data['monthly_stats'][month], year=year, month=month)
+    else:
+        month_data = month_summary(session, month_year, month)
+    fields = list(RECORD_FIELDS)
+    records = records_page(session, s, e, None, None, limit, fields)
+    # 客户端之后用 /api/changes?since=version 增量更新
+    version = changelog.current_version(session)
+
     return jsonify({
-        'year': year,
-        'income': income,
-        'expense': expense,
-        'balance': balance,
-        'monthly_stats': monthly_stats
+        'records': records,
+        'by_category': data['by_category'],
+        'daily_stats': data['daily_stats'],
+        'month_summary': month_data,
+        'year_stats': year_data,
+        'version': version
     })
 
+# 一次推送中最多附带统计的年份数，大范围导入时只推送最近的几年
+EVENT_MAX_YEARS = 5
+
+def poll_ledger(since):
+    """SSE 广播线程的轮询函数：账本版本变化时返回变更概要和受影响年份的最新统计
+
+    统计直接读日汇总表而不经过接口缓存，多 worker 使用 memory 缓存后端时也不会推送过时的数字。
+    """
+    session = get_session(engine)
+    try:
+        version = changelog.current_version(session)
+        if since is None or version == since:
+            return version, None
+        data = changelog.change_summary(session, since)
+        data['version'] = version
+        years = {}
+        if data['start']:
+            first = max(data['start'].year, data['end'].year - EVENT_MAX_YEARS + 1)
+            for y in range(first, data['end'].year + 1):
+                years[y] = compute_year_stats(session, y)
+            data['start'] = data['start'].isoformat()
+            data['end'] = data['end'].isoformat()
+        data['years'] = years
+        return version, data
+    finally:
+        session.close()
+
+broadcaster = Broadcaster(poll_ledger, interval=app.config.get('EVENTS_POLL_INTERVAL', 1.0))
+
+@app.route('/api/events', methods=['GET'])
+def events():
+    """Server-Sent Events：记录变化时推送 change 事件
+
+    data 为 {version, changed, deleted, ids, start, end, years}，years 为受影响年份的年度统计
+    （与 /api/year-stats 格式相同）。连接时先发送 hello 事件告知当前版本；长时间没有事件时发送注释行保活。
+    """
+    q = broadcaster.subscribe()
+    heartbeat = app.config.get('EVENTS_HEARTBEAT', 15)
+
+    def stream():
+        try:
+            # 断线后浏览器 3 秒后自动重连
+            yield b'retry: 3000\n\n' + format_event('hello', {'version': broadcaster.version})
+            while True:
+                try:
+                    yield q.get(timeout=heartbeat)
+                except queue.Empty:
+                    # 客户端断开时写入失败，生成器随之关闭
+                    yield b': ping\n\n'
+        finally:
+            broadcaster.unsubscribe(q)
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus 文本格式的运行指标；设置了 METRICS_DIR 时为所有 worker 的合计"""
+    snapshot = metrics_store.collect() if metrics_store is not None else metrics_registry.snapshot()
+    # 命中率在合并之后计算，多 worker 时按总查找次数加权
+    counters = snapshot['counters']
+    hits = counters.get(metrics.series_key('ledger_cache_lookups_total', (('result', 'hit'),)), 0)
+    misses = counters.get(metrics.series_key('ledger_cache_lookups_total', (('result', 'miss'),)), 0)
+    snapshot['gauges'][metrics.series_key('ledger_cache_hit_ratio')] = round(hits / (hits + misses), 4) if hits + misses else 0
+    return Response(metrics_registry.render(snapshot), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache-stats', methods=['GET'])
+def cache_stats():
+    """接口缓存的命中/未命中/淘汰计数，用于压测时观察缓存效果"""
+    return jsonify(api_cache.stats())
+
 if __name__ == '__main__':
     # 开发环境运行
     app.run(host='0.0.0.0', port=5000, debug=True)
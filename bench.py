@@ -0,0 +1,403 @@
+"""
+接口基准与压测
+生成指定规模的合成账本（SQLite 文件），以混合读写负载驱动 /api/records、/api/stats、/api/year-stats、
+全文搜索 /api/records?q=（默认不包含，用 --mix 加上）和 /api/record（新增、修改、删除），按接口输出 p50/p95/p99 延迟、吞吐量和峰值 RSS（JSON）。
+结果中带有当前 git 提交，保存后可用 --compare 与另一次提交的结果对比。
+
+默认在进程内通过 Flask test client 发请求；--url 改为请求已启动的服务器（如 gunicorn），
+此时加 --server-pid 可统计服务器进程的 RSS。
+用法：
+    python bench.py --rows 100000 --requests 5000
+    python bench.py --rows 1000000 --db /tmp/ledger_1m.db --reuse --output before.json
+    python bench.py --rows 1000000 --db /tmp/ledger_1m.db --reuse --compare before.json --fail-above 1.2
+    python bench.py --url http://127.0.0.1:5000 --server-pid 1234 --duration 30
+    python bench.py --rows 1000000 --db /tmp/ledger_1m.db --reuse --mix search=100 --requests 2000
+    python bench.py --rows 1000000 --db /tmp/ledger_1m.db --reuse --requests 0 --bulk 200000
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from urllib.parse import quote, urlsplit
+
+from sqlalchemy import func, insert, select
+
+# app 导入时打印的数据库连接信息写到 stderr，stdout 只输出 JSON 结果
+with contextlib.redirect_stdout(sys.stderr):
+    import app as app_module
+import rollup
+import search
+from cache import MemoryCache
+from models import Base, Category, LedgerMeta, Record, dispose_engine, get_engine, get_session
+
+CATEGORIES = ['餐饮', '交通', '购物', '工资', '兼职', '娱乐', '医疗', '住房', '通讯', '教育']
+FIRST_DAY = date(2021, 1, 1)
+DAYS = 5 * 365
+# 合成备注的词汇，搜索词从中选取
+NOTE_WORDS = ['午饭', '晚饭', '咖啡', '地铁卡充值', '打车', '超市购物', '水果', '房租', '水电费', '话费',
+              '电影票', '买书', '体检', '药店', '健身卡', '工资', '奖金', '红包', '网购', '快递']
+# 各类操作的默认权重，search 默认为 0
+DEFAULT_MIX = {'records': 50, 'stats': 20, 'year-stats': 10, 'write': 20, 'search': 0}
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+def rss_bytes(pid=None):
+    """进程当前的常驻内存（字节），读取 /proc/<pid>/statm；非 Linux 系统返回本进程的峰值 RSS"""
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        if pid:
+            return None
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def generate_ledger(engine, rows, seed=42, batch=50000):
+    """写入 rows 条随机记录（5 年、10 个分类，约 20% 为收入，备注为一到两个常用词）并重建日汇总和全文索引，
+    返回用时（秒）"""
+    started = time.perf_counter()
+    Base.metadata.create_all(engine)
+    rnd = random.Random(seed)
+    with engine.begin() as conn:
+        if engine.dialect.name == 'sqlite':
+            # 只是生成测试数据，不需要每批落盘
+            conn.exec_driver_sql('PRAGMA synchronous = OFF')
+        conn.execute(insert(Category), [{'id': i + 1, 'name': n} for i, n in enumerate(CATEGORIES)])
+        conn.execute(insert(LedgerMeta), [{'id': 1, 'version': 1}])
+        done = 0
+        while done < rows:
+            n = min(batch, rows - done)
+            conn.execute(insert(Record), [{
+                'type': 'income' if rnd.random() < 0.2 else 'expense',
+                'amount_cents': rnd.randint(1, 500000),
+                'category_id': rnd.randint(1, len(CATEGORIES)),
+                'date': FIRST_DAY + timedelta(days=rnd.randrange(DAYS)),
+                'note': ' '.join(rnd.sample(NOTE_WORDS, rnd.randint(1, 2))),
+                'version': 1,
+            } for _ in range(n)])
+            done += n
+            print(f"\r生成记录 {done}/{rows}", end='', file=sys.stderr, flush=True)
+        print(file=sys.stderr)
+        if search.index_exists(conn):
+            search.index_rows(conn, Record.__table__)
+    rollup.rebuild(engine)
+    return time.perf_counter() - started
+
+def ledger_size(engine):
+    session = get_session(engine)
+    try:
+        return session.execute(select(func.count(Record.id))).scalar()
+    finally:
+        session.close()
+
+class Workload:
+    """按权重随机生成请求；写操作只修改、删除本次基准新增的记录，账本规模保持稳定"""
+
+    def __init__(self, mix, seed):
+        self.ops = list(mix)
+        self.weights = [mix[op] for op in self.ops]
+        self.rnd = random.Random(seed)
+        self.created = []
+        self._lock = threading.Lock()
+
+    def random_day(self):
+        return FIRST_DAY + timedelta(days=self.rnd.randrange(DAYS))
+
+    def next(self):
+        """返回 (接口名, 方法, 路径, 请求体)"""
+        with self._lock:
+            op = self.rnd.choices(self.ops, self.weights)[0]
+            if op == 'records':
+                params = ['limit=50']
+                if self.rnd.random() < 0.3:
+                    start = self.random_day()
+                    params.append(f'start={start}&end={start + timedelta(days=30)}')
+                if self.rnd.random() < 0.2:
+                    params.append(f'category={quote(self.rnd.choice(CATEGORIES))}')
+                if self.rnd.random() < 0.3:
+                    params.append('cursor=' + app_module.encode_cursor(self.random_day(), 1 << 30))
+                return 'GET /api/records', 'GET', '/api/records?' + '&'.join(params), None
+            if op == 'stats':
+                start = self.random_day()
+                return 'GET /api/stats', 'GET', (
+                    f'/api/stats?start={start}&end={start + timedelta(days=30)}'
+                    f'&year={start.year}&month={start.month}'), None
+            if op == 'search':
+                return 'GET /api/records?q=', 'GET', f'/api/records?q={quote(self.rnd.choice(NOTE_WORDS))}&limit=50', None
+            if op == 'year-stats':
+                year = FIRST_DAY.year + self.rnd.randrange(DAYS // 365)
+                return 'GET /api/year-stats', 'GET', f'/api/year-stats?year={year}', None
+            roll = self.rnd.random()
+            if self.created and roll < 0.25:
+                rid = self.created.pop(self.rnd.randrange(len(self.created)))
+                return 'DELETE /api/record', 'DELETE', f'/api/record/{rid}', None
+            if self.created and roll < 0.5:
+                # 修改期间从列表中取出，避免同一条记录同时被删除；完成后由 record_created 放回
+                rid = self.created.pop(self.rnd.randrange(len(self.created)))
+                return 'PUT /api/record', 'PUT', f'/api/record/{rid}', {
+                    'amount': f'{self.rnd.randint(1, 100000) / 100:.2f}'}
+            return 'POST /api/record', 'POST', '/api/record', {
+                'type': 'expense', 'amount': f'{self.rnd.randint(1, 100000) / 100:.2f}',
+                'category': self.rnd.choice(CATEGORIES), 'date': self.random_day().isoformat()}
+
+    def record_created(self, rid):
+        with self._lock:
+            self.created.append(rid)
+
+def test_client_sender():
+    client = app_module.app.test_client()
+
+    def send(method, path, body):
+        resp = client.open(path, method=method, json=body)
+        return resp.status_code, resp.get_json(silent=True)
+    return send
+
+def http_sender(url):
+    """每个线程一个持久连接"""
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+
+    def send(method, path, body):
+        data = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json'} if data is not None else {}
+        conn.request(method, path, body=data, headers=headers)
+        resp = conn.getresponse()
+        raw = resp.read()
+        try:
+            payload = json.loads(raw) if raw else None
+        except ValueError:
+            payload = None
+        return resp.status, payload
+    return send
+
+def bulk_body(rows, rnd):
+    """rows 条随机记录的 NDJSON 请求体"""
+    lines = [json.dumps({
+        'type': 'income' if rnd.random() < 0.2 else 'expense',
+        'amount': f'{rnd.randint(1, 500000) / 100:.2f}',
+        'category': rnd.choice(CATEGORIES),
+        'date': (FIRST_DAY + timedelta(days=rnd.randrange(DAYS))).isoformat(),
+        'note': ' '.join(rnd.sample(NOTE_WORDS, rnd.randint(1, 2))),
+    }, ensure_ascii=False) for _ in range(rows)]
+    return ('\n'.join(lines) + '\n').encode()
+
+def run_bulk(rows, seed, url=None, per_request=100000):
+    """通过 POST /api/records/bulk（NDJSON）写入 rows 条记录，返回写入吞吐量；只计请求用时，不计生成请求体"""
+    rnd = random.Random(seed)
+    client = None if url else app_module.app.test_client()
+    seconds, inserted = 0.0, 0
+    while inserted < rows:
+        body = bulk_body(min(per_request, rows - inserted), rnd)
+        started = time.perf_counter()
+        if client is not None:
+            result = client.post('/api/records/bulk', data=body, content_type='application/x-ndjson').get_json()
+        else:
+            parts = urlsplit(url)
+            conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=600)
+            conn.request('POST', '/api/records/bulk', body=body, headers={'Content-Type': 'application/x-ndjson'})
+            result = json.loads(conn.getresponse().read())
+            conn.close()
+        seconds += time.perf_counter() - started
+        if result['failed']:
+            raise RuntimeError(f"批量写入失败: {result['errors'][:3]}")
+        inserted += result['inserted']
+    return {'rows': inserted, 'seconds': round(seconds, 2), 'rows_per_sec': round(inserted / seconds)}
+
+def run_workload(workload, make_sender, concurrency, requests=None, duration=None, rss_pid=None):
+    """并发执行负载，返回 {接口名: 统计} 和总体统计；requests 与 duration 至少指定一个"""
+    latencies = defaultdict(list)
+    errors = defaultdict(lambda: defaultdict(int))
+    peak_rss = defaultdict(int)
+    lock = threading.Lock()
+    remaining = [requests]
+    deadline = time.perf_counter() + duration if duration else None
+
+    def take():
+        with lock:
+            if deadline and time.perf_counter() >= deadline:
+                return False
+            if remaining[0] is not None:
+                if remaining[0] <= 0:
+                    return False
+                remaining[0] -= 1
+            return True
+
+    def worker():
+        send = make_sender()
+        while take():
+            name, method, path, body = workload.next()
+            t0 = time.perf_counter()
+            try:
+                status, payload = send(method, path, body)
+            except Exception:
+                status, payload = None, None
+            elapsed = time.perf_counter() - t0
+            rss = rss_bytes(rss_pid) or 0
+            with lock:
+                latencies[name].append(elapsed)
+                if status is None or status >= 400:
+                    errors[name][str(status)] += 1
+                peak_rss[name] = max(peak_rss[name], rss)
+            if method == 'POST' and status == 201 and payload:
+                workload.record_created(payload['id'])
+            elif method == 'PUT':
+                workload.record_created(int(path.rsplit('/', 1)[1]))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    total = time.perf_counter() - started
+
+    endpoints = {}
+    for name in sorted(latencies):
+        values = sorted(latencies[name])
+        endpoints[name] = {
+            'requests': len(values),
+            'errors': sum(errors[name].values()),
+            'error_status': dict(errors[name]),
+            'throughput': round(len(values) / total, 1),
+            'mean_ms': round(sum(values) / len(values) * 1000, 3),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+            'peak_rss_mb': round(peak_rss[name] / 2**20, 1) if peak_rss[name] else None,
+        }
+    count = sum(len(v) for v in latencies.values())
+    overall = {
+        'requests': count,
+        'errors': sum(sum(e.values()) for e in errors.values()),
+        'seconds': round(total, 3),
+        'throughput': round(count / total, 1) if total else 0,
+        'peak_rss_mb': round(max(peak_rss.values(), default=0) / 2**20, 1) or None,
+    }
+    return endpoints, overall
+
+def compare(report, baseline, threshold=None):
+    """与之前保存的结果对比，比值 > 1 表示变慢（p95）或吞吐下降；返回 (对比结果, 是否有接口超过阈值)"""
+    result, regressed = {}, False
+    for name, cur in report.get('endpoints', {}).items():
+        old = baseline.get('endpoints', {}).get(name)
+        if not old:
+            continue
+        p95 = round(cur['p95_ms'] / old['p95_ms'], 3) if old['p95_ms'] else None
+        throughput = round(old['throughput'] / cur['throughput'], 3) if cur['throughput'] else None
+        result[name] = {'p95_ratio': p95, 'throughput_ratio': throughput}
+        if threshold and p95 and p95 > threshold:
+            regressed = True
+    return {'baseline_commit': baseline.get('commit'), 'endpoints': result}, regressed
+
+def parse_mix(s):
+    mix = dict(DEFAULT_MIX)
+    if s:
+        for part in s.split(','):
+            op, _, weight = part.partition('=')
+            if op not in DEFAULT_MIX:
+                raise argparse.ArgumentTypeError(f'未知的操作: {op}')
+            mix[op] = float(weight)
+    return {op: w for op, w in mix.items() if w > 0}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='接口基准与压测')
+    parser.add_argument('--rows', type=int, default=100000, help='合成账本的记录数（1 万 ~ 1000 万）')
+    parser.add_argument('--db', help='SQLite 数据库文件，默认使用临时文件并在结束后删除')
+    parser.add_argument('--reuse', action='store_true', help='--db 已有相同规模的数据时不重新生成')
+    parser.add_argument('--url', help='请求已启动的服务器，如 http://127.0.0.1:5000（不生成数据）')
+    parser.add_argument('--server-pid', type=int, help='配合 --url 统计服务器进程的 RSS')
+    parser.add_argument('--requests', type=int, default=5000, help='请求总数，为 0 时不运行混合负载')
+    parser.add_argument('--bulk', type=int, default=0, help='负载结束后通过 /api/records/bulk 写入的记录数，测量批量写入吞吐量')
+    parser.add_argument('--duration', type=float, help='运行秒数，指定后忽略 --requests')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(None),
+                        help='操作权重，如 records=50,stats=20,year-stats=10,write=20')
+    parser.add_argument('--no-cache', action='store_true', help='关闭接口缓存，测量数据库查询本身')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='结果另存为 JSON 文件')
+    parser.add_argument('--compare', help='与之前保存的结果对比')
+    parser.add_argument('--fail-above', type=float, help='任一接口 p95 变慢超过该倍数时以状态 1 退出')
+    args = parser.parse_args(argv)
+
+    report = {
+        'commit': git_commit(),
+        'rows': None,
+        'concurrency': args.concurrency,
+        'mix': args.mix,
+        'cache': not args.no_cache,
+    }
+    path = None
+    if args.url:
+        report['target'] = args.url
+        make_sender = lambda: http_sender(args.url)
+        rss_pid = args.server_pid
+    else:
+        path = args.db
+        if not path:
+            fd, path = tempfile.mkstemp(suffix='.db')
+            os.close(fd)
+            os.remove(path)
+        engine = get_engine(f'sqlite:///{path}')
+        if args.reuse and os.path.exists(path) and os.path.getsize(path) and ledger_size(engine) >= args.rows:
+            print(f"使用已有数据 {path}", file=sys.stderr)
+        else:
+            engine.dispose()
+            if os.path.exists(path):
+                os.remove(path)
+            engine = get_engine(f'sqlite:///{path}')
+            report['generate_seconds'] = round(generate_ledger(engine, args.rows, args.seed), 1)
+        report['rows'] = ledger_size(engine)
+        report['target'] = 'test-client'
+        app_module.engine = engine
+        app_module.api_cache = MemoryCache(maxsize=0) if args.no_cache else MemoryCache()
+        app_module.category_cache.clear()
+        make_sender = test_client_sender
+        rss_pid = None
+
+    if args.requests or args.duration:
+        workload = Workload(args.mix, args.seed)
+        endpoints, overall = run_workload(workload, make_sender, args.concurrency,
+                                          requests=None if args.duration else args.requests,
+                                          duration=args.duration, rss_pid=rss_pid)
+        report['endpoints'] = endpoints
+        report['overall'] = overall
+    if args.bulk:
+        report['bulk'] = run_bulk(args.bulk, args.seed, args.url)
+
+    regressed = False
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            report['comparison'], regressed = compare(report, json.load(f), args.fail_above)
+
+    if not args.url:
+        dispose_engine(engine)
+        if not args.db:
+            os.remove(path)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    return 1 if regressed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""
+接口结果缓存
+LRU + TTL，键为规范化后的查询参数；每个缓存项记录它依赖的日期范围，
+写接口修改某天的记录时只失效范围覆盖该日期的缓存项，其余缓存继续有效。
+
+两种后端（配置项 CACHE_BACKEND）：
+- memory：进程内缓存，适合单进程运行（python app.py）。
+- shared：缓存值仍在各进程内，但失效通过本地 SQLite 文件中的代数计数器和失效日志在
+  所有进程间同步。gunicorn 多 worker 下，任一 worker 的写操作会在其他 worker 的下一次
+  缓存读取时生效。
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+
+class MemoryCache:
+    backend = 'memory'
+
+    def __init__(self, maxsize=256, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (过期时间, 日期范围列表, 值)，按最近使用排序
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        # 每次失效加一；计算期间代数变化说明结果可能已过时，不再写入缓存
+        self._generation = 0
+
+    def generation(self):
+        return self._generation
+
+    def get(self, key):
+        """命中返回缓存值，未命中或已过期返回 None"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            if item[0] <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[2]
+
+    def set(self, key, value, ranges, generation=None):
+        """ranges 为 [(start, end), ...]，闭区间，None 表示该端不限
+
+        generation 为开始计算前 generation() 的返回值，期间发生过失效则丢弃该结果。
+        比较和写入在同一次加锁中完成：失效要等写入结束才能执行，写入的旧结果会被随后的失效删除。
+        """
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            if generation is not None and generation != self.generation():
+                return
+            self._data[key] = (expires, list(ranges), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *dates):
+        """失效所有日期范围覆盖 dates 中任一日期的缓存项，返回失效条数"""
+        return self.invalidate_spans([(d, d) for d in dates if d is not None])
+
+    def invalidate_range(self, start, end):
+        """失效日期范围与 [start, end] 有交集的缓存项，用于批量写入等涉及大量日期的场景"""
+        return self.invalidate_spans([(start, end)])
+
+    def invalidate_spans(self, spans):
+        return self._invalidate_local(spans)
+
+    def _invalidate_local(self, spans):
+        with self._lock:
+            self._generation += 1
+            stale = [key for key, (_, ranges, _) in self._data.items()
+                     if any(_overlaps(r, span) for r in ranges for span in spans)]
+            for key in stale:
+                del self._data[key]
+            self.invalidations += len(stale)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': self.backend,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+class SharedCache(MemoryCache):
+    """多进程共享失效的缓存
+
+    共享文件中保存单调递增的代数 generation 和每一代失效的日期范围。每次读取缓存前先比较
+    代数（一次极小的 SQLite 查询），落后时按日志补做失效；日志被截断、无法补齐时清空本地缓存。
+    """
+    backend = 'shared'
+    # 失效日志保留的代数，进程落后超过这个数量时直接清空本地缓存
+    LOG_SIZE = 1000
+
+    def __init__(self, maxsize=256, ttl=60, path=None):
+        super().__init__(maxsize, ttl)
+        self.path = path or os.path.join(tempfile.gettempdir(), 'accounting_cache.db')
+        self._local = threading.local()
+        self._sync_lock = threading.Lock()
+        conn = self._conn()
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_generation '
+                         '(id INTEGER PRIMARY KEY CHECK (id = 1), generation INTEGER NOT NULL)')
+            conn.execute('INSERT OR IGNORE INTO cache_generation (id, generation) VALUES (1, 0)')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_invalidation_log '
+                         '(generation INTEGER PRIMARY KEY, spans TEXT NOT NULL)')
+        # 新进程从当前代开始，本地缓存为空，无需补做之前的失效
+        self._seen = self.generation()
+
+    def _conn(self):
+        """每个线程一个 SQLite 连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def generation(self):
+        return self._conn().execute('SELECT generation FROM cache_generation WHERE id = 1').fetchone()[0]
+
+    def _sync(self):
+        """追上所有进程（包括本进程）写入的失效，返回失效条数"""
+        current = self.generation()
+        if current <= self._seen:
+            return 0
+        with self._sync_lock:
+            if current <= self._seen:
+                return 0
+            rows = self._conn().execute(
+                'SELECT generation, spans FROM cache_invalidation_log WHERE generation > ? ORDER BY generation',
+                (self._seen,)
+            ).fetchall()
+            if not rows or rows[0][0] != self._seen + 1:
+                with self._lock:
+                    n = len(self._data)
+                    self._data.clear()
+                    self.invalidations += n
+            else:
+                spans = [(date.fromisoformat(a), date.fromisoformat(b))
+                         for _, spans in rows for a, b in json.loads(spans)]
+                n = self._invalidate_local(spans)
+            self._seen = max(current, rows[-1][0] if rows else current)
+            return n
+
+    def get(self, key):
+        self._sync()
+        return super().get(key)
+
+    def invalidate_spans(self, spans):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            generation = conn.execute(
+                'SELECT generation FROM cache_generation WHERE id = 1').fetchone()[0] + 1
+            conn.execute('UPDATE cache_generation SET generation = ? WHERE id = 1', (generation,))
+            conn.execute('INSERT INTO cache_invalidation_log (generation, spans) VALUES (?, ?)',
+                         (generation, json.dumps([[a.isoformat(), b.isoformat()] for a, b in spans])))
+            conn.execute('DELETE FROM cache_invalidation_log WHERE generation <= ?',
+                         (generation - self.LOG_SIZE,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        # 本进程的失效和其他进程积压的失效一起处理
+        return self._sync()
+
+    def stats(self):
+        data = super().stats()
+        data['generation'] = self._seen
+        data['path'] = self.path
+        return data
+
+def create_cache(backend='memory', maxsize=256, ttl=60, path=None):
+    if backend == 'shared':
+        return SharedCache(maxsize, ttl, path)
+    if backend == 'memory':
+        return MemoryCache(maxsize, ttl)
+    raise ValueError(f'未知的缓存后端: {backend}')
+
+def _overlaps(date_range, span):
+    """缓存项的日期范围（端点可为 None 表示不限）与失效区间 span 是否有交集"""
+    start, end = date_range
+    return (start is None or start <= span[1]) and (end is None or span[0] <= end)
@@ -0,0 +1,113 @@
+"""
+分类字典
+分类名称只在 categories 表中保存一次，records 和 daily_totals 中存放小整数 category_id，
+索引更窄，/api/stats 的 GROUP BY 按整数分组。
+
+进程内的 CategoryCache 缓存 名称 <-> id 的映射（分类通常只有几十个，全部常驻内存）：
+- 写入时 ids() 把名称换成 id，新名称在调用方的事务中插入（已存在时忽略），事务提交后才进入缓存，
+  回滚的事务不会在缓存中留下不存在的 id；
+- 输出时 name() 把 id 换回名称，未命中（其他 worker 或导入脚本新建的分类）时重新加载整张表。
+"""
+import threading
+from sqlalchemy import event, insert, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from models import Category, get_session
+
+# session.info 中暂存本事务新发现的分类，提交后写入缓存
+PENDING_KEY = 'new_categories'
+
+def _insert_ignore(session, names):
+    """插入不存在的分类名，并发插入同名分类时以唯一索引去重"""
+    table = Category.__table__
+    dialect = session.get_bind().dialect.name
+    values = [{'name': n} for n in names]
+    if dialect == 'sqlite':
+        session.execute(sqlite_insert(table).on_conflict_do_nothing(index_elements=['name']), values)
+    elif dialect == 'mysql':
+        session.execute(mysql_insert(table).prefix_with('IGNORE'), values)
+    else:
+        existing = set(session.execute(select(table.c.name).where(table.c.name.in_(names))).scalars())
+        missing = [v for v in values if v['name'] not in existing]
+        if missing:
+            session.execute(insert(table), missing)
+
+class CategoryCache:
+    """分类名称与 id 的双向映射，线程安全
+
+    bind 为返回引擎的函数，name() 未命中时用它读取 categories 表。
+    """
+
+    def __init__(self, bind=None):
+        self.bind = bind
+        self._ids = {}
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._names.clear()
+
+    def _store(self, pairs):
+        with self._lock:
+            for name, cid in pairs:
+                self._ids[name] = cid
+                self._names[cid] = name
+
+    def load(self, session):
+        """重新读取整张分类表"""
+        self._store(session.execute(select(Category.name, Category.id)).all())
+
+    def ids(self, session, names, create=True):
+        """名称 -> id 的字典；create 为 False 时不存在的名称不在结果中
+
+        新建的分类要等 session 提交后才进入缓存，同一事务中再次查询时从 session.info 取得。
+        """
+        pending = session.info.setdefault(PENDING_KEY, {})
+        result, missing = {}, []
+        for name in set(names):
+            cid = self._ids.get(name) or pending.get(name)
+            if cid is None:
+                missing.append(name)
+            else:
+                result[name] = cid
+        if missing:
+            if create:
+                _insert_ignore(session, missing)
+            rows = session.execute(select(Category.name, Category.id).where(Category.name.in_(missing))).all()
+            if create:
+                pending.update(rows)
+            else:
+                # 没有插入时读到的都是已提交的分类
+                self._store(rows)
+            result.update(rows)
+        return result
+
+    def id(self, session, name, create=True):
+        return self.ids(session, [name], create).get(name)
+
+    def name(self, cid):
+        name = self._names.get(cid)
+        if name is None and cid is not None and self.bind is not None:
+            session = get_session(self.bind())
+            try:
+                self.load(session)
+            finally:
+                session.close()
+            name = self._names.get(cid)
+        return name
+
+# 进程内唯一的缓存，app.py 和导入脚本共用
+cache = CategoryCache()
+
+@event.listens_for(Session, 'after_commit')
+def _promote_pending(session):
+    pending = session.info.pop(PENDING_KEY, None)
+    if pending:
+        cache._store(pending.items())
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_pending(session, previous_transaction):
+    session.info.pop(PENDING_KEY, None)
@@ -0,0 +1,78 @@
+"""
+账本版本与增量同步
+每个写事务通过 next_version() 把 ledger_meta 中的计数器加一，新增、修改的记录写入该版本号，
+删除的记录在 record_tombstones 中留下 (id, 版本)。计数器行在事务提交前一直被锁住，
+版本号按提交顺序分配：客户端读到版本 V 时，V 及之前的所有变更都已提交，下次从 since=V 继续不会遗漏。
+"""
+from sqlalchemy import func, insert, select, update
+import partitions
+from models import LedgerMeta, Record, RecordTombstone
+
+def next_version(session):
+    """在当前事务中分配一个新的账本版本号"""
+    table = LedgerMeta.__table__
+    result = session.execute(update(table).where(table.c.id == 1).values(version=table.c.version + 1))
+    if result.rowcount == 0:
+        # 新数据库还没有计数器行
+        session.execute(insert(table).values(id=1, version=1))
+        return 1
+    return session.execute(select(table.c.version).where(table.c.id == 1)).scalar_one()
+
+def current_version(session):
+    version = session.execute(select(LedgerMeta.version).where(LedgerMeta.id == 1)).scalar()
+    return version or 0
+
+def record_deleted(session, rec, version):
+    session.merge(RecordTombstone(id=rec.id, version=version, date=rec.date))
+
+def change_summary(session, since, max_ids=50):
+    """版本 since 之后变更的概要，用于推送通知：条数、日期范围和（不多时）记录 id
+
+    只做聚合查询，不读取记录内容，一次导入几十万条时也很便宜。
+    """
+    changed, first, last = session.query(
+        func.count(Record.id), func.min(Record.date), func.max(Record.date)
+    ).filter(Record.version > since).one()
+    deleted, del_first, del_last = session.query(
+        func.count(RecordTombstone.id), func.min(RecordTombstone.date), func.max(RecordTombstone.date)
+    ).filter(RecordTombstone.version > since).one()
+    dates = [d for d in (first, last, del_first, del_last) if d is not None]
+    ids = []
+    if 0 < changed <= max_ids:
+        ids = [rid for rid, in session.query(Record.id).filter(Record.version > since).order_by(Record.id)]
+    return {
+        'changed': changed,
+        'deleted': deleted,
+        'ids': ids,
+        'start': min(dates) if dates else None,
+        'end': max(dates) if dates else None,
+    }
+
+def changes_since(session, since, limit, columns):
+    """返回版本大于 since 的变更 (版本, 记录行, 墓碑行, 是否还有更多)
+
+    记录按 (version, id) 排序，最多约 limit 条；同一版本（如一次批量导入）的记录不会被拆到两页，
+    这样返回的版本号总是一个完整的同步点。单个版本超过 limit 条时整个版本一起返回。
+    columns 为 Record 的列，已归档年份的表（见 partitions.py）中取同名的列；since 不小于归档时的版本时跳过该表。
+    """
+    version = current_version(session)
+    queries = []
+    rows = []
+    for table in partitions.tables(session, since=since):
+        q = session.query(*[table.c[c.key] for c in columns]).filter(table.c.version > since)
+        queries.append((table, q))
+        rows.extend(q.order_by(table.c.version, table.c.id).limit(limit + 1).all())
+    if len(queries) > 1:
+        rows = sorted(rows, key=lambda r: (r.version, r.id))[:limit + 1]
+    more = len(rows) > limit
+    if more:
+        last = rows[limit].version
+        rows = [r for r in rows if r.version < last]
+        if not rows:
+            rows = sorted((r for table, q in queries for r in q.filter(table.c.version == last)), key=lambda r: r.id)
+        version = rows[-1].version
+    deleted = session.query(RecordTombstone.id, RecordTombstone.version).filter(
+        RecordTombstone.version > since,
+        RecordTombstone.version <= version
+    ).order_by(RecordTombstone.version).all()
+    return version, rows, deleted, more
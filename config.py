@@ -14,8 +14,77 @@ class Config:
     
     # SQLAlchemy 配置
     SQLALCHEMY_DATABASE_URI = f'mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DATABASE}?charset=utf8mb4'
+    # 只读副本（可选）：设置 MYSQL_REPLICA_HOST（用户名、密码、库名与主库相同）或完整的 REPLICA_DATABASE_URI 后，
+    # GET 请求查询副本；客户端写入后 REPLICA_PIN_SECONDS 秒内的请求仍读主库，保证读到自己的写入
+    MYSQL_REPLICA_HOST = os.getenv('MYSQL_REPLICA_HOST')
+    MYSQL_REPLICA_PORT = int(os.getenv('MYSQL_REPLICA_PORT', MYSQL_PORT))
+    REPLICA_DATABASE_URI = os.getenv('REPLICA_DATABASE_URI') or (
+        f'mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_REPLICA_HOST}:{MYSQL_REPLICA_PORT}/{MYSQL_DATABASE}?charset=utf8mb4'
+        if MYSQL_REPLICA_HOST else None)
+    REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ECHO = False  # 设为 True 可查看 SQL 语句
+    
+    # 连接池：常驻连接数、高峰时可额外创建的连接数、等待空闲连接的超时（秒）、连接回收周期（秒，
+    # 需小于 MySQL 的 wait_timeout）；DB_POOL_PRE_PING=1 时每次取出连接先 ping 一次（多一次往返，网络不稳定时使用）
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '0') == '1'
+    
+    # SQLite 文件库（备用数据库、测试、bench.py）：每个连接的 PRAGMA，见 models.sqlite_pragmas()；
+    # SQLITE_SINGLE_WRITER=1 时所有写请求通过同一个连接按顺序执行，读请求使用连接池并行
+    SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_CACHE_SIZE_MB = int(os.getenv('SQLITE_CACHE_SIZE_MB', 64))
+    SQLITE_MMAP_SIZE_MB = int(os.getenv('SQLITE_MMAP_SIZE_MB', 256))
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_SINGLE_WRITER = os.getenv('SQLITE_SINGLE_WRITER', '1') == '1'
+    
+    # 统计和记录列表接口缓存：最多缓存的条目数、过期时间（秒）
+    STATS_CACHE_SIZE = int(os.getenv('STATS_CACHE_SIZE', 256))
+    STATS_CACHE_TTL = int(os.getenv('STATS_CACHE_TTL', 60))
+    # 缓存后端：memory（单进程）或 shared（gunicorn 多 worker，通过本地 SQLite 文件同步失效）
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+    CACHE_SHARED_PATH = os.getenv('CACHE_SHARED_PATH')  # 默认为系统临时目录下的 accounting_cache.db
+    
+    # 批量新增每个事务写入的记录数
+    BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', 20000))
+    
+    # 全文搜索（SQLite）没有指定日期范围时，只在最新的 SEARCH_WINDOW 条匹配记录中按相关度排序，为 0 时不限制
+    SEARCH_WINDOW = int(os.getenv('SEARCH_WINDOW', 10000))
+    
+    # /api/events 推送：检查账本版本的间隔（秒，本进程的写操作会立即触发检查）、保活注释的间隔（秒）
+    EVENTS_POLL_INTERVAL = float(os.getenv('EVENTS_POLL_INTERVAL', 1.0))
+    EVENTS_HEARTBEAT = int(os.getenv('EVENTS_HEARTBEAT', 15))
+    
+    # 请求剖析（见 profiling.py）：PROFILE_REQUESTS=1 开启 Server-Timing 响应头和慢查询日志；
+    # 超过 SLOW_QUERY_MS 毫秒的 SQL 写入 SLOW_QUERY_LOG（默认 stderr）；
+    # PROFILE_SAMPLE_RATE 为启用 cProfile 的请求比例，只在 PROFILE_DIR 保留最慢的 PROFILE_KEEP 个
+    PROFILE_REQUESTS = os.getenv('PROFILE_REQUESTS', '0') == '1'
+    SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+    SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG')
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_DIR = os.getenv('PROFILE_DIR')  # 默认为系统临时目录下的 ledger_profiles
+    PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', 20))
+    
+    # /metrics：gunicorn 多 worker 时设置为各 worker 共享的目录，每 METRICS_FLUSH_INTERVAL 秒写出一次本进程的指标
+    METRICS_DIR = os.getenv('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+    
+    # 新增记录的后台组提交（见 writebehind.py）：WRITE_BEHIND=1 时 POST /api/record 由后台线程合并写入，
+    # 每批最多 WRITE_BEHIND_BATCH 条、最多等待 WRITE_BEHIND_DELAY_MS 毫秒；队列最多 WRITE_BEHIND_QUEUE 条，
+    # 满时请求最多等待 WRITE_BEHIND_PUT_TIMEOUT 秒，之后返回 503
+    WRITE_BEHIND = os.getenv('WRITE_BEHIND', '0') == '1'
+    WRITE_BEHIND_BATCH = int(os.getenv('WRITE_BEHIND_BATCH', 200))
+    WRITE_BEHIND_DELAY_MS = float(os.getenv('WRITE_BEHIND_DELAY_MS', 2))
+    WRITE_BEHIND_QUEUE = int(os.getenv('WRITE_BEHIND_QUEUE', 10000))
+    WRITE_BEHIND_PUT_TIMEOUT = float(os.getenv('WRITE_BEHIND_PUT_TIMEOUT', 1.0))
+    
+    # 列式内存分析（见 analytics.py，需要 numpy）：ANALYTICS_MODE=1 时统计接口从内存快照计算；
+    # 快照在第一次统计请求时于后台加载，加载完成前仍查询日汇总表
+    ANALYTICS_MODE = os.getenv('ANALYTICS_MODE', '0') == '1'
 
 # 使用 SQLite 的备用配置（如果不想用 MySQL）
 class SQLiteConfig:
@@ -1,19 +1,22 @@
 from datetime import date
-from models import Base, Record, get_engine, get_session
+from models import Record, get_engine, get_session
+from migrate import migrate
+import ingest
 
 def init_db():
-    engine = get_engine()
-    Base.metadata.create_all(engine)
+    # 建表并为已有数据库补齐索引
+    engine = migrate(get_engine())
     session = get_session(engine)
     # 插入一些示例数据
     if session.query(Record).count() == 0:
         sample = [
-            Record(type='income', amount=5000, category='工资', date=date(2025,1,5), note='一月工资'),
-            Record(type='expense', amount=50, category='餐饮', date=date(2025,1,6), note='午餐'),
-            Record(type='expense', amount=100, category='交通', date=date(2025,1,7), note='地铁卡充值'),
-            Record(type='expense', amount=200, category='购物', date=date(2025,1,10), note='买书'),
+            {'type': 'income', 'amount_cents': 500000, 'category': '工资', 'date': date(2025,1,5), 'note': '一月工资'},
+            {'type': 'expense', 'amount_cents': 5000, 'category': '餐饮', 'date': date(2025,1,6), 'note': '午餐'},
+            {'type': 'expense', 'amount_cents': 10000, 'category': '交通', 'date': date(2025,1,7), 'note': '地铁卡充值'},
+            {'type': 'expense', 'amount_cents': 20000, 'category': '购物', 'date': date(2025,1,10), 'note': '买书'},
         ]
-        session.add_all(sample)
+        # 与批量新增接口相同的写入路径，同时维护日汇总和账本版本
+        ingest.insert_batch(session, sample)
         session.commit()
     session.close()
 
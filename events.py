@@ -0,0 +1,94 @@
+"""
+Server-Sent Events 推送
+每个进程一个 Broadcaster：后台线程定期（或被本进程的写操作唤醒时）调用 poll 检查账本版本，
+有变化时生成一条事件，格式化一次后放入所有订阅者的队列。无论连接多少个页面，每个进程每次变化
+只做一次查询。账本版本保存在数据库中，其他 gunicorn worker 或导入脚本的写操作同样会被发现。
+
+gunicorn 部署时每个 SSE 连接会一直占用一个处理线程，需使用 gthread（或 gevent）worker，
+例如 gunicorn -k gthread --threads 50 wsgi:app。
+"""
+import json
+import queue
+import threading
+
+def format_event(event, data, event_id=None):
+    """按 text/event-stream 格式编码一条事件"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append('data: ' + json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+    return ('\n'.join(lines) + '\n\n').encode()
+
+class Broadcaster:
+    """把一份事件分发给所有订阅者
+
+    poll(since) 返回 (最新版本, 事件数据或 None)，since 为 None 时只返回当前版本。
+    订阅者的队列满了（客户端太慢或已断开）时放弃该订阅者，浏览器的 EventSource 会自动重连。
+    """
+
+    def __init__(self, poll, interval=1.0, queue_size=100):
+        self.poll = poll
+        self.interval = interval
+        self.queue_size = queue_size
+        self.version = None
+        self.events_sent = 0
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def subscribe(self):
+        q = queue.Queue(self.queue_size)
+        with self._lock:
+            if self.version is None:
+                self.version = self.poll(None)[0]
+            self._subscribers.add(q)
+            # 第一个订阅者到来时才启动线程：gunicorn fork 出的每个 worker 各自启动，没有页面连接时不轮询
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sse-broadcaster', daemon=True)
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def subscribers(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def notify(self):
+        """本进程写入后调用，立即检查而不必等到下一个轮询周期"""
+        self._wakeup.set()
+
+    def publish(self, payload):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(payload)
+            except queue.Full:
+                self.unsubscribe(q)
+        self.events_sent += 1
+
+    def check(self):
+        """检查一次账本版本，有变化时广播，返回是否发送了事件"""
+        if not self.subscribers():
+            return False
+        version, data = self.poll(self.version)
+        if version == self.version or data is None:
+            return False
+        self.version = version
+        self.publish(format_event('change', data, version))
+        return True
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.check()
+            except Exception as e:
+                # 数据库暂时不可用等错误不能让线程退出，下个周期重试
+                print(f'✗ SSE 轮询失败: {e}')
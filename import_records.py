@@ -0,0 +1,74 @@
+"""
+流式导入银行流水等 CSV / NDJSON 文件
+逐行解析、校验并分批写入，内存占用与文件大小无关。每批记录与断点在同一事务中提交，
+中断后加 --resume 重新运行即从最后一次提交的位置继续。
+CSV 第一行包含 amount 列时作为表头（type, amount, category, date, note，其他列忽略），
+否则按此顺序取值；校验规则与新增记录接口相同。
+用法：
+    python import_records.py statement.csv
+    python import_records.py records.ndjson --resume
+    python import_records.py statement.csv --encoding gbk --batch-size 10000
+"""
+import argparse
+import os
+import sys
+import ingest
+from models import ImportCheckpoint, get_engine
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='流式导入 CSV / NDJSON 记录')
+    parser.add_argument('path', help='要导入的文件')
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help='文件格式，缺省时按扩展名判断')
+    parser.add_argument('--resume', action='store_true', help='从上次中断的位置继续')
+    parser.add_argument('--batch-size', type=int, default=20000, help='每个事务写入的记录数')
+    parser.add_argument('--encoding', default='utf-8', help='文件编码，如 gbk')
+    args = parser.parse_args(argv)
+
+    fmt = args.format
+    if not fmt:
+        ext = os.path.splitext(args.path)[1].lower()
+        fmt = 'csv' if ext == '.csv' else 'ndjson' if ext in ('.ndjson', '.jsonl') else None
+    if not fmt:
+        parser.error('无法根据扩展名判断文件格式，请指定 --format')
+
+    engine = get_engine()
+    ImportCheckpoint.__table__.create(engine, checkfirst=True)
+    # 多 worker 部署使用共享缓存时，通知正在运行的应用失效导入日期范围内的缓存
+    cache = None
+    try:
+        from config import Config
+        if Config.CACHE_BACKEND == 'shared':
+            from cache import SharedCache
+            cache = SharedCache(path=Config.CACHE_SHARED_PATH)
+    except ImportError:
+        pass
+
+    size = os.path.getsize(args.path)
+
+    def on_batch(result, span):
+        if cache and span:
+            cache.invalidate_range(*span)
+        percent = result['offset'] / size * 100 if size else 100
+        print(f"\r已导入 {result['inserted']} 条，失败 {result['failed']} 条，"
+              f"{percent:.1f}%，{result['rows_per_sec']} 行/秒", end='', file=sys.stderr, flush=True)
+
+    with open(args.path, 'rb', buffering=1 << 16) as f:
+        try:
+            result = ingest.import_stream(
+                engine, f, fmt, source=os.path.abspath(args.path), resume=args.resume,
+                batch_size=args.batch_size, encoding=args.encoding, on_batch=on_batch
+            )
+        except Exception as e:
+            print(f"\n✗ 导入中断: {e}\n已提交的部分已记录断点，修正后加 --resume 继续", file=sys.stderr)
+            return 1
+    print(file=sys.stderr)
+    for err in result['errors']:
+        print(f"  第 {err['row']} 行: {err['error']}")
+    if result['failed'] > len(result['errors']):
+        print(f"  ……其余 {result['failed'] - len(result['errors'])} 行错误未列出")
+    print(f"✓ 导入完成：新增 {result['inserted']} 条，失败 {result['failed']} 条，"
+          f"本次 {result['rows']} 行用时 {result['seconds']} 秒（{result['rows_per_sec']} 行/秒）")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,273 @@
+"""
+记录的校验与批量写入
+add_record、POST /api/records/bulk、POST /api/import 以及导入脚本 import_records.py
+共用同一套校验规则和写入逻辑。
+"""
+import codecs
+import csv
+import json
+import time
+from collections import defaultdict
+from datetime import datetime
+from functools import lru_cache
+from operator import itemgetter
+from sqlalchemy import func, select
+from models import Category, ImportCheckpoint, Record, get_session, insert_many
+from money import to_cents
+import categories
+import changelog
+import partitions
+import rollup
+import search
+
+# CSV 没有表头时各列的顺序
+IMPORT_COLUMNS = ('type', 'amount', 'category', 'date', 'note')
+# 记录类型，以及备注、分类名称的最大长度（与表结构一致，超出时整批写入会失败）
+RECORD_TYPES = ('income', 'expense')
+NOTE_MAX_LENGTH = Record.__table__.c.note.type.length
+CATEGORY_MAX_LENGTH = Category.__table__.c.name.type.length
+# insert_batch 写入的列
+INSERT_COLUMNS = ('type', 'amount_cents', 'category_id', 'date', 'note', 'version')
+# 导入结果中保留的错误明细条数，超出的只计数，错误很多的大文件也不会占满内存
+MAX_IMPORT_ERRORS = 100
+
+@lru_cache(maxsize=4096)
+def parse_date(date_s):
+    """批量导入中同一日期会反复出现，缓存解析结果"""
+    return datetime.strptime(date_s, '%Y-%m-%d').date()
+
+def parse_record(payload):
+    """按 add_record 的规则校验并转换一条记录，返回可直接插入的字典
+
+    参数错误时抛出 ValueError。批量写入整批 executemany，任何一条违反表结构约束都会使整批失败，
+    因此类型、长度在这里逐条检查。
+    """
+    try:
+        t = payload.get('type')
+        amount_cents = to_cents(payload.get('amount'))
+        category = payload.get('category') or '未分类'
+        date_s = payload.get('date')
+        d = parse_date(date_s) if date_s else datetime.today().date()
+        note = payload.get('note')
+    except (AttributeError, TypeError, ValueError) as e:
+        raise ValueError(str(e))
+    if t not in RECORD_TYPES:
+        raise ValueError(f'type 应为 income 或 expense: {t!r}')
+    if not isinstance(category, str) or len(category) > CATEGORY_MAX_LENGTH:
+        raise ValueError(f'category 应为不超过 {CATEGORY_MAX_LENGTH} 个字符的字符串')
+    if note is not None and (not isinstance(note, str) or len(note) > NOTE_MAX_LENGTH):
+        raise ValueError(f'note 应为不超过 {NOTE_MAX_LENGTH} 个字符的字符串')
+    return {'type': t, 'amount_cents': amount_cents, 'category': category, 'date': d, 'note': note}
+
+def insert_batch(session, rows, index=True):
+    """在当前事务中批量插入已校验的记录，并同步更新日汇总
+
+    使用 executemany 一次写入整批（不经过 ORM 对象）；日汇总先在内存中按 (日期, 类型, 分类) 合并，
+    每个组合只更新一次。整批记录共用一个账本版本。提交由调用方负责。返回本批涉及的 (最早日期, 最晚日期)。
+    包含已归档年份（见 partitions.py）的记录时抛出 ValueError，整批都不写入。
+    index 为 False 时不写全文索引，由调用方在全部批次写完后用 index_pending() 一次补齐。
+    """
+    if not rows:
+        return None
+    # 按日期排序后写入，(date, ...) 索引的插入位置相邻，B 树页命中率更高；
+    # 排序是稳定的，同一天的记录 id 仍按原顺序递增
+    rows = sorted(rows, key=itemgetter('date'))
+    partitions.check_writable(session, rows[0]['date'], rows[-1]['date'])
+    # 整批的分类名称一次换成 id
+    category_ids = categories.cache.ids(session, {row['category'] for row in rows})
+    version = changelog.next_version(session)
+    for row in rows:
+        row['category_id'] = category_ids[row.pop('category')]
+        row['version'] = version
+    indexed = index and search.indexed(session)
+    if indexed:
+        last_id = session.execute(select(func.max(Record.id))).scalar() or 0
+    insert_many(session.connection(), Record.__table__, INSERT_COLUMNS, [tuple(map(row.get, INSERT_COLUMNS)) for row in rows])
+    if indexed:
+        # executemany 不返回 id：按本事务的版本号和插入前的最大 id 读回新记录，整批写入全文索引
+        names = {cid: name for name, cid in category_ids.items()}
+        added = session.execute(select(Record.id, Record.note, Record.category_id)
+                                .where(Record.version == version, Record.id > last_id))
+        search.add_to_index(session, [(rid, note, names[cid]) for rid, note, cid in added])
+    deltas = defaultdict(lambda: [0, 0])
+    for row in rows:
+        delta = deltas[(row['date'], row['type'], row['category_id'])]
+        delta[0] += row['amount_cents']
+        delta[1] += 1
+    rollup.apply_deltas(session, deltas)
+    dates = [d for d, _, _ in deltas]
+    return min(dates), max(dates)
+
+def last_record_id(session):
+    """records 当前最大的 id，作为 index_pending() 的起点"""
+    return session.execute(select(func.max(Record.id))).scalar() or 0
+
+def index_pending(session, after):
+    """把 id 大于 after、还不在全文索引中的记录写入索引，返回行数；提交由调用方负责
+
+    批量写入时各批次用 insert_batch(index=False) 跳过索引，结束后在一个事务中整体补齐：FTS5 每次提交都要
+    把内存中的词表写成新的段并可能触发合并，分批写入时这部分开销随批次数增长。补齐之前这些记录搜索不到；
+    补齐前进程退出时，重新执行 python migrate.py 会把它们补进索引。
+    """
+    if not search.indexed(session):
+        return 0
+    return search.index_rows(session.connection(), Record.__table__, after=after)
+
+class OffsetReader:
+    """逐行迭代二进制流，offset 为已读取部分在文件中的结束字节偏移"""
+
+    def __init__(self, stream, offset=0):
+        self.stream = stream
+        self.offset = offset
+
+    def __iter__(self):
+        for line in self.stream:
+            self.offset += len(line)
+            yield line
+
+    def skip_to(self, offset):
+        """跳到文件中的 offset 处，不可 seek 的流（如请求体）读取并丢弃中间的内容"""
+        if offset <= self.offset:
+            return
+        if self.stream.seekable():
+            self.stream.seek(offset)
+        else:
+            remaining = offset - self.offset
+            while remaining > 0:
+                chunk = self.stream.read(min(remaining, 1 << 20))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+        self.offset = offset
+
+def iter_import_rows(stream, fmt, offset=0, encoding='utf-8'):
+    """逐行解析 CSV / NDJSON，产出 (该行在文件中的结束偏移, 记录字典或解析异常)
+
+    stream 为从文件开头读取的二进制流。CSV 第一行包含 amount 列时作为表头，按列名取值
+    （多余的列忽略），否则按 IMPORT_COLUMNS 的顺序。offset > 0 时跳过之前的部分，CSV 仍会先读表头。
+    """
+    reader = OffsetReader(stream)
+    if fmt == 'csv':
+        first = next(iter(reader), b'')
+        header = next(csv.reader([first.decode(encoding).lstrip('\ufeff')]), [])
+        names = [h.strip().lower() for h in header]
+        if 'amount' in names:
+            columns, pending = names, []
+        else:
+            columns, pending = IMPORT_COLUMNS, [first] if first else []
+        if offset > reader.offset:
+            pending = []
+            reader.skip_to(offset)
+
+        def lines():
+            for line in pending:
+                yield line.decode(encoding).lstrip('\ufeff')
+            for line in reader:
+                yield line.decode(encoding)
+
+        # csv.reader 按需逐行读取，带引号的多行字段也能正确处理，偏移始终对应当前行的结尾
+        for row in csv.reader(lines()):
+            if not any(v.strip() for v in row):
+                continue
+            if len(row) > len(columns):
+                yield reader.offset, ValueError(f'列数 {len(row)} 多于表头 {len(columns)}')
+                continue
+            yield reader.offset, {c: v.strip() or None for c, v in zip(columns, row)}
+    elif fmt == 'ndjson':
+        reader.skip_to(offset)
+        for line in reader:
+            line = line.strip()
+            if line.startswith(codecs.BOM_UTF8):
+                line = line[len(codecs.BOM_UTF8):]
+            if not line:
+                continue
+            try:
+                yield reader.offset, json.loads(line.decode(encoding))
+            except ValueError as e:
+                yield reader.offset, e
+    else:
+        raise ValueError(f'不支持的导入格式: {fmt}')
+
+def import_stream(engine, stream, fmt, source, resume=False, batch_size=20000,
+                  encoding='utf-8', on_batch=None):
+    """流式导入 CSV / NDJSON，每 batch_size 条有效记录写入并提交一个事务
+
+    每批记录与 import_checkpoints 中该 source 的断点在同一事务中提交，进程崩溃后以 resume=True
+    重新导入同一文件，会从最后一次提交的偏移继续，已导入的记录既不重复也不遗漏。
+    on_batch(result, span) 在每批提交后调用，用于失效缓存和输出进度。
+    各批次不写全文索引，全部提交后再一次补齐（见 index_pending）；续传时从头检查，之前中断的运行留下的记录也会补上。
+    返回 {'inserted', 'failed', 'errors', 'rows', 'offset', 'seconds', 'rows_per_sec'}，
+    其中 inserted/failed 包含断点之前的部分，rows、seconds 只统计本次运行。
+    """
+    session = get_session(engine)
+    checkpoint = session.get(ImportCheckpoint, source) if resume else None
+    after = 0 if resume else last_record_id(session)
+    result = {
+        'source': source,
+        'inserted': checkpoint.inserted if checkpoint else 0,
+        'failed': checkpoint.failed if checkpoint else 0,
+        'errors': [],
+        'rows': 0,
+        'offset': checkpoint.offset if checkpoint else 0,
+        'seconds': 0,
+        'rows_per_sec': 0,
+    }
+    started = time.perf_counter()
+    batch = []
+    failed = 0
+
+    def commit(offset):
+        nonlocal batch, failed
+        try:
+            span = insert_batch(session, batch, index=False)
+            session.merge(ImportCheckpoint(
+                source=source, offset=offset,
+                inserted=result['inserted'] + len(batch), failed=result['failed'] + failed
+            ))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        result['inserted'] += len(batch)
+        result['failed'] += failed
+        result['offset'] = offset
+        result['seconds'] = round(time.perf_counter() - started, 3)
+        if result['seconds']:
+            result['rows_per_sec'] = round(result['rows'] / result['seconds'])
+        batch, failed = [], 0
+        if on_batch:
+            on_batch(result, span)
+
+    try:
+        # 行号从文件开头计数，断点之前的行也算在内
+        row_number = result['inserted'] + result['failed']
+        offset = result['offset']
+        for offset, item in iter_import_rows(stream, fmt, result['offset'], encoding):
+            row_number += 1
+            result['rows'] += 1
+            try:
+                if isinstance(item, Exception):
+                    raise ValueError(str(item))
+                values = parse_record(item)
+                partitions.check_writable(session, values['date'])
+                batch.append(values)
+            except ValueError as e:
+                failed += 1
+                if len(result['errors']) < MAX_IMPORT_ERRORS:
+                    result['errors'].append({'row': row_number, 'error': str(e)})
+                continue
+            if len(batch) >= batch_size:
+                commit(offset)
+        commit(offset)
+        try:
+            index_pending(session, after)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        result['seconds'] = round(time.perf_counter() - started, 3)
+        if result['seconds']:
+            result['rows_per_sec'] = round(result['rows'] / result['seconds'])
+    finally:
+        session.close()
+    return result
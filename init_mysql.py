@@ -7,7 +7,9 @@ MySQL 数据库初始化脚本
 """
 import pymysql
 from config import Config
-from models import Base, Record, get_engine, get_session
+from models import Record, get_engine, get_session
+from migrate import migrate
+import ingest
 from datetime import date
 
 def create_database():
@@ -32,10 +34,9 @@ def create_database():
         raise
 
 def init_tables():
-    """创建表结构"""
+    """创建表结构，已有的表会补齐缺失的索引"""
     try:
-        engine = get_engine()
-        Base.metadata.create_all(engine)
+        engine = migrate(get_engine())
         print("✓ 数据表已创建")
         return engine
     except Exception as e:
@@ -48,13 +49,14 @@ def insert_sample_data(engine):
         session = get_session(engine)
         if session.query(Record).count() == 0:
             sample = [
-                Record(type='income', amount=5000, category='工资', date=date(2025,1,5), note='一月工资'),
-                Record(type='expense', amount=50, category='餐饮', date=date(2025,1,6), note='午餐'),
-                Record(type='expense', amount=100, category='交通', date=date(2025,1,7), note='地铁卡充值'),
-                Record(type='expense', amount=200, category='购物', date=date(2025,1,10), note='买书'),
-                Record(type='income', amount=300, category='兼职', date=date(2025,1,15), note='周末兼职'),
+                {'type': 'income', 'amount_cents': 500000, 'category': '工资', 'date': date(2025,1,5), 'note': '一月工资'},
+                {'type': 'expense', 'amount_cents': 5000, 'category': '餐饮', 'date': date(2025,1,6), 'note': '午餐'},
+                {'type': 'expense', 'amount_cents': 10000, 'category': '交通', 'date': date(2025,1,7), 'note': '地铁卡充值'},
+                {'type': 'expense', 'amount_cents': 20000, 'category': '购物', 'date': date(2025,1,10), 'note': '买书'},
+                {'type': 'income', 'amount_cents': 30000, 'category': '兼职', 'date': date(2025,1,15), 'note': '周末兼职'},
             ]
-            session.add_all(sample)
+            # 与批量新增接口相同的写入路径，同时维护日汇总和账本版本
+            ingest.insert_batch(session, sample)
             session.commit()
             print(f"✓ 已插入 {len(sample)} 条示例数据")
         else:
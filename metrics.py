@@ -0,0 +1,261 @@
+"""
+Prometheus 格式的运行指标（GET /metrics）
+计数器和直方图按线程分片：每个线程只写自己的字典，热路径上没有锁，抓取时才把所有线程的分片合并。
+缓存命中率、连接池占用等由 collector 在抓取时读取。
+
+gunicorn 多 worker 部署时设置 METRICS_DIR（所有 worker 可写的目录）：每个 worker 每隔
+METRICS_FLUSH_INTERVAL 秒把本进程的合计写入 metrics-<pid>.json，/metrics 落到任一 worker 时
+先写出自己的最新值，再合并目录中所有文件。已退出的 worker 的计数器和直方图继续计入总数（计数器不回退），
+gauge 只统计仍在运行的进程。部署前清空该目录即可从零开始计数。
+"""
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+# 请求耗时直方图的默认分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def series_key(name, labels=()):
+    """快照中序列的键"""
+    return json.dumps([name, labels], ensure_ascii=False)
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def _format_value(v):
+    if v == float('inf'):
+        return '+Inf'
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class Counter:
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def inc(self, labels=(), amount=1):
+        """labels 为 ((标签名, 值), ...)；只修改当前线程的分片，不加锁"""
+        shard = self.registry._shard()
+        key = (self.name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+class Histogram:
+    def __init__(self, registry, name, buckets):
+        self.registry = registry
+        self.name = name
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        shard = self.registry._shard()
+        key = (self.name, labels)
+        h = shard.get(key)
+        if h is None:
+            # 各分桶的计数（非累计，最后一个为 +Inf），然后是 sum 和 count
+            h = shard[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        h[bisect.bisect_left(self.buckets, value)] += 1
+        h[-2] += value
+        h[-1] += 1
+
+class Registry:
+    def __init__(self):
+        self._local = threading.local()
+        # [(所属线程, 分片)]；线程结束后分片并入 _retired 并丢弃，线程池换线程时分片数不会一直增长
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+        # 指标名 -> (类型, 说明, 分桶)
+        self._meta = {}
+        self._collectors = []
+
+    def _shard(self):
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            # 只有每个线程第一次记录时加锁
+            with self._lock:
+                self._retire_dead()
+                self._shards.append((threading.current_thread(), values))
+            return values
+
+    def _retire_dead(self):
+        """把已结束线程的分片累加到 _retired 后删除，调用方持有 _lock"""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+                continue
+            # 线程已结束，不会再写入它的分片
+            for key, value in shard.items():
+                merged = self._retired.get(key)
+                if isinstance(value, list):
+                    self._retired[key] = list(value) if merged is None else [a + b for a, b in zip(merged, value)]
+                else:
+                    self._retired[key] = (merged or 0) + value
+        self._shards = alive
+
+    def describe(self, name, kind, help, buckets=None):
+        """登记指标的类型和说明，render 时输出 # HELP / # TYPE"""
+        self._meta[name] = (kind, help, tuple(buckets) if buckets else None)
+
+    def counter(self, name, help):
+        self.describe(name, 'counter', help)
+        return Counter(self, name)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.describe(name, 'histogram', help, buckets)
+        return Histogram(self, name, buckets)
+
+    def collector(self, name, kind, help):
+        """注册在抓取时调用的函数，返回 [(labels, value), ...]；kind 为 counter 或 gauge"""
+        def decorator(fn):
+            self.describe(name, kind, help)
+            self._collectors.append((name, fn))
+            return fn
+        return decorator
+
+    def snapshot(self):
+        """合并所有线程的分片和 collector 的值，返回可 JSON 序列化的 {'counters', 'histograms', 'gauges'}"""
+        counters, histograms, gauges = {}, {}, {}
+        with self._lock:
+            self._retire_dead()
+            shards = [self._retired.copy()] + [shard for _, shard in self._shards]
+        for shard in shards:
+            # dict.copy() 在持有 GIL 时完成，不会与所属线程的写入交错出错
+            for (name, labels), value in shard.copy().items():
+                key = series_key(name, labels)
+                if isinstance(value, list):
+                    merged = histograms.get(key)
+                    histograms[key] = list(value) if merged is None else [a + b for a, b in zip(merged, value)]
+                else:
+                    counters[key] = counters.get(key, 0) + value
+        for name, fn in self._collectors:
+            target = gauges if self._meta[name][0] == 'gauge' else counters
+            for labels, value in fn():
+                target[series_key(name, labels)] = value
+        return {'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+    def render(self, snapshot=None):
+        """Prometheus 文本格式（0.0.4）"""
+        snapshot = snapshot or self.snapshot()
+        series = {}
+        for section in ('counters', 'gauges', 'histograms'):
+            for key, value in snapshot[section].items():
+                name, labels = json.loads(key)
+                series.setdefault(name, []).append((tuple(map(tuple, labels)), value))
+        lines = []
+        for name in sorted(series):
+            kind, help, buckets = self._meta.get(name, ('untyped', '', None))
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(series[name]):
+                if kind != 'histogram':
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for le, count in zip(buckets + (float('inf'),), value):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(labels, [("le", _format_value(le))])} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value[-2])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+def instrument_pool(pool, histogram):
+    """统计从连接池取出连接的等待时间（池满时排队的时间），同一个池只包装一次"""
+    if getattr(pool, '_metrics_instrumented', False):
+        return
+    do_get = pool._do_get
+
+    def timed_do_get():
+        t0 = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            histogram.observe(time.perf_counter() - t0)
+    pool._do_get = timed_do_get
+    pool._metrics_instrumented = True
+
+def merge_snapshots(snapshots):
+    """合并多个进程的快照：计数器、直方图和 gauge 都按序列相加"""
+    result = {'counters': {}, 'histograms': {}, 'gauges': {}}
+    for snap in snapshots:
+        for section in ('counters', 'gauges'):
+            target = result[section]
+            for key, value in snap.get(section, {}).items():
+                target[key] = target.get(key, 0) + value
+        for key, value in snap.get('histograms', {}).items():
+            merged = result['histograms'].get(key)
+            result['histograms'][key] = list(value) if merged is None else [a + b for a, b in zip(merged, value)]
+    return result
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class MultiProcessStore:
+    """gunicorn 各 worker 通过共享目录交换快照"""
+
+    def __init__(self, registry, path, interval=5.0):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._thread = None
+        self._pid = None
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, pid):
+        return os.path.join(self.path, f'metrics-{pid}.json')
+
+    def write(self):
+        """原子地写出本进程当前的快照"""
+        pid = os.getpid()
+        data = self.registry.snapshot()
+        data['pid'] = pid
+        data['time'] = time.time()
+        tmp = self._file(pid) + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self._file(pid))
+
+    def start(self):
+        """在当前进程启动定期写出的线程；fork 出的 worker 中第一次调用时启动"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.write()
+            except OSError as e:
+                print(f'✗ 写出指标失败: {e}')
+
+    def collect(self):
+        """写出本进程的最新值，合并目录中所有进程的快照"""
+        self.write()
+        snapshots = []
+        for file in glob.glob(os.path.join(self.path, 'metrics-*.json')):
+            try:
+                with open(file, encoding='utf-8') as f:
+                    snap = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not _alive(snap.get('pid', 0)):
+                # 已退出的 worker：保留累计值，丢弃 gauge
+                snap['gauges'] = {}
+            snapshots.append(snap)
+        return merge_snapshots(snapshots)
@@ -0,0 +1,328 @@
+"""
+数据库迁移脚本
+为 db_init.py / init_mysql.py 创建的已有数据库补齐模型中新增的表和索引，可重复执行。
+用法：
+    python migrate.py            # 执行迁移
+    python migrate.py --explain  # 用 EXPLAIN 检查 app.py 中的每个查询是否都用上了索引
+"""
+import re
+import sys
+from datetime import date
+from sqlalchemy import event, inspect
+from models import Base, DailyTotal, LedgerMeta, Record, get_engine, get_session
+import partitions
+import rollup
+import search
+
+def create_missing_tables(engine):
+    """新表直接建表（连同索引）"""
+    Base.metadata.create_all(engine)
+
+def add_missing_columns(engine):
+    """create_all 不会给已存在的表加列，这里用 ALTER TABLE 补上，NOT NULL 列按模型中的默认值填充已有行"""
+    insp = inspect(engine)
+    tables = set(insp.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {c['name'] for c in insp.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"{preparer.quote(column.name)} {column.type.compile(engine.dialect)}"
+            default = column.default.arg if column.default is not None and column.default.is_scalar else None
+            if default is not None:
+                ddl += f" NOT NULL DEFAULT {default}" if not column.nullable else f" DEFAULT {default}"
+            with engine.begin() as conn:
+                conn.exec_driver_sql(f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN {ddl}")
+            print(f"  + 列 {table.name}.{column.name}")
+
+def convert_categories_to_ids(engine):
+    """旧版本的 records.category、daily_totals.category 为分类名称字符串，改为 categories 表的 id
+
+    add_missing_columns 已经加上了 records.category_id 列。日汇总表的主键包含分类，直接重建空表，
+    随后由 backfill_daily_totals 回填。
+    """
+    insp = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    if 'category' in {c['name'] for c in insp.get_columns('records')}:
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                'INSERT INTO categories (name) SELECT DISTINCT category FROM records '
+                'WHERE category NOT IN (SELECT name FROM categories)')
+            conn.exec_driver_sql(
+                'UPDATE records SET category_id = (SELECT id FROM categories WHERE categories.name = records.category)')
+            for ix in insp.get_indexes('records'):
+                if 'category' in ix['column_names']:
+                    on = '' if engine.dialect.name == 'sqlite' else ' ON records'
+                    conn.exec_driver_sql(f"DROP INDEX {preparer.quote(ix['name'])}{on}")
+            conn.exec_driver_sql('ALTER TABLE records DROP COLUMN category')
+            n = conn.exec_driver_sql('SELECT COUNT(*) FROM categories').scalar()
+        print(f"  + records.category 已换算为 category_id，共 {n} 个分类")
+    if 'category' in {c['name'] for c in insp.get_columns('daily_totals')}:
+        DailyTotal.__table__.drop(engine)
+        DailyTotal.__table__.create(engine)
+        print("  + 日汇总表按分类 id 重建")
+
+def convert_amounts_to_cents(engine):
+    """旧版本的 records.amount、daily_totals.total 为浮点数（元），换算为整数分后删除旧列
+
+    add_missing_columns 已经加上了 amount_cents / total_cents 列。日汇总换算后整体重建。
+    """
+    insp = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    integer = 'INTEGER' if engine.dialect.name == 'sqlite' else 'SIGNED'
+    converted = False
+    if 'amount' in {c['name'] for c in insp.get_columns('records')}:
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f'UPDATE records SET amount_cents = CAST(ROUND(amount * 100) AS {integer})')
+            # 包含旧列的索引要先删除才能删列，模型中的新索引随后由 create_missing_indexes 建立
+            for ix in insp.get_indexes('records'):
+                if 'amount' in ix['column_names']:
+                    on = '' if engine.dialect.name == 'sqlite' else ' ON records'
+                    conn.exec_driver_sql(f"DROP INDEX {preparer.quote(ix['name'])}{on}")
+            conn.exec_driver_sql('ALTER TABLE records DROP COLUMN amount')
+        print("  + records.amount 已换算为 amount_cents（分）")
+        converted = True
+    if 'total' in {c['name'] for c in insp.get_columns('daily_totals')}:
+        with engine.begin() as conn:
+            conn.exec_driver_sql('ALTER TABLE daily_totals DROP COLUMN total')
+        converted = True
+    if converted:
+        print(f"  + 按分重建日汇总 {rollup.rebuild(engine)} 行")
+
+def enforce_not_null(engine):
+    """add_missing_columns 补上的列可以为空（已有行要先回填），回填后按模型改为 NOT NULL
+
+    MySQL 用 ALTER TABLE ... MODIFY COLUMN；SQLite 不能修改列定义，按模型重建表再复制数据，
+    旧表的索引随表删除，由之后的 create_missing_indexes 补建。仍有空值又没有默认值的列无法加约束，抛出 RuntimeError。
+    """
+    insp = inspect(engine)
+    tables = set(insp.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        nullable = {c['name'] for c in insp.get_columns(table.name) if c['nullable']}
+        columns = [c for c in table.columns if not c.nullable and not c.primary_key and c.name in nullable]
+        if not columns:
+            continue
+        name = preparer.quote(table.name)
+        with engine.begin() as conn:
+            for column in columns:
+                quoted = preparer.quote(column.name)
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if default is not None:
+                    conn.exec_driver_sql(f"UPDATE {name} SET {quoted} = {default} WHERE {quoted} IS NULL")
+                nulls = conn.exec_driver_sql(f"SELECT COUNT(*) FROM {name} WHERE {quoted} IS NULL").scalar()
+                if nulls:
+                    raise RuntimeError(f"{table.name}.{column.name} 有 {nulls} 行为空，无法加上 NOT NULL 约束")
+            if engine.dialect.name == 'mysql':
+                for column in columns:
+                    ddl = f"{preparer.quote(column.name)} {column.type.compile(engine.dialect)} NOT NULL"
+                    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                    if default is not None:
+                        ddl += f" DEFAULT {default}"
+                    conn.exec_driver_sql(f"ALTER TABLE {name} MODIFY COLUMN {ddl}")
+            else:
+                old = preparer.quote(f'{table.name}__old')
+                for ix in insp.get_indexes(table.name):
+                    conn.exec_driver_sql(f"DROP INDEX {preparer.quote(ix['name'])}")
+                conn.exec_driver_sql(f"ALTER TABLE {name} RENAME TO {old}")
+                table.create(conn)
+                names = ', '.join(preparer.quote(c.name) for c in table.columns)
+                conn.exec_driver_sql(f"INSERT INTO {name} ({names}) SELECT {names} FROM {old}")
+                conn.exec_driver_sql(f"DROP TABLE {old}")
+        print(f"  + {table.name}: {', '.join(c.name for c in columns)} 改为 NOT NULL")
+
+def create_missing_indexes(engine):
+    """create_all 不会给已存在的表加索引，这里逐个补建"""
+    insp = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {ix['name'] for ix in insp.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(engine)
+                print(f"  + 索引 {table.name}.{index.name}")
+
+# 早期版本创建、已没有查询使用的索引（统计改为读 daily_totals 之后），每次写入还要维护它们
+OBSOLETE_INDEXES = {'records': ['ix_records_date_type_cents']}
+
+def drop_obsolete_indexes(engine):
+    """删除 OBSOLETE_INDEXES 中仍存在的索引"""
+    insp = inspect(engine)
+    tables = set(insp.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    for table, names in OBSOLETE_INDEXES.items():
+        if table not in tables:
+            continue
+        existing = {ix['name'] for ix in insp.get_indexes(table)}
+        for name in names:
+            if name in existing:
+                with engine.begin() as conn:
+                    if engine.dialect.name == 'mysql':
+                        conn.exec_driver_sql(f"DROP INDEX {preparer.quote(name)} ON {preparer.quote(table)}")
+                    else:
+                        conn.exec_driver_sql(f"DROP INDEX {preparer.quote(name)}")
+                print(f"  - 索引 {table}.{name}")
+
+def backfill_daily_totals(engine):
+    """日汇总表为空而 records 有数据时（旧数据库首次迁移），根据 records 回填"""
+    session = get_session(engine)
+    need = session.query(DailyTotal).first() is None and session.query(Record.id).first() is not None
+    session.close()
+    if need:
+        print(f"  + 回填日汇总 {rollup.rebuild(engine)} 行")
+
+def init_ledger_version(engine):
+    """旧数据库首次迁移时创建账本版本计数器，已有记录归入版本 1，使 since=0 的增量同步能取到它们"""
+    session = get_session(engine)
+    if session.get(LedgerMeta, 1) is None:
+        n = session.query(Record).filter(Record.version == 0).update({Record.version: 1}, synchronize_session=False)
+        session.add(LedgerMeta(id=1, version=1 if n else 0))
+        session.commit()
+        if n:
+            print(f"  + {n} 条已有记录归入账本版本 1")
+    session.close()
+
+def partition_records(engine):
+    """MySQL 上把 records 改为按年 RANGE 分区，已分区时补建到明年为止的分区（见 partitions.py）"""
+    for year in partitions.partition_mysql(engine):
+        print(f"  + 分区 records.p{year}")
+
+def create_search_index(engine):
+    """已有数据库补建全文索引表和删除触发器（见 search.py），并把不在索引中的记录（首次建索引前的记录、
+    不经过应用写入的记录）补进索引"""
+    session = get_session(engine)
+    try:
+        conn = session.connection()
+        search.create_index(conn)
+        n = sum(search.index_rows(conn, table) for table in partitions.tables(session))
+        if n:
+            print(f"  + 全文索引补入 {n} 条记录")
+        session.commit()
+    finally:
+        session.close()
+
+# 迁移步骤按顺序执行，每一步都必须是幂等的
+MIGRATIONS = [
+    ('创建缺失的表', create_missing_tables),
+    ('添加缺失的列', add_missing_columns),
+    ('分类名称换算为 id', convert_categories_to_ids),
+    ('金额换算为整数分', convert_amounts_to_cents),
+    ('NOT NULL 约束与模型一致', enforce_not_null),
+    ('创建缺失的索引', create_missing_indexes),
+    ('删除不再使用的索引', drop_obsolete_indexes),
+    ('回填日汇总表', backfill_daily_totals),
+    ('初始化账本版本', init_ledger_version),
+    ('MySQL 按年分区', partition_records),
+    ('创建全文索引', create_search_index),
+]
+
+def migrate(engine=None):
+    engine = engine or get_engine()
+    for description, step in MIGRATIONS:
+        print(f"• {description}")
+        step(engine)
+    return engine
+
+# ---------------------------------------------------------------------------
+# EXPLAIN 检查
+# ---------------------------------------------------------------------------
+
+# 覆盖 app.py 中各接口的查询形态：无过滤、日期范围、分类、游标翻页等
+EXPLAIN_REQUESTS = [
+    '/api/records',
+    '/api/records?start=2025-01-01&end=2025-01-31',
+    '/api/records?category=餐饮',
+    '/api/records?category=餐饮&start=2025-01-01&end=2025-01-31',
+    '/api/records?limit=20&fields=id,amount,date',
+    '/api/records?limit=20&cursor=__CURSOR__',
+    '/api/stats',
+    '/api/stats?start=2025-01-01&end=2025-01-31',
+    '/api/stats?year=2025&month=1',
+    '/api/year-stats?year=2025',
+    '/api/dashboard?start=2025-01-01&end=2025-01-31&month=2024-12&year=2025',
+    '/api/changes?since=5&limit=100',
+    '/api/records?q=午饭',
+    '/api/records?q=午饭 地铁&category=餐饮&start=2025-01-01&end=2025-01-31&limit=20',
+]
+
+def explain(conn, statement, parameters):
+    """返回查询计划中每一步的描述文本"""
+    if conn.dialect.name == 'sqlite':
+        rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+        return [row[3] for row in rows]
+    rows = conn.exec_driver_sql('EXPLAIN ' + statement, parameters).mappings().fetchall()
+    return [f"{row['table']} type={row['type']} key={row['key']}" for row in rows]
+
+# 需要检查的明细表；daily_totals 等汇总表的行数只与天数相关，允许全表扫描
+CHECKED_TABLES = ('records', 'records_fts')
+
+def full_scans(plan, dialect_name):
+    """找出明细表上没有走索引的全表扫描步骤"""
+    if dialect_name == 'sqlite':
+        # "SCAN records" 是全表扫描；"SCAN records USING (COVERING) INDEX ..." 是索引扫描
+        return [step for step in plan
+                if re.fullmatch(r'SCAN (\w+)', step) and step.split()[1] in CHECKED_TABLES]
+    return [step for step in plan
+            if ' type=ALL ' in step and step.split()[0] in CHECKED_TABLES]
+
+def check_query_plans(engine):
+    """通过 test client 调用各接口，捕获实际执行的 SELECT 并逐条 EXPLAIN
+
+    返回 [(sql, plan, full_scans), ...]，full_scans 为空表示该查询用上了索引。
+    """
+    import app as app_module
+    from app import encode_cursor
+
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            captured.append((statement, parameters))
+
+    orig_engine, orig_columnar, orig_replica = app_module.engine, app_module.columnar, app_module.replica_engine
+    app_module.engine = engine
+    # 检查的是统计接口的 SQL，列式快照的全量加载本来就是全表扫描；读请求也不走副本，只捕获 engine 上的查询
+    app_module.columnar = app_module.replica_engine = None
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        client = app_module.app.test_client()
+        cursor = encode_cursor(date(2025, 1, 15), 100)
+        for url in EXPLAIN_REQUESTS:
+            client.get(url.replace('__CURSOR__', cursor))
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+        app_module.engine, app_module.columnar, app_module.replica_engine = orig_engine, orig_columnar, orig_replica
+
+    results, seen = [], set()
+    with engine.connect() as conn:
+        for statement, parameters in captured:
+            if statement in seen:
+                continue
+            seen.add(statement)
+            plan = explain(conn, statement, parameters)
+            results.append((statement, plan, full_scans(plan, engine.dialect.name)))
+    return results
+
+def print_query_plans(engine):
+    ok = True
+    for statement, plan, scans in check_query_plans(engine):
+        mark = '✓' if not scans else '✗'
+        ok = ok and not scans
+        print(f"{mark} {' '.join(statement.split())}")
+        for step in plan:
+            print(f"    {step}")
+    return ok
+
+if __name__ == '__main__':
+    engine = migrate()
+    print('迁移完成。')
+    if '--explain' in sys.argv:
+        print('\n查询计划检查：')
+        if not print_query_plans(engine):
+            print('\n✗ 存在未使用索引的查询')
+            sys.exit(1)
+        print('\n✓ 所有查询均使用了索引')
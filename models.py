@@ -1,5 +1,7 @@
+import threading
+import weakref
 from datetime import date
-from sqlalchemy import Column, Integer, String, Float, Date, create_engine
+from sqlalchemy import Column, Integer, BigInteger, String, Date, Index, create_engine, event
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 Base = declarative_base()
@@ -8,10 +10,156 @@ class Record(Base):
     __tablename__ = 'records'
     id = Column(Integer, primary_key=True, autoincrement=True)
     type = Column(String(10), nullable=False)  # 'income' or 'expense'
-    amount = Column(Float, nullable=False)
-    category = Column(String(50), nullable=False)
+    amount_cents = Column(BigInteger, nullable=False)  # 金额，单位为分（见 money.py）
+    category_id = Column(Integer, nullable=False)  # categories.id，名称见 categories.py
     date = Column(Date, nullable=False)
     note = Column(String(200))
+    # 最后一次新增或修改时的账本版本（见 changelog.py），/api/changes 据此返回增量
+    version = Column(BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        # 记录列表按 (date, id) 倒序做游标分页
+        Index('ix_records_date_id', 'date', 'id'),
+        # 按分类过滤的记录列表
+        Index('ix_records_category_date', 'category_id', 'date', 'id'),
+        # 增量同步按版本查询变更
+        Index('ix_records_version', 'version', 'id'),
+    )
+
+@event.listens_for(Record.__table__, 'after_create')
+def _create_search_index(target, connection, **kw):
+    """新建 records 表时一并创建全文索引表和删除触发器（见 search.py）"""
+    import search
+    search.create_index(connection)
+
+class Category(Base):
+    """分类字典，每个分类名称一行，记录中只保存 id"""
+    __tablename__ = 'categories'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(50), nullable=False, unique=True)
+
+class DailyTotal(Base):
+    """按 (日期, 类型, 分类) 预聚合的日汇总，与 records 的增删改在同一事务中维护（见 rollup.py）"""
+    __tablename__ = 'daily_totals'
+    date = Column(Date, primary_key=True)
+    type = Column(String(10), primary_key=True)
+    category_id = Column(Integer, primary_key=True)
+    total_cents = Column(BigInteger, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
+
+class LedgerMeta(Base):
+    """只有一行（id=1），version 为账本版本计数器，每个写事务加一"""
+    __tablename__ = 'ledger_meta'
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+class RecordTombstone(Base):
+    """已删除记录的 id 和删除时的账本版本，供增量同步的客户端删除本地副本"""
+    __tablename__ = 'record_tombstones'
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    version = Column(BigInteger, nullable=False)
+    date = Column(Date)  # 被删除记录的日期，用于推送受影响月份的统计
+
+    __table_args__ = (
+        Index('ix_record_tombstones_version', 'version'),
+    )
+
+class ArchivedYear(Base):
+    """已归档（关闭）的年份，见 partitions.py；归档后该年的记录和汇总不再允许修改"""
+    __tablename__ = 'archived_years'
+    year = Column(Integer, primary_key=True, autoincrement=False)
+    records = Column(Integer, nullable=False, default=0)  # 归档时的记录条数
+    # 该年记录的最大版本，增量同步 since 不小于它时跳过归档表
+    max_version = Column(BigInteger, nullable=False, default=0)
+
+class YearTotal(Base):
+    """归档年份冻结的按 (月份, 类型) 汇总，过去年份的年度统计直接读取，最多 24 行"""
+    __tablename__ = 'year_totals'
+    year = Column(Integer, primary_key=True, autoincrement=False)
+    month = Column(Integer, primary_key=True, autoincrement=False)
+    type = Column(String(10), primary_key=True)
+    total_cents = Column(BigInteger, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
+
+class ImportCheckpoint(Base):
+    """流式导入的断点，与每批记录在同一事务中更新，崩溃后从 offset 继续不会重复或遗漏（见 ingest.py）"""
+    __tablename__ = 'import_checkpoints'
+    source = Column(String(191), primary_key=True)  # 导入来源，命令行为文件的绝对路径
+    offset = Column(BigInteger, nullable=False, default=0)  # 已提交部分在文件中的结束字节偏移
+    inserted = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+
+# 全局唯一的会话工厂，不再每次调用 get_session 时重新创建 sessionmaker；绑定的引擎在创建会话时指定
+SessionFactory = sessionmaker(future=True)
+
+def _config():
+    try:
+        from config import Config
+    except ImportError:
+        return None
+    return Config
+
+def is_sqlite_memory(db_uri):
+    return db_uri.startswith('sqlite') and (db_uri in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in db_uri)
+
+def is_sqlite_file(db_uri):
+    return db_uri.startswith('sqlite') and not is_sqlite_memory(db_uri)
+
+def pool_options(db_uri):
+    """连接池参数，从 config.Config 读取（DB_POOL_* 环境变量）
+
+    默认不做 pre-ping（每次取出连接都要多一次往返），改为定期回收连接，避开 MySQL wait_timeout；
+    连接真的断开时 SQLAlchemy 会作废整个池并重连。SQLite 内存库使用单连接池，不适用这些参数。
+    """
+    Config = _config()
+    options = {
+        'pool_size': getattr(Config, 'DB_POOL_SIZE', 5),
+        'max_overflow': getattr(Config, 'DB_MAX_OVERFLOW', 10),
+        'pool_timeout': getattr(Config, 'DB_POOL_TIMEOUT', 30),
+        'pool_recycle': getattr(Config, 'DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': getattr(Config, 'DB_POOL_PRE_PING', False),
+    }
+    if is_sqlite_memory(db_uri):
+        return {'pool_pre_ping': options['pool_pre_ping']}
+    return options
+
+def sqlite_pragmas():
+    """SQLite 文件库每个连接建立时执行的 PRAGMA（SQLITE_* 环境变量）
+
+    WAL 模式下读不阻塞写、写不阻塞读；synchronous=NORMAL 在 WAL 下只在检查点时 fsync，
+    断电可能丢失最后几个事务但不会损坏数据库；cache_size 为负数时单位是 KiB。
+    """
+    Config = _config()
+    return [
+        ('journal_mode', getattr(Config, 'SQLITE_JOURNAL_MODE', 'WAL')),
+        ('synchronous', getattr(Config, 'SQLITE_SYNCHRONOUS', 'NORMAL')),
+        ('cache_size', -1024 * getattr(Config, 'SQLITE_CACHE_SIZE_MB', 64)),
+        ('mmap_size', 1024 * 1024 * getattr(Config, 'SQLITE_MMAP_SIZE_MB', 256)),
+        ('busy_timeout', getattr(Config, 'SQLITE_BUSY_TIMEOUT_MS', 5000)),
+        ('temp_store', 'MEMORY'),
+    ]
+
+def _install_sqlite_events(engine, immediate=False):
+    """通过 connect 事件为每个新连接设置 PRAGMA；immediate 为 True 时事务以 BEGIN IMMEDIATE 开始
+
+    pysqlite 默认在第一条 INSERT/UPDATE 前才发出 BEGIN，先读后写的事务在升级为写锁时可能直接报
+    database is locked。关闭驱动自己的事务管理、由 begin 事件发出 BEGIN IMMEDIATE，事务一开始就拿到写锁。
+    """
+    pragmas = sqlite_pragmas()
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        if immediate:
+            dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    if immediate:
+        @event.listens_for(engine, 'begin')
+        def begin_immediate(conn):
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
 
 def get_engine(db_uri=None):
     """
@@ -19,15 +167,68 @@ def get_engine(db_uri=None):
     db_uri: 数据库连接字符串，如果不提供则从 config.py 读取
     """
     if db_uri is None:
-        try:
-            from config import Config
-            db_uri = Config.SQLALCHEMY_DATABASE_URI
-        except ImportError:
-            # 如果没有配置文件，使用 SQLite
-            db_uri = 'sqlite:///records.db'
+        Config = _config()
+        # 如果没有配置文件，使用 SQLite
+        db_uri = Config.SQLALCHEMY_DATABASE_URI if Config else 'sqlite:///records.db'
     
-    return create_engine(db_uri, echo=False, future=True, pool_pre_ping=True)
+    engine = create_engine(db_uri, echo=False, future=True, **pool_options(db_uri))
+    if is_sqlite_file(db_uri):
+        _install_sqlite_events(engine)
+    return engine
+
+# 读引擎 -> 写引擎，随读引擎一起回收
+_writers = weakref.WeakKeyDictionary()
+_writers_lock = threading.Lock()
+
+def writer_engine(engine):
+    """写事务使用的引擎
+
+    SQLite 文件库（SQLITE_SINGLE_WRITER=1，默认）返回同一文件上只有一个连接的引擎，事务以
+    BEGIN IMMEDIATE 开始：并发的写请求在连接池中排队，而不是在 SQLite 的锁上重试或报错；
+    读请求继续使用 engine 的连接池，WAL 下可以与写并行。MySQL 和 SQLite 内存库返回 engine 本身。
+    """
+    url = engine.url.render_as_string(hide_password=False)
+    if not is_sqlite_file(url) or not getattr(_config(), 'SQLITE_SINGLE_WRITER', True):
+        return engine
+    with _writers_lock:
+        writer = _writers.get(engine)
+        if writer is None:
+            options = dict(pool_options(url), pool_size=1, max_overflow=0)
+            writer = _writers[engine] = create_engine(url, echo=False, future=True, **options)
+            _install_sqlite_events(writer, immediate=True)
+        return writer
+
+def dispose_engine(engine):
+    """关闭 engine 及其写引擎的所有连接（SQLite 在最后一个连接关闭时合并并删除 -wal 文件）"""
+    with _writers_lock:
+        writer = _writers.pop(engine, None)
+    if writer is not None:
+        writer.dispose()
+    engine.dispose()
 
 def get_session(engine):
-    Session = sessionmaker(bind=engine, future=True)
-    return Session()
+    """新建一个绑定到 engine 的会话，由调用方关闭；请求内请使用 app.request_session()"""
+    return SessionFactory(bind=engine)
+
+def insert_many(conn, table, columns, rows, suffix=''):
+    """把 rows（与 columns 顺序一致的元组）用 DBAPI 的 executemany 插入 table
+
+    跳过 SQLAlchemy 逐行构造参数字典和类型处理的开销（批量写入中约占一半时间），只对需要转换的列
+    （如 SQLite 上的日期）调用一次列类型的 bind processor。columns 为列的 key，conn 为 Connection。
+    suffix 附加在 VALUES 之后，如 upsert 的冲突处理子句（见 rollup._upsert）。
+    """
+    if not rows:
+        return
+    dialect = conn.dialect
+    preparer = dialect.identifier_preparer
+    columns = [table.c[key] for key in columns]
+    processors = [(i, p) for i, p in enumerate(c.type.bind_processor(dialect) for c in columns) if p is not None]
+    if processors:
+        rows = [list(row) for row in rows]
+        for row in rows:
+            for i, process in processors:
+                row[i] = process(row[i])
+    placeholder = '?' if dialect.paramstyle == 'qmark' else '%s'
+    sql = (f"INSERT INTO {preparer.format_table(table)} ({', '.join(preparer.quote(c.name) for c in columns)}) "
+           f"VALUES ({', '.join([placeholder] * len(columns))}){suffix}")
+    conn.exec_driver_sql(sql, [tuple(row) for row in rows])
@@ -0,0 +1,39 @@
+"""
+金额换算
+数据库中金额以整数分（BIGINT）存储，求和在 SQL 中按整数进行，结果精确；
+只在接收请求和输出 JSON 时与 "12.50" 形式的十进制字符串互相转换。
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+CENT = Decimal('0.01')
+# 单笔金额上限（分）：1 万亿元。远小于 BIGINT 上限（约 9.2e18），日汇总、年度合计累加大量记录也不会溢出
+MAX_CENTS = 10 ** 14
+MAX_AMOUNT = Decimal(MAX_CENTS) / 100
+
+def to_cents(value):
+    """将请求中的金额（字符串或数字）转换为整数分，按四舍五入保留两位小数
+
+    参数无效或绝对值超过 MAX_CENTS 时抛出 ValueError。浮点数先转为字符串，0.1 得到 10 分而不是 0.1000000000000000055... 元。
+    """
+    if isinstance(value, bool) or value is None:
+        raise ValueError(f'无效的金额: {value!r}')
+    try:
+        amount = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f'无效的金额: {value!r}')
+    if not amount.is_finite():
+        raise ValueError(f'无效的金额: {value!r}')
+    # 先比较再取整：指数很大的值（如 1e1000000）做 abs()、quantize 等运算会超出 Decimal 的范围，copy_abs 不做舍入
+    if amount.copy_abs() > MAX_AMOUNT:
+        raise ValueError(f'金额超出范围: {value!r}')
+    cents = int(amount.quantize(CENT, rounding=ROUND_HALF_UP) * 100)
+    if abs(cents) > MAX_CENTS:
+        raise ValueError(f'金额超出范围: {value!r}')
+    return cents
+
+def format_cents(cents):
+    """整数分转为两位小数的字符串，如 1250 -> '12.50'、-5 -> '-0.05'"""
+    cents = int(cents or 0)
+    sign = '-' if cents < 0 else ''
+    yuan, fen = divmod(abs(cents), 100)
+    return f'{sign}{yuan}.{fen:02d}'
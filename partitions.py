@@ -0,0 +1,247 @@
+"""
+按年分区与冷数据归档
+- MySQL：records 按 YEAR(date) 做原生 RANGE 分区（python migrate.py 执行 ALTER TABLE，主键改为 (id, date)），
+  每年一个分区外加 pmax，按日期过滤的查询由优化器裁剪到相关分区；每年年底执行一次
+  python partitions.py add-partitions 从 pmax 拆出新一年的分区。
+- SQLite：归档的年份移到同一数据库中每年一张表 records_<年>，列和索引与 records 相同，records 只保存未归档的年份。
+  tables() 返回与查询日期范围有交集的表（从新到旧），记录列表、导出、增量同步和列式快照逐表查询。
+
+归档（python partitions.py archive 2022）按从旧到新的顺序关闭截至该年的所有年份：该年的按月汇总冻结到
+year_totals，过去年份的 /api/year-stats 直接读取这最多 24 行；之后已归档年份的记录不允许新增、修改或删除，
+日汇总表中这些年份的行也随之不再变化。当前年份不能归档。
+"""
+import sys
+import threading
+from datetime import date
+from sqlalchemy import Column, Index, MetaData, Table, and_, delete, extract, func, select
+
+import search
+from models import ArchivedYear, DailyTotal, Record, YearTotal, get_engine, get_session, writer_engine
+
+# 归档表不属于 models.Base，migrate.py 的 create_all 不会创建它们
+archive_metadata = MetaData()
+_archive_lock = threading.Lock()
+
+def archive_table(year):
+    """SQLite 上保存 year 年已归档记录的表"""
+    name = f'records_{year}'
+    with _archive_lock:
+        table = archive_metadata.tables.get(name)
+        if table is None:
+            columns = [Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable, autoincrement=False)
+                       for c in Record.__table__.columns]
+            table = Table(name, archive_metadata, *columns,
+                          Index(f'ix_{name}_date_id', 'date', 'id'),
+                          Index(f'ix_{name}_category_date', 'category_id', 'date', 'id'),
+                          Index(f'ix_{name}_version', 'version'))
+        return table
+
+def per_year_tables(session):
+    """归档记录是否移到每年一张表；MySQL 使用原生分区，记录留在 records 中"""
+    return session.get_bind().dialect.name != 'mysql'
+
+def archived(session):
+    """已归档的 {年份: 该年记录的最大版本}，同一会话内只查询一次"""
+    years = session.info.get('archived_years')
+    if years is None:
+        years = session.info['archived_years'] = dict(
+            session.query(ArchivedYear.year, ArchivedYear.max_version).all())
+    return years
+
+def closed_through(session):
+    """最后一个已归档的年份，没有时为 None；该年及之前的日期都不允许写入"""
+    years = archived(session)
+    return max(years) if years else None
+
+def check_writable(session, *dates):
+    """dates 中有已归档年份的日期时抛出 ValueError"""
+    closed = closed_through(session)
+    if closed is None:
+        return
+    for d in dates:
+        if d is not None and d.year <= closed:
+            raise ValueError(f'{d.year} 年已归档，不能新增、修改或删除该年的记录')
+
+def tables(session, start=None, end=None, since=None):
+    """与 [start, end] 有交集的记录表，按日期从新到旧（None 表示不限）
+
+    归档按从旧到新的顺序进行，records 中的日期都晚于所有归档年份，逐表查询的结果拼起来仍是倒序。
+    since 给出时跳过归档后没有更新变更的表（增量同步）。
+    """
+    live = Record.__table__
+    years = archived(session) if per_year_tables(session) else {}
+    if not years:
+        return [live]
+    result = []
+    if end is None or end.year > max(years):
+        result.append(live)
+    for year in sorted(years, reverse=True):
+        if start is not None and start.year > year:
+            break
+        if end is not None and end.year < year:
+            continue
+        if since is None or since < years[year]:
+            result.append(archive_table(year))
+    return result
+
+def archived_year_of(session, rid):
+    """id 为 rid 的记录所在的归档年份，不在归档表中时为 None"""
+    if not per_year_tables(session):
+        return None
+    for year in archived(session):
+        table = archive_table(year)
+        if session.execute(select(table.c.id).where(table.c.id == rid)).first() is not None:
+            return year
+    return None
+
+def frozen_monthly_totals(session, year):
+    """已归档年份冻结的 {月份: {'income', 'expense'}}（分），未归档时返回 None"""
+    if year not in archived(session):
+        return None
+    months = {m: {'income': 0, 'expense': 0} for m in range(1, 13)}
+    rows = session.query(YearTotal.month, YearTotal.type, YearTotal.total_cents).filter(YearTotal.year == year).all()
+    for m, t, total in rows:
+        if t in ('income', 'expense'):
+            months[m][t] = total
+    return months
+
+def archive_year(engine, year):
+    """归档一年：冻结按月汇总，SQLite 上把记录移到 records_<年>；返回归档的记录条数
+
+    整个过程在一个写事务中完成；必须先归档更早的年份。年份不合法时抛出 ValueError。
+    """
+    if year >= date.today().year:
+        raise ValueError(f'{year} 年尚未结束，不能归档')
+    session = get_session(writer_engine(engine))
+    try:
+        existing = session.get(ArchivedYear, year)
+        if existing is not None:
+            return existing.records
+        first = session.query(func.min(Record.date)).scalar()
+        if first is not None and first.year < year:
+            raise ValueError(f'请先归档 {first.year} 年（按从旧到新的顺序归档）')
+        start, end = date(year, 1, 1), date(year + 1, 1, 1)
+        month_col = extract('month', DailyTotal.date)
+        totals = session.query(
+            month_col, DailyTotal.type, func.sum(DailyTotal.total_cents), func.sum(DailyTotal.count)
+        ).filter(DailyTotal.date >= start, DailyTotal.date < end).group_by(month_col, DailyTotal.type).all()
+        session.add_all([YearTotal(year=year, month=int(m), type=t, total_cents=int(total), count=int(count))
+                         for m, t, total, count in totals])
+        in_year = and_(Record.date >= start, Record.date < end)
+        count, max_version, moved_max = session.query(
+            func.count(Record.id), func.max(Record.version), func.max(Record.id)).filter(in_year).one()
+        if per_year_tables(session):
+            # SQLite 的新 id 为表中现有最大 id 加一：移走的记录如果包含最大的 id，之后的新记录会重用它们，
+            # 增量同步的客户端会把两条记录当成同一条
+            kept_max = session.query(func.max(Record.id)).filter(Record.date >= end).scalar()
+            if moved_max is not None and (kept_max is None or kept_max < moved_max):
+                raise ValueError(f'{year} 年包含 id 最大的记录，归档后新记录会重用这些 id；请先新增一条 {year} 年之后的记录再归档')
+            table = archive_table(year)
+            conn = session.connection()
+            table.create(conn, checkfirst=True)
+            records = Record.__table__
+            conn.execute(table.insert().from_select([c.name for c in records.columns],
+                                                    select(*records.columns).where(in_year)))
+            conn.execute(delete(records).where(in_year))
+            # records 上的删除触发器把这些记录从全文索引中删掉了，归档后仍然可以搜索
+            if search.index_exists(conn):
+                search.index_rows(conn, table)
+        session.add(ArchivedYear(year=year, records=count, max_version=max_version or 0))
+        session.commit()
+        return count
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def archive_through(engine, year):
+    """按从旧到新的顺序归档截至 year 的所有年份，返回 {年份: 记录条数}"""
+    session = get_session(engine)
+    try:
+        first = session.query(func.min(Record.date)).scalar()
+        closed = closed_through(session)
+    finally:
+        session.close()
+    if closed is not None:
+        start = closed + 1
+    else:
+        start = first.year if first is not None else year
+    return {y: archive_year(engine, y) for y in range(start, year + 1)}
+
+# ---------------------------------------------------------------------------
+# MySQL 原生分区
+# ---------------------------------------------------------------------------
+
+def _partition(year):
+    return f'PARTITION p{year} VALUES LESS THAN ({year + 1})'
+
+def mysql_partitions(conn):
+    """records 已有的分区名，未分区时为空"""
+    return [row[0] for row in conn.exec_driver_sql(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'records' AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION")]
+
+def partition_mysql(engine):
+    """把 records 改为按 YEAR(date) 的 RANGE 分区，已分区时从 pmax 拆出到明年为止缺少的分区
+
+    MySQL 要求分区列包含在每个唯一键中，主键改为 (id, date)；id 仍是自增列和主键的第一列。
+    返回新建的分区年份列表。
+    """
+    if engine.dialect.name != 'mysql':
+        return []
+    this_year = date.today().year
+    with engine.begin() as conn:
+        first, last = conn.exec_driver_sql('SELECT MIN(YEAR(date)), MAX(YEAR(date)) FROM records').first()
+        last = max(last or this_year, this_year + 1)
+        existing = mysql_partitions(conn)
+        if not existing:
+            years = list(range(first or this_year, last + 1))
+            parts = [_partition(y) for y in years] + ['PARTITION pmax VALUES LESS THAN MAXVALUE']
+            conn.exec_driver_sql('ALTER TABLE records DROP PRIMARY KEY, ADD PRIMARY KEY (id, date) '
+                                 f"PARTITION BY RANGE (YEAR(date)) ({', '.join(parts)})")
+            return years
+        newest = max(int(name[1:]) for name in existing if name != 'pmax')
+        years = list(range(newest + 1, last + 1))
+        if years:
+            parts = [_partition(y) for y in years] + ['PARTITION pmax VALUES LESS THAN MAXVALUE']
+            conn.exec_driver_sql(f"ALTER TABLE records REORGANIZE PARTITION pmax INTO ({', '.join(parts)})")
+        return years
+
+def main(argv):
+    usage = '用法: python partitions.py archive <年份> | add-partitions | status'
+    if not argv:
+        print(usage)
+        return 2
+    engine = get_engine()
+    if argv[0] == 'archive' and len(argv) == 2:
+        try:
+            archived_counts = archive_through(engine, int(argv[1]))
+        except ValueError as e:
+            print(f'✗ {e}')
+            return 1
+        for year, count in archived_counts.items():
+            print(f'✓ {year} 年已归档，{count} 条记录')
+        if not archived_counts:
+            print('没有需要归档的年份')
+        return 0
+    if argv[0] == 'add-partitions':
+        years = partition_mysql(engine)
+        print(f"✓ 新建分区: {', '.join(map(str, years))}" if years else '没有需要新建的分区')
+        return 0
+    if argv[0] == 'status':
+        session = get_session(engine)
+        try:
+            for year, records in session.query(ArchivedYear.year, ArchivedYear.records).order_by(ArchivedYear.year):
+                print(f'{year}: 已归档，{records} 条记录')
+            if engine.dialect.name == 'mysql':
+                print(f"MySQL 分区: {', '.join(mysql_partitions(session.connection())) or '未分区'}")
+        finally:
+            session.close()
+        return 0
+    print(usage)
+    return 2
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
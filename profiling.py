@@ -0,0 +1,166 @@
+"""
+请求级性能剖析与慢查询日志（默认关闭，PROFILE_REQUESTS=1 开启）
+- 通过 SQLAlchemy 的 before/after_cursor_execute 事件统计每个请求的查询次数和 SQL 耗时，
+  JSON 序列化耗时在 Flask 的 JSON provider 中统计，结果写入 Server-Timing 响应头，
+  浏览器开发者工具的 Network -> Timing 中可以直接看到；
+- 单条 SQL 超过 SLOW_QUERY_MS 毫秒时，连同参数和请求路径写入慢查询日志（JSON Lines，
+  SLOW_QUERY_LOG 指定文件，否则输出到 stderr）；
+- PROFILE_SAMPLE_RATE > 0 时按比例对请求启用 cProfile，只保留最慢的 PROFILE_KEEP 个请求的
+  .prof 文件（PROFILE_DIR），可用 python -m pstats 或 snakeviz 查看。
+
+事件监听挂在 Engine 类上，对 app.engine 之后被替换的引擎同样生效；关闭时移除监听，没有额外开销。
+"""
+import cProfile
+import heapq
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from flask import g, has_app_context, request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 慢查询日志中参数的最大长度，executemany 的参数可能非常长
+MAX_PARAMS_LENGTH = 2000
+
+def _current():
+    """当前请求的统计，不在请求中或未开启时返回 None"""
+    if has_app_context():
+        return g.get('profile')
+    return None
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """统计 jsonify 的序列化耗时"""
+
+    def response(self, *args, **kwargs):
+        stats = _current()
+        if stats is None:
+            return super().response(*args, **kwargs)
+        t0 = time.perf_counter()
+        try:
+            return super().response(*args, **kwargs)
+        finally:
+            stats['serialize'] += time.perf_counter() - t0
+
+class Profiler:
+    """挂在 Flask 应用上的剖析器，enable() / disable() 可在运行时切换"""
+
+    def __init__(self, app=None, slow_ms=200, slow_log=None, sample_rate=0.0, profile_dir=None, keep=20):
+        self.enabled = False
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.profile_dir = profile_dir or os.path.join(tempfile.gettempdir(), 'ledger_profiles')
+        self.keep = keep
+        # 已保存的最慢请求 (耗时, 文件路径)，小顶堆
+        self._slowest = []
+        self._lock = threading.Lock()
+        self.slow_log = logging.getLogger('ledger.slow_query')
+        self.slow_log.propagate = False
+        if not self.slow_log.handlers:
+            handler = logging.FileHandler(slow_log, encoding='utf-8') if slow_log else logging.StreamHandler()
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.slow_log.addHandler(handler)
+            self.slow_log.setLevel(logging.INFO)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.json = TimedJSONProvider(app)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def enable(self):
+        if not self.enabled:
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            self.enabled = True
+
+    def disable(self):
+        if self.enabled:
+            event.remove(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.remove(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            self.enabled = False
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('query_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        stats = _current()
+        if stats is not None:
+            stats['queries'] += 1
+            stats['sql'] += elapsed
+        if elapsed * 1000 >= self.slow_ms:
+            params = repr(parameters)
+            if len(params) > MAX_PARAMS_LENGTH:
+                params = params[:MAX_PARAMS_LENGTH] + '...'
+            self.slow_log.info(json.dumps({
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'ms': round(elapsed * 1000, 2),
+                'path': request.full_path if stats is not None else None,
+                'executemany': executemany,
+                'sql': ' '.join(statement.split()),
+                'params': params,
+            }, ensure_ascii=False))
+
+    def _before_request(self):
+        if not self.enabled:
+            return
+        g.profile = {'start': time.perf_counter(), 'queries': 0, 'sql': 0.0, 'serialize': 0.0, 'cprofile': None}
+        if self.sample_rate and random.random() < self.sample_rate:
+            g.profile['cprofile'] = cProfile.Profile()
+            g.profile['cprofile'].enable()
+
+    def _after_request(self, response):
+        stats = g.pop('profile', None)
+        if stats is None:
+            return response
+        total = time.perf_counter() - stats['start']
+        if stats['cprofile'] is not None:
+            stats['cprofile'].disable()
+            self._keep_profile(stats['cprofile'], total)
+        # 响应体为流式生成器（如 /api/export）时，这里只统计到开始发送为止
+        response.headers.add('Server-Timing', ', '.join([
+            f'db;dur={stats["sql"] * 1000:.2f};desc="{stats["queries"]} queries"',
+            f'serialize;dur={stats["serialize"] * 1000:.2f}',
+            f'app;dur={(total - stats["sql"] - stats["serialize"]) * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ]))
+        return response
+
+    def _teardown_request(self, exc=None):
+        # 处理函数抛出异常时 after_request 不会执行，这里停止 cProfile
+        stats = g.pop('profile', None)
+        if stats is not None and stats['cprofile'] is not None:
+            stats['cprofile'].disable()
+
+    def _keep_profile(self, profile, total):
+        """只保存最慢的 keep 个请求，更慢的请求到来时删除堆中最快的一个"""
+        with self._lock:
+            if len(self._slowest) >= self.keep and total <= self._slowest[0][0]:
+                return
+            os.makedirs(self.profile_dir, exist_ok=True)
+            name = re.sub(r'[^\w.-]+', '_', f'{request.method}{request.path}').strip('_')
+            path = os.path.join(self.profile_dir, f'{total * 1000:09.1f}ms-{name}-{time.time_ns()}.prof')
+            profile.dump_stats(path)
+            heapq.heappush(self._slowest, (total, path))
+            if len(self._slowest) > self.keep:
+                _, evicted = heapq.heappop(self._slowest)
+                try:
+                    os.remove(evicted)
+                except OSError:
+                    pass
+
+    def profiles(self):
+        """已保存的 .prof 文件，按耗时从慢到快"""
+        with self._lock:
+            return [path for _, path in sorted(self._slowest, reverse=True)]
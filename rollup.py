@@ -0,0 +1,113 @@
+"""
+日汇总表 daily_totals 的维护
+写接口在提交前调用 record_added / record_removed，使汇总与 records 在同一事务中更新；
+统计接口只读汇总表，耗时取决于日期范围内的天数而不是记录条数。
+用法：
+    python rollup.py rebuild   # 根据 records 全量重建汇总（历史数据回填）
+"""
+import sys
+from sqlalchemy import bindparam, func, insert, select, delete
+from models import DailyTotal, get_engine, get_session, insert_many
+import partitions
+
+# 汇总行的主键列和累加的列
+KEY_COLUMNS = ('date', 'type', 'category_id')
+SUM_COLUMNS = ('total_cents', 'count')
+
+def _upsert(session, values):
+    """将 total_cents/count 增量累加到对应的汇总行，行不存在时插入
+
+    values 为 (日期, 类型, 分类 id, 金额（分）, 条数) 元组列表。SQLite / MySQL 上用一条 upsert 语句经
+    models.insert_many 直接 executemany：批量写入时汇总行数与记录数同一量级，逐组构造参数字典的开销不可忽略。
+    """
+    table = DailyTotal.__table__
+    dialect = session.get_bind().dialect.name
+    if dialect in ('sqlite', 'mysql'):
+        conn = session.connection()
+        quote = conn.dialect.identifier_preparer.quote
+        if dialect == 'sqlite':
+            suffix = (f" ON CONFLICT ({', '.join(map(quote, KEY_COLUMNS))}) DO UPDATE SET "
+                      + ', '.join(f'{quote(c)} = {quote(c)} + excluded.{quote(c)}' for c in SUM_COLUMNS))
+        else:
+            suffix = ' ON DUPLICATE KEY UPDATE ' + ', '.join(f'{quote(c)} = {quote(c)} + VALUES({quote(c)})'
+                                                             for c in SUM_COLUMNS)
+        insert_many(conn, table, KEY_COLUMNS + SUM_COLUMNS, values, suffix)
+    else:
+        for v in (dict(zip(KEY_COLUMNS + SUM_COLUMNS, v)) for v in values):
+            row = session.get(DailyTotal, (v['date'], v['type'], v['category_id']), with_for_update=True)
+            if row:
+                row.total_cents += v['total_cents']
+                row.count += v['count']
+            else:
+                session.add(DailyTotal(**v))
+        session.flush()
+
+def apply_deltas(session, deltas):
+    """批量累加增量，deltas 为 {(日期, 类型, 分类 id): (金额（分）, 条数)}，计数归零的行会被删除"""
+    if not deltas:
+        return
+    _upsert(session, [key + tuple(delta) for key, delta in deltas.items()])
+    emptied = [{'d': d, 't': t, 'c': category_id}
+               for (d, t, category_id), (_, count) in deltas.items() if count < 0]
+    if emptied:
+        table = DailyTotal.__table__
+        session.execute(delete(table).where(
+            table.c.date == bindparam('d'),
+            table.c.type == bindparam('t'),
+            table.c.category_id == bindparam('c'),
+            table.c.count <= 0
+        ), emptied)
+
+def apply_delta(session, d, t, category_id, amount, count):
+    """对单个 (日期, 类型, 分类) 汇总行累加增量"""
+    apply_deltas(session, {(d, t, category_id): (amount, count)})
+
+def snapshot(rec):
+    """记录修改前保存影响汇总的字段，供 record_removed 使用"""
+    return {'date': rec.date, 'type': rec.type, 'category_id': rec.category_id, 'amount_cents': rec.amount_cents}
+
+def record_added(session, rec):
+    apply_delta(session, rec.date, rec.type, rec.category_id, rec.amount_cents, 1)
+
+def record_removed(session, rec):
+    """rec 可以是 Record 实例，也可以是 snapshot() 返回的字典"""
+    if isinstance(rec, dict):
+        apply_delta(session, rec['date'], rec['type'], rec['category_id'], -rec['amount_cents'], -1)
+    else:
+        apply_delta(session, rec.date, rec.type, rec.category_id, -rec.amount_cents, -1)
+
+def record_updated(session, old, rec):
+    """old 为修改前的 snapshot()；日期、类型、分类、金额中任一变化都会先减后加"""
+    if old == snapshot(rec):
+        return
+    record_removed(session, old)
+    record_added(session, rec)
+
+def rebuild(engine=None):
+    """清空并根据 records（以及已归档年份的表，见 partitions.py）全量重建 daily_totals，返回汇总行数"""
+    engine = engine or get_engine()
+    session = get_session(engine)
+    session.execute(delete(DailyTotal))
+    # 各表的年份互不重叠，逐表插入不会产生重复的汇总行
+    for table in partitions.tables(session):
+        c = table.c
+        source = select(
+            c.date,
+            c.type,
+            c.category_id,
+            func.sum(c.amount_cents),
+            func.count(c.id)
+        ).group_by(c.date, c.type, c.category_id)
+        session.execute(insert(DailyTotal).from_select(
+            ['date', 'type', 'category_id', 'total_cents', 'count'], source
+        ))
+    session.commit()
+    n = session.query(func.count()).select_from(DailyTotal).scalar()
+    session.close()
+    return n
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['rebuild']:
+        print(__doc__)
+        sys.exit(1)
+    print(f"✓ 日汇总已重建，共 {rebuild()} 行")
@@ -0,0 +1,190 @@
+"""
+记录备注和分类名称的全文搜索（GET /api/records?q=）
+全文索引放在单独的 records_fts 表中，写入记录的代码（ingest.insert_batch、新增/修改接口、write-behind）
+在同一事务中调用 add_to_index() 整批写入索引行，批量新增和导入则在全部批次提交后用 index_rows() 一次补齐；
+删除由 records 上的触发器完成（不调用自定义函数）。
+- SQLite：FTS5 虚拟表。内置分词器不能切分中文（unicode61 把连续汉字当作一个词，trigram 搜不到两个字的词），
+  写入前在 Python 中用 ngrams() 把连续的中日韩文字切成相邻两个字的词（地铁卡 -> 地铁 铁卡 卡）。
+- MySQL：records 按年分区后不能建 FULLTEXT 索引，records_fts 为普通 InnoDB 表，FULLTEXT 索引使用 ngram 分词器
+  （ngram_token_size 默认为 2，与 SQLite 一致），写入原文。创建删除触发器需要 TRIGGER 权限，开启 binlog 时还需要
+  log_bin_trust_function_creators=1。
+不经过应用写入的记录（sqlite3 命令行、外部导入工具）不在索引中，重新执行 python migrate.py 时补进索引。
+
+每个搜索词按短语匹配（词内的字必须相邻），多个词之间为“且”；只有一个汉字的词按前缀匹配。
+结果按相关度（SQLite 为 bm25，MySQL 为 MATCH 的得分）从高到低排序，相同时较新的记录在前。
+SQLite 上没有日期范围时只对最新的 SEARCH_WINDOW 条匹配记录排序（见 app.records_query）。
+"""
+import re
+import weakref
+from functools import lru_cache
+from sqlalchemy import Column, Integer, MetaData, String, Table, delete, literal_column, select
+from sqlalchemy.dialects.mysql import match
+
+from models import Category, insert_many
+
+# records_fts 不属于 models.Base，由 models 中 records 的 after_create 事件和 migrate.py 创建
+search_metadata = MetaData()
+
+# 中日韩文字（平假名、片假名、汉字、兼容汉字、谚文）
+CJK = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+')
+
+@lru_cache(maxsize=65536)
+def ngrams(text, query=False):
+    """把连续的中日韩文字切成相邻两个字的词，其他文字原样保留（由 FTS5 的 unicode61 分词器按空白和标点切分）
+
+    索引时每段连续文字末尾再加上最后一个字，只有一个汉字的搜索词按前缀匹配时也能匹配到段尾的字；
+    query 为 True 时（切分搜索词）不加，否则短语中多出的词会导致匹配不到。
+    分类名称和常见备注（午餐、地铁）反复出现，缓存切分结果，批量写入时不必逐条重新切分。
+    """
+    if not text:
+        return text
+
+    def split(m):
+        run = m.group()
+        grams = [run[i:i + 2] for i in range(len(run) - 1)]
+        if not query or len(run) == 1:
+            grams.append(run[-1])
+        return ' ' + ' '.join(grams) + ' '
+    return CJK.sub(split, text)
+
+def terms(q):
+    """搜索词：按空白切分，去掉不含文字和数字的部分"""
+    return [t for t in q.split() if re.search(r'\w', t)]
+
+def fts_query(q):
+    """SQLite FTS5 的 MATCH 表达式：每个词一个带前缀匹配的短语，多个短语之间为 AND"""
+    phrases = []
+    for term in terms(q):
+        tokens = ngrams(term, query=True).split()
+        phrases.append('"' + ' '.join(tokens).replace('"', '""') + '"*')
+    return ' '.join(phrases)
+
+def boolean_query(q):
+    """MySQL 布尔模式的 AGAINST 表达式：每个词为必须出现的短语，单个汉字用前缀匹配"""
+    parts = []
+    for term in terms(q):
+        term = term.replace('"', '')
+        parts.append(f'+{term}*' if len(term) == 1 else f'+"{term}"')
+    return ' '.join(parts)
+
+def index_table(dialect_name):
+    """records_fts 的表对象，只用于构造查询；SQLite 的 rowid、MySQL 的 id 为记录 id"""
+    table = search_metadata.tables.get('records_fts')
+    if table is None:
+        id_column = 'rowid' if dialect_name == 'sqlite' else 'id'
+        table = Table('records_fts', search_metadata,
+                      Column(id_column, Integer, key='record_id'),
+                      Column('note', String(200)),
+                      Column('category', String(50)))
+    return table
+
+def match_clause(session, q):
+    """返回 (records_fts 表, 过滤条件, 得分)，得分越高越相关；没有有效的搜索词时抛出 ValueError"""
+    if not terms(q):
+        raise ValueError('搜索词不能为空')
+    dialect = session.get_bind().dialect.name
+    fts = index_table(dialect)
+    if dialect == 'mysql':
+        score = match(fts.c.note, fts.c.category, against=boolean_query(q)).in_boolean_mode()
+        return fts, score > 0, score
+    # bm25 越小越相关，取负数使两种数据库的得分方向一致
+    return fts, literal_column('records_fts').op('MATCH')(fts_query(q)), -literal_column('records_fts.rank')
+
+# ---------------------------------------------------------------------------
+# 建表、触发器与写入
+# ---------------------------------------------------------------------------
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS records_fts USING fts5(note, category, tokenize='unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS records_fts_delete AFTER DELETE ON records BEGIN "
+    "DELETE FROM records_fts WHERE rowid = old.id; END",
+]
+
+MYSQL_TABLE_DDL = (
+    "CREATE TABLE IF NOT EXISTS records_fts ("
+    "id INT NOT NULL PRIMARY KEY, note VARCHAR(200), category VARCHAR(50), "
+    "FULLTEXT KEY ft_records_fts (note, category) WITH PARSER ngram"
+    ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+)
+
+MYSQL_TRIGGERS = {
+    'records_fts_delete': "CREATE TRIGGER records_fts_delete AFTER DELETE ON records FOR EACH ROW "
+                          "DELETE FROM records_fts WHERE id = OLD.id",
+}
+
+# 早期版本逐行维护索引的触发器（SQLite 上调用 ledger_ngrams()，没有注册该函数的连接无法写入），建索引时删除
+OLD_TRIGGERS = ('records_fts_insert', 'records_fts_update')
+
+# 已确认有 records_fts 的引擎，写入时不再逐次查询
+_indexed = weakref.WeakSet()
+
+def index_exists(conn):
+    if conn.dialect.name == 'mysql':
+        sql = "SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'records_fts'"
+    else:
+        sql = "SELECT COUNT(*) FROM sqlite_master WHERE name = 'records_fts'"
+    return conn.exec_driver_sql(sql).scalar() > 0
+
+def create_index(conn):
+    """创建 records_fts 和删除触发器，已存在的跳过；返回是否新建了 records_fts"""
+    created = not index_exists(conn)
+    for name in OLD_TRIGGERS:
+        conn.exec_driver_sql(f'DROP TRIGGER IF EXISTS {name}')
+    if conn.dialect.name == 'mysql':
+        conn.exec_driver_sql(MYSQL_TABLE_DDL)
+        existing = {row[0] for row in conn.exec_driver_sql(
+            "SELECT TRIGGER_NAME FROM information_schema.TRIGGERS WHERE TRIGGER_SCHEMA = DATABASE()")}
+        for name, ddl in MYSQL_TRIGGERS.items():
+            if name not in existing:
+                conn.exec_driver_sql(ddl)
+    else:
+        for ddl in SQLITE_DDL:
+            conn.exec_driver_sql(ddl)
+    return created
+
+def indexed(conn):
+    """conn（连接或会话）所在的数据库是否已有 records_fts；旧库未执行 migrate.py 时为 False"""
+    engine = conn.get_bind().engine if hasattr(conn, 'get_bind') else conn.engine
+    if engine not in _indexed:
+        if not index_exists(conn.connection() if hasattr(conn, 'get_bind') else conn):
+            return False
+        _indexed.add(engine)
+    return True
+
+def add_to_index(conn, rows, replace=False):
+    """把 rows（[(记录 id, 备注, 分类名称)]）写入全文索引，一次 executemany；返回写入的行数
+
+    conn 为写入记录的连接或会话，与记录在同一事务中提交。replace 为 True 时先删除这些记录原有的索引行（修改记录）。
+    数据库还没有 records_fts（见 indexed()）时不写入。
+    """
+    if not rows or not indexed(conn):
+        return 0
+    dialect = conn.get_bind().dialect.name if hasattr(conn, 'get_bind') else conn.dialect.name
+    fts = index_table(dialect)
+    if replace:
+        conn.execute(delete(fts).where(fts.c.record_id.in_([rid for rid, _, _ in rows])))
+    if dialect == 'sqlite':
+        rows = [(rid, ngrams(note), ngrams(category)) for rid, note, category in rows]
+    connection = conn.connection() if hasattr(conn, 'get_bind') else conn
+    insert_many(connection, fts, [c.key for c in fts.columns], rows)
+    return len(rows)
+
+def index_rows(conn, table, batch=10000, after=0):
+    """把 table（records 或已归档年份的表）中 id 大于 after、不在索引里的记录写入全文索引，返回行数
+
+    用于已有数据库建索引时回填、补上不经过应用写入的记录、归档时把移走的记录重新加入索引
+    （records 上的删除触发器已删掉它们），以及批量写入结束后一次补齐索引（见 ingest.insert_batch 的 index 参数）。
+    按 id 分批读取，每批一次写入。
+    """
+    c = table.c
+    fts = index_table(conn.dialect.name)
+    category = select(Category.name).where(Category.id == c.category_id).scalar_subquery()
+    missing = ~select(fts.c.record_id).where(fts.c.record_id == c.id).exists()
+    total, last = 0, after
+    while True:
+        rows = conn.execute(select(c.id, c.note, category).where(c.id > last, missing)
+                            .order_by(c.id).limit(batch)).all()
+        if not rows:
+            return total
+        total += add_to_index(conn, rows)
+        last = rows[-1][0]
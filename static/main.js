@@ -30,58 +30,116 @@ function initSelectors() {
   }
 }
 
-async function fetchRecords(start, end){
-  let q = [];
+// 读接口的条件请求：保存每个 URL 上次的 ETag 和响应体，服务器返回 304（账本未变化）时直接复用
+const responseCache = new Map();
+const RESPONSE_CACHE_SIZE = 50;
+
+// 返回 {ok, status, data}；304 时 data 为上次缓存的响应体
+async function getJSON(url){
+  const cached = responseCache.get(url);
+  const headers = cached ? {'If-None-Match': cached.etag} : {};
+  // no-store 绕过浏览器自身的 HTTP 缓存，才能拿到 304 并使用这里保存的响应体
+  const res = await fetch(url, {headers, cache: 'no-store'});
+  if(res.status === 304 && cached) {
+    // 重新插入，使 Map 的顺序保持为最近使用
+    responseCache.delete(url);
+    responseCache.set(url, cached);
+    return {ok: true, status: 304, data: cached.data};
+  }
+  if(!res.ok) return {ok: false, status: res.status, data: null};
+  const data = await res.json();
+  const etag = res.headers.get('ETag');
+  if(etag) {
+    responseCache.delete(url);
+    responseCache.set(url, {etag, data});
+    if(responseCache.size > RESPONSE_CACHE_SIZE) {
+      responseCache.delete(responseCache.keys().next().value);
+    }
+  }
+  return {ok: true, status: res.status, data};
+}
+
+// 记录列表分页状态
+const PAGE_SIZE = 100;
+let nextCursor = null;
+// 表格中已加载的记录（按日期、id 倒序）及其对应的账本版本，写操作后通过 /api/changes 增量更新
+let displayedRecords = [];
+let ledgerVersion = 0;
+
+async function fetchRecords(start, end, cursor){
+  let q = ['limit=' + PAGE_SIZE];
   if(start) q.push('start='+start);
   if(end) q.push('end='+end);
-  const url = '/api/records' + (q.length?('?'+q.join('&')):'');
+  if(cursor) q.push('cursor='+encodeURIComponent(cursor));
+  const url = '/api/records?' + q.join('&');
   console.log('正在获取记录:', url);
   try {
-    const res = await fetch(url);
+    const res = await getJSON(url);
     if(!res.ok) {
       console.error('获取记录失败:', res.status);
-      return [];
+      return {items: [], next_cursor: null};
     }
-    const data = await res.json();
-    console.log('获取到记录数:', data.length);
+    const data = res.data;
+    console.log('获取到记录数:', data.items.length);
     return data;
   } catch(e) {
     console.error('获取记录异常:', e);
-    return [];
+    return {items: [], next_cursor: null};
   }
 }
 
-function renderTable(data){
+// append 为 true 时追加到现有表格末尾（加载下一页），否则重新渲染
+function renderTable(data, append){
   const tbody = document.querySelector('#recordTable tbody');
-  tbody.innerHTML = '';
+  if(!append) tbody.innerHTML = '';
   
   if(data.length === 0) {
-    tbody.innerHTML = '<tr><td colspan="7" style="text-align:center;color:var(--muted-foreground);padding:2rem;">暂无记录</td></tr>';
+    if(!append) {
+      tbody.innerHTML = '<tr><td colspan="7" style="text-align:center;color:var(--muted-foreground);padding:2rem;">暂无记录</td></tr>';
+    }
     return;
   }
   
+  const fragment = document.createDocumentFragment();
   data.forEach(r => {
     const tr = document.createElement('tr');
     tr.innerHTML = `<td>${r.id}</td><td>${r.type === 'income' ? '收入' : '支出'}</td><td>¥${parseFloat(r.amount).toFixed(2)}</td><td>${r.category}</td><td>${r.date}</td><td>${r.note || '-'}</td><td><button data-id="${r.id}" class="del">删除</button></td>`;
-    tbody.appendChild(tr);
-  });
-  
-  // 为所有删除按钮添加事件监听
-  document.querySelectorAll('.del').forEach(btn => {
-    btn.addEventListener('click', async (e) => {
-      const id = e.target.dataset.id;
-      if(confirm('确定要删除这条记录吗？')) {
-        await deleteRecord(id);
-      }
-    });
+    fragment.appendChild(tr);
   });
+  tbody.appendChild(fragment);
+}
+
+function updateLoadMore(){
+  document.getElementById('loadMoreBtn').style.display = nextCursor ? '' : 'none';
+}
+
+async function loadMoreRecords(){
+  if(!nextCursor) return;
+  const start = document.querySelector('#start').value;
+  const end = document.querySelector('#end').value;
+  const page = await fetchRecords(start, end, nextCursor);
+  nextCursor = page.next_cursor;
+  displayedRecords = displayedRecords.concat(page.items);
+  renderTable(page.items, true);
+  updateLoadMore();
 }
 
+// 删除按钮使用事件委托，追加的分页行无需重复绑定
+document.querySelector('#recordTable tbody').addEventListener('click', async (e) => {
+  if(!e.target.classList.contains('del')) return;
+  const id = e.target.dataset.id;
+  if(confirm('确定要删除这条记录吗？')) {
+    await deleteRecord(id);
+  }
+});
+
+document.getElementById('loadMoreBtn').addEventListener('click', loadMoreRecords);
+
 async function deleteRecord(id){
   try {
     const res = await fetch(`/api/record/${id}`, {method:'DELETE'});
     if(res.ok){
-      await refresh();
+      await syncChanges();
     } else {
       alert('删除失败');
     }
@@ -91,49 +149,129 @@ async function deleteRecord(id){
   }
 }
 
+// 最近一次的分类统计，切换收入/支出时直接重新渲染，无需再次请求
+let lastByCategory = [];
+// 最近一次渲染的首页数据 URL
+let lastDashboardUrl = null;
+
 async function refresh(){
   console.log('开始刷新数据...');
   const start = document.querySelector('#start').value;
   const end = document.querySelector('#end').value;
-  const data = await fetchRecords(start, end);
-  renderTable(data);
   
+  // 一次请求获取记录首页、区间统计、月度结余和年度统计
+  let q = ['limit=' + PAGE_SIZE, 'year=' + selectedYear,
+           'month=' + currentYear + '-' + currentMonth.toString().padStart(2, '0')];
+  if(start) q.push('start='+start);
+  if(end) q.push('end='+end);
+  const url = '/api/dashboard?' + q.join('&');
+  console.log('正在获取首页数据:', url);
   try {
-    const statsUrl = '/api/stats' + (start||end?('?'+(start?('start='+start):'') + (end?('&end='+end):'')) : '');
-    console.log('正在获取统计:', statsUrl);
-    const statsRes = await fetch(statsUrl);
-    if(!statsRes.ok) {
-      console.error('获取统计失败:', statsRes.status);
+    const res = await getJSON(url);
+    if(!res.ok) {
+      console.error('获取首页数据失败:', res.status);
       return;
     }
-    const stats = await statsRes.json();
-    console.log('统计数据:', stats);
+    // 账本和筛选条件都没有变化，页面上已是最新数据，不必重新渲染图表
+    if(res.status === 304 && url === lastDashboardUrl) return;
+    lastDashboardUrl = url;
+    const data = res.data;
+    
+    nextCursor = data.records.next_cursor;
+    displayedRecords = data.records.items.slice();
+    ledgerVersion = data.version;
+    renderTable(data.records.items);
+    updateLoadMore();
     
     // 渲染日统计图表
-    renderDailyChart(stats.daily_stats);
+    renderDailyChart(data.daily_stats);
     
     // 渲染分类图表和列表
-    renderCategoryStats(stats.by_category);
+    lastByCategory = data.by_category;
+    renderCategoryStats(lastByCategory);
+    
+    updateMonthSummaryCard(data.month_summary);
+    updateYearSummaryCard(data.year_stats);
+  } catch(e) {
+    console.error('获取首页数据异常:', e);
+  }
+}
+
+// 按 (日期, id) 倒序比较两条记录
+function compareRecords(a, b) {
+  if(a.date !== b.date) return a.date < b.date ? 1 : -1;
+  return b.id - a.id;
+}
+
+// 写操作后只下载变化的记录并应用到表格，再更新统计；下载量只与变化多少有关，与账本大小无关
+async function syncChanges(){
+  const start = document.querySelector('#start').value;
+  const end = document.querySelector('#end').value;
+  // 还有下一页时，排在已加载部分之后的记录留给"加载更多"，避免重复
+  const boundary = nextCursor ? displayedRecords[displayedRecords.length - 1] : null;
+  const byId = new Map(displayedRecords.map(r => [r.id, r]));
+  let more = true;
+  while(more) {
+    const res = await getJSON(`/api/changes?since=${ledgerVersion}`);
+    if(!res.ok) {
+      console.error('获取增量失败:', res.status);
+      await refresh();
+      return;
+    }
+    const data = res.data;
+    data.deleted.forEach(d => {
+      const local = byId.get(d.id);
+      // 墓碑比本地副本新才删除（SQLite 可能复用已删除的 id）
+      if(local && (local.version || 0) < d.version) byId.delete(d.id);
+    });
+    data.records.forEach(r => {
+      const inRange = (!start || r.date >= start) && (!end || r.date <= end);
+      if(inRange && (!boundary || compareRecords(r, boundary) <= 0)) {
+        byId.set(r.id, r);
+      } else {
+        byId.delete(r.id);
+      }
+    });
+    ledgerVersion = data.version;
+    more = data.more;
+  }
+  displayedRecords = Array.from(byId.values()).sort(compareRecords);
+  renderTable(displayedRecords);
+  updateLoadMore();
+  await refreshStats(start, end);
+}
+
+// 只刷新统计部分（分类、日统计、月度和年度结余），结果在服务端按日期范围缓存
+async function refreshStats(start, end) {
+  let q = ['year=' + currentYear, 'month=' + currentMonth];
+  if(start) q.push('start='+start);
+  if(end) q.push('end='+end);
+  try {
+    const [stats, yearStats] = await Promise.all([
+      getJSON('/api/stats?' + q.join('&')),
+      getJSON(`/api/year-stats?year=${selectedYear}`)
+    ]);
+    if(stats.ok) {
+      renderDailyChart(stats.data.daily_stats);
+      lastByCategory = stats.data.by_category;
+      renderCategoryStats(lastByCategory);
+      updateMonthSummaryCard(stats.data.month_summary);
+    }
+    if(yearStats.ok) updateYearSummaryCard(yearStats.data);
   } catch(e) {
     console.error('获取统计异常:', e);
   }
-  
-  // 获取并更新月度统计（独立调用，使用当前选择的年月）
-  await refreshMonthSummary();
-  
-  // 获取并更新年度统计
-  await refreshYearSummary();
 }
 
 async function refreshMonthSummary() {
   try {
     const url = `/api/stats?year=${currentYear}&month=${currentMonth}`;
-    const res = await fetch(url);
+    const res = await getJSON(url);
     if(!res.ok) {
       console.error('获取月度统计失败:', res.status);
       return;
     }
-    const stats = await res.json();
+    const stats = res.data;
     updateMonthSummaryCard(stats.month_summary);
   } catch(e) {
     console.error('获取月度统计异常:', e);
@@ -143,12 +281,12 @@ async function refreshMonthSummary() {
 async function refreshYearSummary() {
   try {
     const url = `/api/year-stats?year=${selectedYear}`;
-    const res = await fetch(url);
+    const res = await getJSON(url);
     if(!res.ok) {
       console.error('获取年度统计失败:', res.status);
       return;
     }
-    const stats = await res.json();
+    const stats = res.data;
     updateYearSummaryCard(stats);
   } catch(e) {
     console.error('获取年度统计异常:', e);
@@ -156,9 +294,9 @@ async function refreshYearSummary() {
 }
 
 function updateMonthSummaryCard(summary) {
-  const balance = summary.balance || 0;
-  const income = summary.income || 0;
-  const expense = summary.expense || 0;
+  const balance = Number(summary.balance || 0);
+  const income = Number(summary.income || 0);
+  const expense = Number(summary.expense || 0);
   
   // 更新选择器的值
   const value = `${summary.year}-${summary.month.toString().padStart(2, '0')}`;
@@ -181,9 +319,9 @@ function updateMonthSummaryCard(summary) {
 }
 
 function updateYearSummaryCard(summary) {
-  const balance = summary.balance || 0;
-  const income = summary.income || 0;
-  const expense = summary.expense || 0;
+  const balance = Number(summary.balance || 0);
+  const income = Number(summary.income || 0);
+  const expense = Number(summary.expense || 0);
   
   // 更新选择器的值
   document.getElementById('yearSelector').value = summary.year;
@@ -239,7 +377,7 @@ document.getElementById('recordForm').addEventListener('submit', async (e)=>{
     
     if(res.ok){
       f.reset();
-      await refresh();
+      await syncChanges();
       alert('添加成功！');
     } else {
       const err = await res.json();
@@ -265,8 +403,8 @@ function renderDailyChart(daily_stats) {
   }
   
   const dates = Object.keys(daily_stats).sort();
-  const incomeData = dates.map(d => daily_stats[d].income || 0);
-  const expenseData = dates.map(d => daily_stats[d].expense || 0);
+  const incomeData = dates.map(d => Number(daily_stats[d].income || 0));
+  const expenseData = dates.map(d => Number(daily_stats[d].expense || 0));
   const labels = dates.map(d => d.substring(5)); // 只显示月-日
   
   const ctx = document.getElementById('dailyChart').getContext('2d');
@@ -385,7 +523,7 @@ function renderPieChart(by_category, type) {
   }
   
   const labels = data.map(x => x.category);
-  const values = data.map(x => Math.abs(x.total));
+  const values = data.map(x => Math.abs(Number(x.total)));
   
   // 根据类型选择配色
   const colors = type === 'expense' ? [
@@ -453,7 +591,7 @@ function renderCategoryList(by_category, type) {
     return;
   }
   
-  const total = data.reduce((sum, item) => sum + item.total, 0);
+  const total = data.reduce((sum, item) => sum + Number(item.total), 0);
   
   const colors = type === 'expense' ? [
     'oklch(0.65 0.20 25)',
@@ -476,7 +614,7 @@ function renderCategoryList(by_category, type) {
   ];
   
   const listHtml = data.map((item, index) => {
-    const percent = ((item.total / total) * 100).toFixed(1);
+    const percent = ((Number(item.total) / total) * 100).toFixed(1);
     const color = colors[index % colors.length];
     return `
       <div class="category-item">
@@ -487,7 +625,7 @@ function renderCategoryList(by_category, type) {
           <div class="category-name">${item.category}</div>
           <div class="category-percent">${percent}%</div>
         </div>
-        <div class="category-amount">¥${item.total.toFixed(2)}</div>
+        <div class="category-amount">¥${item.total}</div>
       </div>
     `;
   }).join('');
@@ -495,9 +633,29 @@ function renderCategoryList(by_category, type) {
   listDiv.innerHTML = listHtml;
 }
 
+// 订阅服务端推送：其他页面、设备或导入脚本写入记录后，自动增量更新表格和统计
+function subscribeEvents() {
+  if(!window.EventSource) return;
+  const source = new EventSource('/api/events');
+  let pending = null;
+  source.addEventListener('change', (e) => {
+    const data = JSON.parse(e.data);
+    if(data.version <= ledgerVersion) return;  // 本页面自己的写操作已经同步过
+    // 推送中带有受影响年份的统计，先直接更新结余卡片
+    const year = data.years[selectedYear];
+    if(year) updateYearSummaryCard(year);
+    const month = data.years[currentYear];
+    if(month) updateMonthSummaryCard(Object.assign({year: currentYear, month: currentMonth}, month.monthly_stats[currentMonth]));
+    // 连续多次写入时合并为一次同步
+    clearTimeout(pending);
+    pending = setTimeout(syncChanges, 200);
+  });
+}
+
 // 初始化加载
 initSelectors();
 refresh();
+subscribeEvents();
 
 // 月份导航按钮事件
 document.getElementById('prevMonth').addEventListener('click', async () => {
@@ -548,12 +706,12 @@ document.getElementById('btnExpense').addEventListener('click', async () => {
   currentCategoryType = 'expense';
   document.getElementById('btnExpense').classList.add('active');
   document.getElementById('btnIncome').classList.remove('active');
-  await refresh();
+  renderCategoryStats(lastByCategory);
 });
 
 document.getElementById('btnIncome').addEventListener('click', async () => {
   currentCategoryType = 'income';
   document.getElementById('btnIncome').classList.add('active');
   document.getElementById('btnExpense').classList.remove('active');
-  await refresh();
+  renderCategoryStats(lastByCategory);
 });
@@ -0,0 +1,1595 @@
+"""
+记账本接口单元测试
+使用 Flask test client + 临时 SQLite 数据库，无需启动服务即可运行：
+    python -m pytest -q test_ledger.py
+"""
+import io
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sqlite3
+import pstats
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from datetime import date
+
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import IntegrityError
+
+import analytics
+import app as app_module
+import bench
+import ingest
+import metrics
+import partitions
+import rollup
+import search
+import writebehind
+from cache import MemoryCache, SharedCache
+from events import Broadcaster
+from migrate import check_query_plans, migrate
+from money import format_cents, to_cents
+from models import (Base, Category, DailyTotal, ImportCheckpoint, Record, dispose_engine, get_engine, get_session,
+                    pool_options, writer_engine)
+
+
+class LedgerTestCase(unittest.TestCase):
+    """每个用例使用独立的临时 SQLite 数据库"""
+
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.engine = get_engine(f'sqlite:///{self.db_path}')
+        Base.metadata.create_all(self.engine)
+        self._orig_engine = app_module.engine
+        app_module.engine = self.engine
+        app_module.app.config['TESTING'] = True
+        self._orig_cache = app_module.api_cache
+        app_module.api_cache = MemoryCache()
+        # 每个用例是新数据库，分类 id 不能沿用上一个用例的缓存
+        app_module.category_cache.clear()
+        self.client = app_module.app.test_client()
+
+    def tearDown(self):
+        app_module.engine = self._orig_engine
+        app_module.api_cache = self._orig_cache
+        dispose_engine(self.engine)
+        os.remove(self.db_path)
+
+    def add_records(self, records):
+        """直接写库后重建日汇总，模拟历史数据回填"""
+        session = get_session(self.engine)
+        session.add_all(records)
+        session.commit()
+        session.close()
+        rollup.rebuild(self.engine)
+
+    def category_id(self, name):
+        session = get_session(self.engine)
+        cid = app_module.category_cache.id(session, name)
+        session.commit()
+        session.close()
+        return cid
+
+    def daily_totals(self):
+        session = get_session(self.engine)
+        rows = session.query(DailyTotal).all()
+        name = app_module.category_cache.name
+        result = {(r.date, r.type, name(r.category_id)): (r.total_cents, r.count) for r in rows}
+        session.close()
+        return result
+
+
+class TestRecordPagination(LedgerTestCase):
+    """GET /api/records 游标分页与字段投影"""
+
+    def setUp(self):
+        super().setUp()
+        self.add_records([
+            Record(type='expense', amount_cents=i * 100, category_id=self.category_id('餐饮' if i % 2 else '交通'),
+                   date=date(2025, 1, 1 + i // 3), note=f'n{i}')
+            for i in range(25)
+        ])
+
+    def test_unpaginated_returns_list(self):
+        data = self.client.get('/api/records').get_json()
+        self.assertIsInstance(data, list)
+        self.assertEqual(len(data), 25)
+
+    def test_pages_cover_all_records_in_order(self):
+        seen, cursor = [], None
+        while True:
+            url = '/api/records?limit=7' + (f'&cursor={cursor}' if cursor else '')
+            page = self.client.get(url).get_json()
+            seen.extend(page['items'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(len({r['id'] for r in seen}), 25)
+        keys = [(r['date'], r['id']) for r in seen]
+        self.assertEqual(keys, sorted(keys, reverse=True))
+
+    def test_pagination_with_filters(self):
+        page = self.client.get('/api/records?limit=100&category=交通&start=2025-01-03').get_json()
+        self.assertIsNone(page['next_cursor'])
+        self.assertTrue(all(r['category'] == '交通' and r['date'] >= '2025-01-03' for r in page['items']))
+
+    def test_field_projection(self):
+        page = self.client.get('/api/records?limit=3&fields=id,amount').get_json()
+        self.assertEqual(set(page['items'][0]), {'id', 'amount'})
+        self.assertIsNotNone(page['next_cursor'])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/api/records?fields=password').status_code, 400)
+        self.assertEqual(self.client.get('/api/records?cursor=xxx').status_code, 400)
+        self.assertEqual(self.client.get('/api/records?limit=abc').status_code, 400)
+
+
+class TestSessionScope(LedgerTestCase):
+    """请求内共用一个会话，请求结束后归还连接"""
+
+    def test_one_session_per_request(self):
+        sessions = []
+        with app_module.app.test_request_context('/'):
+            sessions.append(app_module.request_session())
+            sessions.append(app_module.request_session())
+            self.assertIs(sessions[0], sessions[1])
+            sessions[0].execute(Record.__table__.select())
+            self.assertEqual(self.engine.pool.checkedout(), 1)
+        self.assertEqual(self.engine.pool.checkedout(), 0)
+        with app_module.app.test_request_context('/'):
+            self.assertIsNot(app_module.request_session(), sessions[0])
+
+    def test_connections_returned_after_requests(self):
+        self.client.post('/api/record', json={'type': 'expense', 'amount': 1, 'date': '2025-01-01'})
+        self.client.get('/api/dashboard')
+        self.client.get('/api/record/999')
+        self.client.delete('/api/record/999')
+        self.assertEqual(self.engine.pool.checkedout(), 0)
+
+    def test_pool_options(self):
+        options = pool_options('mysql+pymysql://u:p@h/db')
+        self.assertFalse(options['pool_pre_ping'])
+        self.assertIn('pool_recycle', options)
+        self.assertNotIn('pool_size', pool_options('sqlite://'))
+
+
+class TestBulkInsert(LedgerTestCase):
+    """POST /api/records/bulk：JSON 数组或 NDJSON，逐行报告错误"""
+
+    def test_json_array_with_invalid_rows(self):
+        rows = [
+            {'type': 'expense', 'amount': 10, 'category': '餐饮', 'date': '2025-01-05'},
+            {'type': 'expense', 'amount': 'abc', 'date': '2025-01-05'},
+            {'type': 'income', 'amount': 100, 'date': '2025/01/05'},
+            {'type': 'income', 'amount': '200.5', 'category': '工资', 'date': '2025-01-06'},
+            'not an object',
+        ]
+        data = self.client.post('/api/records/bulk', json=rows).get_json()
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual([e['index'] for e in data['errors']], [1, 2, 4])
+        self.assertEqual(len(self.client.get('/api/records').get_json()), 2)
+        self.assertEqual(self.daily_totals()[(date(2025, 1, 6), 'income', '工资')], (20050, 1))
+
+    def test_ndjson_in_multiple_chunks(self):
+        app_module.app.config['BULK_CHUNK_SIZE'] = 7
+        self.addCleanup(app_module.app.config.pop, 'BULK_CHUNK_SIZE')
+        lines = [f'{{"type": "expense", "amount": {i}, "category": "餐饮", "date": "2025-02-{1 + i % 20:02d}"}}'
+                 for i in range(30)]
+        lines.insert(10, '{broken json')
+        body = '\n'.join(lines) + '\n'
+        data = self.client.post('/api/records/bulk', data=body,
+                                content_type='application/x-ndjson').get_json()
+        self.assertEqual((data['inserted'], data['failed']), (30, 1))
+        self.assertEqual(data['errors'][0]['index'], 10)
+        maintained = self.daily_totals()
+        rollup.rebuild(self.engine)
+        self.assertEqual(maintained, self.daily_totals())
+
+    def test_invalidates_cached_stats(self):
+        self.client.get('/api/year-stats?year=2025')
+        self.client.post('/api/records/bulk', json=[{'type': 'expense', 'amount': 5, 'date': '2025-03-01'}])
+        self.assertEqual(self.client.get('/api/year-stats?year=2025').get_json()['expense'], '5.00')
+
+    def test_rejects_non_array(self):
+        self.assertEqual(self.client.post('/api/records/bulk', json={'type': 'expense'}).status_code, 400)
+
+    def test_schema_violations_fail_only_their_row(self):
+        # 缺少或未知的类型、超长的备注在校验时拒绝，不会让整批 executemany 失败
+        rows = [
+            {'type': 'expense', 'amount': 1, 'date': '2025-03-01'},
+            {'amount': 2, 'date': '2025-03-01'},
+            {'type': 'foo', 'amount': 3, 'date': '2025-03-01'},
+            {'type': 'expense', 'amount': 4, 'date': '2025-03-01', 'note': 'x' * 201},
+            {'type': 'income', 'amount': 5, 'date': '2025-03-01', 'note': 'x' * 200},
+        ]
+        data = self.client.post('/api/records/bulk', json=rows).get_json()
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual([e['index'] for e in data['errors']], [1, 2, 3])
+        self.assertFalse(any('INSERT' in e['error'] for e in data['errors']))
+        resp = self.client.post('/api/record', json={'type': 'foo', 'amount': 1})
+        self.assertEqual(resp.status_code, 400)
+
+
+class TestStreamingImport(LedgerTestCase):
+    """流式导入 CSV / NDJSON 与断点续传"""
+
+    CSV = (
+        '\ufeffdate,type,amount,category,note,balance\n'
+        '2025-01-05,expense,12.5,餐饮,午餐,100\n'
+        '2025-01-05,expense,abc,餐饮,,100\n'
+        '2025-01-06,income,5000,工资,"一月\n工资",100\n'
+        '\n'
+        '2025-01-07,expense,3,,地铁,100\n'
+    )
+
+    def test_csv_with_header(self):
+        result = ingest.import_stream(self.engine, io.BytesIO(self.CSV.encode()), 'csv', 'test', batch_size=2)
+        self.assertEqual((result['inserted'], result['failed']), (3, 1))
+        self.assertEqual(result['errors'][0]['row'], 2)
+        self.assertEqual(result['offset'], len(self.CSV.encode()))
+        notes = {r['note']: r['category'] for r in self.client.get('/api/records').get_json()}
+        self.assertEqual(notes, {'午餐': '餐饮', '一月\n工资': '工资', '地铁': '未分类'})
+
+    def test_invalid_type_counted_and_checkpointed(self):
+        # 类型为空或未知的行计入 failed，不会在提交时整批失败；断点越过这些行，续传不会卡在同一行
+        lines = ['date,type,amount'] + [f'2025-03-{1 + i:02d},{"expense" if i % 5 else ""},{i + 1}' for i in range(10)]
+        lines[4] = '2025-03-04,refund,4'
+        body = ('\n'.join(lines) + '\n').encode()
+        result = ingest.import_stream(self.engine, io.BytesIO(body), 'csv', 'bad-type', batch_size=3)
+        self.assertEqual((result['inserted'], result['failed']), (7, 3))
+        self.assertEqual([e['row'] for e in result['errors']], [1, 4, 6])
+        self.assertEqual(result['offset'], len(body))
+        again = ingest.import_stream(self.engine, io.BytesIO(body), 'csv', 'bad-type', resume=True, batch_size=3)
+        self.assertEqual((again['inserted'], again['failed'], again['rows']), (7, 3, 0))
+        resp = self.client.post('/api/import?format=csv&source=api-bad-type', data=body)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json()['failed'], 3)
+
+    def test_resume_after_crash(self):
+        lines = [f'{{"type": "expense", "amount": {i}, "date": "2025-02-{1 + i % 20:02d}"}}\n' for i in range(25)]
+        body = ''.join(lines).encode()
+
+        def crash(result, span):
+            if result['inserted'] >= 10:
+                raise RuntimeError('模拟崩溃')
+
+        with self.assertRaises(RuntimeError):
+            ingest.import_stream(self.engine, io.BytesIO(body), 'ndjson', 'f', batch_size=5, on_batch=crash)
+        # 崩溃前提交的两批（10 条）保留下来，断点指向第 10 行的结尾
+        self.assertEqual(len(self.client.get('/api/records').get_json()), 10)
+        result = ingest.import_stream(self.engine, io.BytesIO(body), 'ndjson', 'f', resume=True, batch_size=5)
+        self.assertEqual((result['inserted'], result['rows']), (25, 15))
+        amounts = sorted(r['amount'] for r in self.client.get('/api/records').get_json())
+        self.assertEqual(amounts, sorted(f'{i}.00' for i in range(25)))
+        maintained = self.daily_totals()
+        rollup.rebuild(self.engine)
+        self.assertEqual(maintained, self.daily_totals())
+
+    def test_search_index_filled_after_import(self):
+        # 各批次不写全文索引，导入结束后一次补齐；中断后续传时，中断前提交的记录也会补上
+        lines = [f'{{"type": "expense", "amount": {i + 1}, "date": "2025-02-01", "note": "地铁卡{i}"}}\n'
+                 for i in range(12)]
+        body = ''.join(lines).encode()
+
+        def crash(result, span):
+            if result['inserted'] >= 5:
+                raise RuntimeError('模拟崩溃')
+
+        def found():
+            return len(self.client.get('/api/records', query_string={'q': '地铁', 'limit': 50}).get_json()['items'])
+
+        with self.assertRaises(RuntimeError):
+            ingest.import_stream(self.engine, io.BytesIO(body), 'ndjson', 'fts', batch_size=5, on_batch=crash)
+        self.assertEqual(found(), 0)
+        ingest.import_stream(self.engine, io.BytesIO(body), 'ndjson', 'fts', resume=True, batch_size=5)
+        self.assertEqual(found(), 12)
+
+    def test_csv_resume_keeps_header(self):
+        body = self.CSV.encode()
+        offset = body.index('2025-01-06'.encode())
+        session = get_session(self.engine)
+        session.add(ImportCheckpoint(source='test', offset=offset, inserted=1, failed=1))
+        session.commit()
+        session.close()
+        result = ingest.import_stream(self.engine, io.BytesIO(body), 'csv', 'test', resume=True)
+        self.assertEqual((result['inserted'], result['failed'], result['rows']), (3, 1, 2))
+        self.assertEqual({r['category'] for r in self.client.get('/api/records').get_json()}, {'工资', '未分类'})
+
+    def test_api_import(self):
+        self.client.get('/api/year-stats?year=2025')
+        resp = self.client.post('/api/import', data=self.CSV.encode(), content_type='text/csv')
+        self.assertEqual(resp.get_json()['inserted'], 3)
+        self.assertEqual(self.client.get('/api/year-stats?year=2025').get_json()['income'], '5000.00')
+        resp = self.client.post('/api/import?format=ndjson&source=x',
+                                data=b'{"type": "expense", "amount": 1, "date": "2025-03-01"}\n')
+        self.assertEqual(resp.get_json()['inserted'], 1)
+        self.assertEqual(self.client.post('/api/import', data=b'x').status_code, 400)
+
+
+class TestExport(LedgerTestCase):
+    """GET /api/export 流式导出"""
+
+    def setUp(self):
+        super().setUp()
+        self.add_records([
+            Record(type='expense', amount_cents=i * 100 + 50, category_id=self.category_id('餐饮' if i % 2 else '交通'),
+                   date=date(2025, 1, 1 + i % 28), note=f'备注{i}')
+            for i in range(50)
+        ])
+        self._orig_chunk = app_module.EXPORT_CHUNK_SIZE
+        app_module.EXPORT_CHUNK_SIZE = 7
+
+    def tearDown(self):
+        app_module.EXPORT_CHUNK_SIZE = self._orig_chunk
+        super().tearDown()
+
+    def test_formats_match_records(self):
+        expected = self.client.get('/api/records?category=餐饮&start=2025-01-05').get_json()
+        query = 'category=餐饮&start=2025-01-05'
+
+        resp = self.client.get(f'/api/export?format=ndjson&{query}')
+        self.assertTrue(resp.is_streamed)
+        rows = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual(rows, expected)
+
+        lines = self.client.get(f'/api/export?format=columnar&{query}').get_data(as_text=True).splitlines()
+        header, groups = json.loads(lines[0]), [json.loads(line) for line in lines[1:]]
+        self.assertTrue(all(g['rows'] <= 7 for g in groups))
+        self.assertEqual([g['columns']['id'] for g in groups], [[r['id'] for r in expected[i:i + 7]]
+                                                                 for i in range(0, len(expected), 7)])
+        self.assertEqual(header['fields'], list(app_module.RECORD_FIELDS))
+
+    def test_csv_round_trips_through_import(self):
+        body = self.client.get('/api/export?format=csv').get_data()
+        self.assertTrue(body.startswith('\ufeffid,type,amount'.encode()))
+        result = ingest.import_stream(self.engine, io.BytesIO(body), 'csv', 'export')
+        self.assertEqual((result['inserted'], result['failed']), (50, 0))
+        self.assertEqual(len(self.client.get('/api/records').get_json()), 100)
+
+    def test_invalid_format(self):
+        self.assertEqual(self.client.get('/api/export?format=xlsx').status_code, 400)
+        self.assertEqual(self.client.get('/api/export?fields=bogus').status_code, 400)
+
+
+class TestChanges(LedgerTestCase):
+    """GET /api/changes 增量同步"""
+
+    def sync(self, replica, since, limit=1000):
+        """按客户端的规则把增量应用到本地副本 {id: 记录}，返回新的 since"""
+        while True:
+            data = self.client.get(f'/api/changes?since={since}&limit={limit}').get_json()
+            for r in data['records']:
+                replica[r['id']] = r
+            for d in data['deleted']:
+                if d['id'] in replica and replica[d['id']]['version'] < d['version']:
+                    del replica[d['id']]
+            since = data['version']
+            if not data['more']:
+                return since
+
+    def assertReplicaMatches(self, replica):
+        expected = {r['id']: r for r in self.client.get('/api/records').get_json()}
+        self.assertEqual({i: {k: v for k, v in r.items() if k != 'version'} for i, r in replica.items()}, expected)
+
+    def test_add_update_delete(self):
+        replica = {}
+        since = self.sync(replica, 0)
+        self.assertEqual((since, replica), (0, {}))
+        ids = [self.client.post('/api/record', json={'type': 'expense', 'amount': i, 'date': '2025-01-05'})
+               .get_json()['id'] for i in range(5)]
+        since = self.sync(replica, since)
+        self.assertEqual(since, 5)
+        self.assertReplicaMatches(replica)
+
+        self.client.put(f'/api/record/{ids[0]}', json={'amount': 99})
+        self.client.delete(f'/api/record/{ids[1]}')
+        data = self.client.get(f'/api/changes?since={since}').get_json()
+        self.assertEqual([r['id'] for r in data['records']], [ids[0]])
+        self.assertEqual(data['deleted'], [{'id': ids[1], 'version': 7}])
+        since = self.sync(replica, since)
+        self.assertReplicaMatches(replica)
+        self.assertEqual(self.client.get(f'/api/changes?since={since}').get_json()['records'], [])
+
+    def test_batches_are_not_split_across_pages(self):
+        self.client.post('/api/records/bulk', json=[{'type': 'expense', 'amount': i, 'date': '2025-01-05'}
+                                                   for i in range(8)])
+        for i in range(3):
+            self.client.post('/api/record', json={'type': 'income', 'amount': i, 'date': '2025-01-06'})
+        first = self.client.get('/api/changes?since=0&limit=5').get_json()
+        # 批量写入的 8 条共用版本 1，即使超过 limit 也整批返回
+        self.assertEqual((first['version'], len(first['records']), first['more']), (1, 8, True))
+        second = self.client.get('/api/changes?since=1&limit=2').get_json()
+        self.assertEqual((second['version'], len(second['records']), second['more']), (3, 2, True))
+        replica = {}
+        self.sync(replica, 0, limit=3)
+        self.assertReplicaMatches(replica)
+
+    def test_migrate_adds_version_column(self):
+        Base.metadata.drop_all(self.engine)
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(
+                'CREATE TABLE records (id INTEGER PRIMARY KEY, type VARCHAR(10) NOT NULL, amount FLOAT NOT NULL, '
+                'category VARCHAR(50) NOT NULL, date DATE NOT NULL, note VARCHAR(200))')
+            conn.exec_driver_sql("INSERT INTO records (type, amount, category, date) VALUES ('expense', 1, 'x', '2025-01-01')")
+        migrate(self.engine)
+        data = self.client.get('/api/changes').get_json()
+        self.assertEqual((data['version'], [r['version'] for r in data['records']]), (1, [1]))
+        self.client.post('/api/record', json={'type': 'expense', 'amount': 2})
+        self.assertEqual(self.client.get('/api/changes?since=1').get_json()['version'], 2)
+
+
+class TestEvents(LedgerTestCase):
+    """/api/events 推送"""
+
+    def setUp(self):
+        super().setUp()
+        # 不启动后台线程，由测试调用 check() 控制轮询时机
+        self._orig_broadcaster = app_module.broadcaster
+        app_module.broadcaster = Broadcaster(app_module.poll_ledger, interval=3600)
+        app_module.broadcaster._thread = _AliveThread()
+
+    def tearDown(self):
+        app_module.broadcaster = self._orig_broadcaster
+        super().tearDown()
+
+    def open_stream(self):
+        resp = self.client.get('/api/events', buffered=False)
+        self.assertEqual(resp.mimetype, 'text/event-stream')
+        return resp, iter(resp.response)
+
+    def read_event(self, stream):
+        chunk = next(stream).decode()
+        fields = dict(line.split(': ', 1) for line in chunk.strip().splitlines() if ': ' in line)
+        return fields['event'], json.loads(fields['data'])
+
+    def test_change_event_fans_out(self):
+        streams = [self.open_stream() for _ in range(3)]
+        for _, stream in streams:
+            self.assertEqual(self.read_event(stream), ('hello', {'version': 0}))
+        self.client.post('/api/record', json={'type': 'expense', 'amount': 30, 'date': '2025-03-08'})
+        self.client.post('/api/record', json={'type': 'income', 'amount': 100, 'date': '2025-04-01'})
+        # 两次写入之后只检查一次，合并为一个事件
+        self.assertTrue(app_module.broadcaster.check())
+        self.assertFalse(app_module.broadcaster.check())
+        for _, stream in streams:
+            event, data = self.read_event(stream)
+            self.assertEqual(event, 'change')
+            self.assertEqual((data['version'], data['changed'], data['ids']), (2, 2, [1, 2]))
+            self.assertEqual((data['start'], data['end']), ('2025-03-08', '2025-04-01'))
+            self.assertEqual(data['years']['2025']['monthly_stats']['3']['expense'], '30.00')
+        for resp, _ in streams:
+            resp.close()
+        self.assertEqual(app_module.broadcaster.subscribers(), 0)
+
+    def test_deletes_report_dates(self):
+        rid = self.client.post('/api/record', json={'type': 'expense', 'amount': 5, 'date': '2024-12-31'}).get_json()['id']
+        resp, stream = self.open_stream()
+        self.read_event(stream)
+        self.client.delete(f'/api/record/{rid}')
+        app_module.broadcaster.check()
+        event, data = self.read_event(stream)
+        self.assertEqual((data['changed'], data['deleted'], data['start']), (0, 1, '2024-12-31'))
+        self.assertEqual(data['years']['2024']['expense'], '0.00')
+        resp.close()
+
+    def test_slow_subscriber_is_dropped(self):
+        app_module.broadcaster.queue_size = 1
+        resp, stream = self.open_stream()
+        for i in range(2):
+            self.client.post('/api/record', json={'type': 'expense', 'amount': 1, 'date': '2025-01-01'})
+            app_module.broadcaster.check()
+        self.assertEqual(app_module.broadcaster.subscribers(), 0)
+        resp.close()
+
+
+class _AliveThread:
+    def is_alive(self):
+        return True
+
+
+class TestIndexes(LedgerTestCase):
+    """索引迁移与查询计划检查"""
+
+    def test_migrate_adds_indexes_to_existing_table(self):
+        # 模拟旧版本创建的、只有主键的 records 表
+        Base.metadata.drop_all(self.engine)
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(
+                'CREATE TABLE records (id INTEGER PRIMARY KEY AUTOINCREMENT, type VARCHAR(10) NOT NULL, '
+                'amount FLOAT NOT NULL, category VARCHAR(50) NOT NULL, date DATE NOT NULL, note VARCHAR(200))'
+            )
+        migrate(self.engine)
+        migrate(self.engine)
+        names = {ix['name'] for ix in inspect(self.engine).get_indexes('records')}
+        self.assertTrue({ix.name for ix in Record.__table__.indexes} <= names)
+
+    def test_migrate_drops_obsolete_index(self):
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql('CREATE INDEX ix_records_date_type_cents ON records (date, type, amount_cents)')
+        migrate(self.engine)
+        names = {ix['name'] for ix in inspect(self.engine).get_indexes('records')}
+        self.assertNotIn('ix_records_date_type_cents', names)
+        self.assertTrue({ix.name for ix in Record.__table__.indexes} <= names)
+
+    def test_migrate_enforces_not_null_on_added_columns(self):
+        # 旧表补上的 amount_cents、category_id 回填后应与新建的表一样为 NOT NULL
+        Base.metadata.drop_all(self.engine)
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(
+                'CREATE TABLE records (id INTEGER PRIMARY KEY AUTOINCREMENT, type VARCHAR(10) NOT NULL, '
+                'amount FLOAT NOT NULL, category VARCHAR(50) NOT NULL, date DATE NOT NULL, note VARCHAR(200))'
+            )
+            conn.exec_driver_sql(
+                "INSERT INTO records (type, amount, category, date, note) VALUES ('expense', 12.5, '餐饮', '2024-01-02', '午饭')"
+            )
+        migrate(self.engine)
+        migrate(self.engine)
+        columns = {c['name']: c for c in inspect(self.engine).get_columns('records')}
+        self.assertFalse(columns['amount_cents']['nullable'])
+        self.assertFalse(columns['category_id']['nullable'])
+        with self.engine.connect() as conn:
+            row = conn.exec_driver_sql('SELECT id, amount_cents, note FROM records').one()
+        self.assertEqual(tuple(row), (1, 1250, '午饭'))
+        names = {ix['name'] for ix in inspect(self.engine).get_indexes('records')}
+        self.assertTrue({ix.name for ix in Record.__table__.indexes} <= names)
+        with self.assertRaises(IntegrityError):
+            with self.engine.begin() as conn:
+                conn.exec_driver_sql(
+                    "INSERT INTO records (type, amount_cents, date, version) VALUES ('expense', 100, '2024-01-03', 0)"
+                )
+
+    def test_every_query_uses_an_index(self):
+        results = check_query_plans(self.engine)
+        self.assertTrue(results)
+        for statement, plan, scans in results:
+            self.assertEqual(scans, [], f'{statement}\n{plan}')
+
+
+class TestDailyRollup(LedgerTestCase):
+    """日汇总表随写接口在同一事务中维护"""
+
+    def post(self, **payload):
+        return self.client.post('/api/record', json=payload).get_json()
+
+    def assertRollupConsistent(self):
+        maintained = self.daily_totals()
+        rollup.rebuild(self.engine)
+        self.assertEqual(maintained, self.daily_totals())
+
+    def test_add_update_delete(self):
+        a = self.post(type='expense', amount=10, category='餐饮', date='2025-01-05')
+        b = self.post(type='expense', amount=20, category='餐饮', date='2025-01-05')
+        self.post(type='income', amount=500, category='工资', date='2025-01-06')
+        self.assertEqual(self.daily_totals()[(date(2025, 1, 5), 'expense', '餐饮')], (3000, 2))
+        self.assertRollupConsistent()
+
+        # 金额、日期、分类、类型分别变化
+        for change in ({'amount': 15}, {'date': '2025-02-01'}, {'category': '交通'}, {'type': 'income'}):
+            self.client.put(f"/api/record/{a['id']}", json=change)
+            self.assertRollupConsistent()
+
+        self.client.delete(f"/api/record/{b['id']}")
+        self.assertRollupConsistent()
+        self.assertNotIn((date(2025, 1, 5), 'expense', '餐饮'), self.daily_totals())
+
+    def test_stats_read_rollup(self):
+        self.post(type='expense', amount=10, category='餐饮', date='2025-01-05')
+        self.post(type='income', amount=500, category='工资', date='2025-01-06')
+        data = self.client.get('/api/stats?start=2025-01-01&end=2025-01-31&year=2025&month=1').get_json()
+        self.assertEqual(data['month_summary']['balance'], '490.00')
+        self.assertEqual(data['daily_stats']['2025-01-05'], {'income': '0.00', 'expense': '10.00'})
+        self.assertIn({'category': '工资', 'type': 'income', 'total': '500.00'}, data['by_category'])
+        year = self.client.get('/api/year-stats?year=2025').get_json()
+        self.assertEqual(year['monthly_stats']['1']['income'], '500.00')
+
+
+class TestMoney(LedgerTestCase):
+    """金额以整数分存储，JSON 中为两位小数的字符串"""
+
+    def test_conversion(self):
+        self.assertEqual([to_cents(v) for v in ('12.5', 0.1, 3, '-0.015', ' 7.005 ')], [1250, 10, 300, -2, 701])
+        for bad in ('abc', None, '', 'nan', 'inf', True, '1e20', '-1e20', '1e1000000', 10 ** 30):
+            with self.assertRaises(ValueError):
+                to_cents(bad)
+        self.assertEqual([format_cents(c) for c in (1250, 5, 0, -5, -123456)],
+                         ['12.50', '0.05', '0.00', '-0.05', '-1234.56'])
+
+    def test_sums_are_exact(self):
+        # 浮点数相加 0.1 + 0.2 != 0.3，按分求和没有误差
+        rows = [{'type': 'expense', 'amount': a, 'date': '2025-01-05'} for a in ('0.10', '0.20')] * 500
+        self.client.post('/api/records/bulk', json=rows)
+        data = self.client.get('/api/stats?start=2025-01-05&end=2025-01-05&year=2025&month=1').get_json()
+        self.assertEqual(data['month_summary']['expense'], '150.00')
+        self.assertEqual(data['by_category'], [{'category': '未分类', 'type': 'expense', 'total': '150.00'}])
+
+    def test_invalid_amount_rejected(self):
+        self.assertEqual(self.client.post('/api/record', json={'type': 'expense', 'amount': 'x'}).status_code, 400)
+        rid = self.client.post('/api/record', json={'type': 'expense', 'amount': '1.5'}).get_json()['id']
+        self.assertEqual(self.client.put(f'/api/record/{rid}', json={'amount': 'x'}).status_code, 400)
+        self.assertEqual(self.client.put(f'/api/record/{rid}', json={'amount': 2.25}).get_json()['amount'], '2.25')
+        # 超出范围的金额返回 400，而不是写入时整数溢出
+        self.assertEqual(self.client.post('/api/record', json={'type': 'expense', 'amount': '1e20'}).status_code, 400)
+        self.assertEqual(self.client.put(f'/api/record/{rid}', json={'amount': '1e20'}).status_code, 400)
+        self.assertEqual(to_cents('1000000000000'), 10 ** 14)
+
+    def test_migrate_converts_float_amounts(self):
+        Base.metadata.drop_all(self.engine)
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(
+                'CREATE TABLE records (id INTEGER PRIMARY KEY, type VARCHAR(10) NOT NULL, amount FLOAT NOT NULL, '
+                'category VARCHAR(50) NOT NULL, date DATE NOT NULL, note VARCHAR(200))')
+            conn.exec_driver_sql('CREATE INDEX ix_records_date_type_amount ON records (date, type, amount)')
+            conn.exec_driver_sql(
+                "INSERT INTO records (type, amount, category, date) VALUES "
+                "('expense', 0.1, 'x', '2025-01-01'), ('expense', 0.2, 'x', '2025-01-01'), ('income', 99.99, 'y', '2025-01-02')")
+            conn.exec_driver_sql(
+                'CREATE TABLE daily_totals (date DATE, type VARCHAR(10), category VARCHAR(50), total FLOAT NOT NULL, '
+                'count INTEGER NOT NULL, PRIMARY KEY (date, type, category))')
+        migrate(self.engine)
+        columns = {c['name'] for c in inspect(self.engine).get_columns('records')}
+        self.assertNotIn('amount', columns)
+        self.assertEqual(sorted(r['amount'] for r in self.client.get('/api/records').get_json()),
+                         ['0.10', '0.20', '99.99'])
+        self.assertEqual(self.daily_totals()[(date(2025, 1, 1), 'expense', 'x')], (30, 2))
+        # 再次执行不做任何改动
+        migrate(self.engine)
+        self.assertEqual(len(self.client.get('/api/records').get_json()), 3)
+
+
+class TestCategories(LedgerTestCase):
+    """分类名称保存在 categories 表，记录和日汇总中只存 id"""
+
+    def test_names_stored_once(self):
+        rows = [{'type': 'expense', 'amount': 1, 'category': c, 'date': '2025-01-05'} for c in ('餐饮', '交通')] * 50
+        self.client.post('/api/records/bulk', json=rows)
+        self.client.post('/api/record', json={'type': 'expense', 'amount': 1, 'category': '餐饮'})
+        session = get_session(self.engine)
+        self.assertEqual(sorted(n for n, in session.query(Category.name)), ['交通', '餐饮'])
+        session.close()
+        self.assertEqual(len(self.client.get('/api/records?category=餐饮').get_json()), 51)
+        self.assertEqual(self.client.get('/api/records?category=不存在').get_json(), [])
+        by_category = self.client.get('/api/stats?start=2025-01-05&end=2025-01-05').get_json()['by_category']
+        self.assertEqual(sorted((c['category'], c['total']) for c in by_category), [('交通', '50.00'), ('餐饮', '50.00')])
+
+    def test_update_category(self):
+        rid = self.client.post('/api/record', json={'type': 'expense', 'amount': 1, 'category': '餐饮',
+                                                    'date': '2025-01-05'}).get_json()['id']
+        self.assertEqual(self.client.put(f'/api/record/{rid}', json={'category': '购物'}).get_json()['category'], '购物')
+        self.assertEqual(self.daily_totals(), {(date(2025, 1, 5), 'expense', '购物'): (100, 1)})
+
+    def test_rolled_back_category_not_cached(self):
+        cache = app_module.category_cache
+        session = get_session(self.engine)
+        cid = cache.id(session, '临时')
+        # 同一事务中再次查询得到同一个 id
+        self.assertEqual(cache.id(session, '临时'), cid)
+        session.rollback()
+        session.close()
+        self.assertIsNone(cache.name(cid))
+        # 提交后才进入缓存
+        self.assertEqual(cache.name(self.category_id('临时')), '临时')
+
+    def test_reload_on_miss(self):
+        # 其他 worker 新建的分类：本进程缓存中没有，输出时重新加载
+        with self.engine.begin() as conn:
+            conn.execute(Category.__table__.insert(), [{'id': 7, 'name': '医疗'}])
+            conn.execute(Record.__table__.insert(), [{'type': 'expense', 'amount_cents': 100, 'category_id': 7,
+                                                      'date': date(2025, 1, 5), 'version': 1}])
+        self.assertEqual(self.client.get('/api/records').get_json()[0]['category'], '医疗')
+
+    def test_migrate_converts_category_names(self):
+        Base.metadata.drop_all(self.engine)
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(
+                'CREATE TABLE records (id INTEGER PRIMARY KEY, type VARCHAR(10) NOT NULL, amount_cents BIGINT NOT NULL, '
+                'category VARCHAR(50) NOT NULL, date DATE NOT NULL, note VARCHAR(200))')
+            conn.exec_driver_sql('CREATE INDEX ix_records_category_date ON records (category, date, id)')
+            conn.exec_driver_sql(
+                "INSERT INTO records (type, amount_cents, category, date) VALUES "
+                "('expense', 100, '餐饮', '2025-01-01'), ('expense', 200, '餐饮', '2025-01-01'), "
+                "('expense', 300, '交通', '2025-01-02')")
+            conn.exec_driver_sql(
+                'CREATE TABLE daily_totals (date DATE, type VARCHAR(10), category VARCHAR(50), total_cents BIGINT NOT NULL, '
+                'count INTEGER NOT NULL, PRIMARY KEY (date, type, category))')
+        migrate(self.engine)
+        self.assertNotIn('category', {c['name'] for c in inspect(self.engine).get_columns('records')})
+        self.assertEqual(self.daily_totals(), {(date(2025, 1, 1), 'expense', '餐饮'): (300, 2),
+                                               (date(2025, 1, 2), 'expense', '交通'): (300, 1)})
+        self.assertEqual(len(self.client.get('/api/records?category=餐饮').get_json()), 2)
+        migrate(self.engine)
+        self.assertEqual(len(self.client.get('/api/records').get_json()), 3)
+
+
+class TestBenchmark(LedgerTestCase):
+    """bench.py 的合成账本和混合负载"""
+
+    def test_mixed_workload_report(self):
+        bench.generate_ledger(self.engine, 2000, batch=500)
+        self.assertEqual(bench.ledger_size(self.engine), 2000)
+        self.assertTrue(self.client.get('/api/records?category=餐饮').get_json())
+        workload = bench.Workload(bench.DEFAULT_MIX, seed=1)
+        endpoints, overall = bench.run_workload(workload, bench.test_client_sender, concurrency=2, requests=300)
+        self.assertEqual(overall['requests'], 300)
+        self.assertEqual(overall['errors'], 0)
+        self.assertIn('GET /api/records', endpoints)
+        self.assertIn('POST /api/record', endpoints)
+        for stats in endpoints.values():
+            self.assertLessEqual(stats['p50_ms'], stats['p95_ms'])
+            self.assertLessEqual(stats['p95_ms'], stats['p99_ms'])
+            self.assertGreater(stats['peak_rss_mb'], 0)
+        # 写操作只删除本次新增的记录
+        self.assertGreaterEqual(bench.ledger_size(self.engine), 2000)
+
+    def test_scripts_smoke(self):
+        """两个基准脚本在当前表结构上能跑通，表结构变化时不会悄悄失效"""
+        here = os.path.dirname(os.path.abspath(__file__))
+        for script, args in [('bench.py', ['--rows', '1000', '--requests', '10', '--concurrency', '2']),
+                             ('bench_session.py', ['--requests', '10', '--concurrency', '2'])]:
+            result = subprocess.run([sys.executable, script] + args, cwd=here, capture_output=True, text=True,
+                                    timeout=300)
+            self.assertEqual(result.returncode, 0, f'{script}\n{result.stderr}')
+            self.assertIsInstance(json.loads(result.stdout), dict)
+
+    def test_compare(self):
+        old = {'commit': 'abc', 'endpoints': {'GET /api/stats': {'p95_ms': 10, 'throughput': 100}}}
+        new = {'endpoints': {'GET /api/stats': {'p95_ms': 15, 'throughput': 80}}}
+        result, regressed = bench.compare(new, old, threshold=1.2)
+        self.assertEqual(result['endpoints']['GET /api/stats'], {'p95_ratio': 1.5, 'throughput_ratio': 1.25})
+        self.assertTrue(regressed)
+        self.assertFalse(bench.compare(new, old, threshold=2)[1])
+
+
+class TestProfiling(LedgerTestCase):
+    """PROFILE_REQUESTS：Server-Timing 响应头、慢查询日志和 cProfile 采样"""
+
+    def setUp(self):
+        super().setUp()
+        self.profiler = app_module.profiler
+        self._orig = (self.profiler.slow_ms, self.profiler.sample_rate, self.profiler.profile_dir, self.profiler.keep)
+        self.logged = []
+        self.handler = logging.Handler()
+        self.handler.emit = lambda record: self.logged.append(json.loads(record.getMessage()))
+        self.profiler.slow_log.addHandler(self.handler)
+        self.profiler.enable()
+
+    def tearDown(self):
+        self.profiler.disable()
+        self.profiler.slow_log.removeHandler(self.handler)
+        self.profiler.slow_ms, self.profiler.sample_rate, self.profiler.profile_dir, self.profiler.keep = self._orig
+        self.profiler._slowest.clear()
+        super().tearDown()
+
+    def timing(self, resp):
+        metrics = {}
+        for part in resp.headers['Server-Timing'].split(', '):
+            name, _, params = part.partition(';')
+            metrics[name] = dict(p.split('=', 1) for p in params.split(';'))
+        return metrics
+
+    def test_server_timing(self):
+        self.client.post('/api/record', json={'type': 'expense', 'amount': 1, 'date': '2025-01-05'})
+        metrics = self.timing(self.client.get('/api/stats?start=2025-01-01&end=2025-01-31'))
+        self.assertEqual(set(metrics), {'db', 'serialize', 'app', 'total'})
+        self.assertRegex(metrics['db']['desc'], r'"[1-9]\d* queries"')
+        self.assertGreaterEqual(float(metrics['total']['dur']), float(metrics['db']['dur']))
+        self.profiler.disable()
+        self.assertNotIn('Server-Timing', self.client.get('/api/stats').headers)
+
+    def test_slow_query_log(self):
+        self.profiler.slow_ms = 1000
+        self.client.get('/api/records?category=餐饮')
+        self.assertEqual(self.logged, [])
+        self.profiler.slow_ms = 0
+        self.client.get('/api/records?category=餐饮')
+        entry = next(e for e in self.logged if 'categories' in e['sql'])
+        self.assertEqual(entry['path'], '/api/records?category=餐饮')
+        self.assertIn('餐饮', entry['params'])
+        self.assertGreaterEqual(entry['ms'], 0)
+
+    def test_keeps_slowest_profiles(self):
+        self.profiler.sample_rate = 1
+        self.profiler.keep = 2
+        self.profiler.profile_dir = tempfile.mkdtemp()
+        for _ in range(5):
+            self.client.get('/api/year-stats?year=2025')
+        profiles = self.profiler.profiles()
+        self.assertEqual(len(profiles), 2)
+        self.assertEqual(sorted(os.listdir(self.profiler.profile_dir)), sorted(os.path.basename(p) for p in profiles))
+        self.assertTrue(pstats.Stats(profiles[0]).total_calls > 0)
+        for path in profiles:
+            os.remove(path)
+        os.rmdir(self.profiler.profile_dir)
+
+
+def _metrics_worker(path, n):
+    """模拟另一个 gunicorn worker：记录 n 次请求后写出快照并退出"""
+    registry = metrics.Registry()
+    counter = registry.counter('requests_total', '')
+    for _ in range(n):
+        counter.inc((('route', '/api/stats'),))
+    registry.collector('pool_checked_out', 'gauge', '')(lambda: [((), 3)])
+    metrics.MultiProcessStore(registry, path).write()
+
+
+class TestMetrics(LedgerTestCase):
+    """/metrics：按线程分片计数、抓取时合并，多进程通过 METRICS_DIR 汇总"""
+
+    def scrape(self):
+        values = {}
+        for line in self.client.get('/metrics').get_data(as_text=True).splitlines():
+            if line and not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                values[name] = float(value)
+        return values
+
+    def test_endpoint(self):
+        key = 'ledger_http_requests_total{route="/api/records",method="GET",status="200"}'
+        before = self.scrape()
+        for _ in range(3):
+            self.client.get('/api/records?limit=5')
+        self.client.get('/api/stats')
+        after = self.scrape()
+        self.assertEqual(after[key] - before.get(key, 0), 3)
+        count = 'ledger_http_request_duration_seconds_count{route="/api/records"}'
+        self.assertEqual(after[count] - before.get(count, 0), 3)
+        self.assertEqual(after['ledger_http_request_duration_seconds_bucket{route="/api/records",le="+Inf"}'], after[count])
+        self.assertIn('ledger_db_rows_returned_count{query="stats_daily"}', after)
+        self.assertIn('ledger_db_pool_wait_seconds_count', after)
+        cache = self.client.get('/api/cache-stats').get_json()
+        self.assertEqual(after['ledger_cache_lookups_total{result="hit"}'], cache['hits'])
+        self.assertEqual(after['ledger_cache_hit_ratio'], cache['hit_ratio'])
+
+    def test_thread_shards_merge(self):
+        registry = metrics.Registry()
+        counter = registry.counter('hits_total', '')
+        histogram = registry.histogram('latency_seconds', '', buckets=(0.1, 1))
+
+        def work():
+            for i in range(1000):
+                counter.inc()
+                histogram.observe(0.05 if i % 2 else 0.5)
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['counters'][metrics.series_key('hits_total')], 8000)
+        self.assertEqual(snapshot['histograms'][metrics.series_key('latency_seconds')][:3], [4000, 4000, 0])
+        text = registry.render(snapshot)
+        self.assertIn('latency_seconds_bucket{le="1"} 8000', text)
+        self.assertIn('latency_seconds_count 8000', text)
+
+    def test_dead_thread_shards_retired(self):
+        # 线程池不断换线程时分片数不增长，已结束线程的计数仍保留
+        registry = metrics.Registry()
+        counter = registry.counter('hits_total', '')
+        histogram = registry.histogram('latency_seconds', '', buckets=(0.1, 1))
+
+        def work():
+            counter.inc()
+            histogram.observe(0.5)
+        for _ in range(5):
+            threads = [threading.Thread(target=work) for _ in range(20)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            snapshot = registry.snapshot()
+            self.assertLessEqual(len(registry._shards), 1)
+        self.assertEqual(snapshot['counters'][metrics.series_key('hits_total')], 100)
+        self.assertEqual(snapshot['histograms'][metrics.series_key('latency_seconds')][:3], [0, 100, 0])
+        self.assertEqual(snapshot['histograms'][metrics.series_key('latency_seconds')][-1], 100)
+
+    def test_multiprocess_aggregation(self):
+        path = tempfile.mkdtemp()
+        registry = metrics.Registry()
+        registry.counter('requests_total', '').inc((('route', '/api/stats'),), 5)
+        registry.collector('pool_checked_out', 'gauge', '')(lambda: [((), 1)])
+        store = metrics.MultiProcessStore(registry, path)
+        ctx = multiprocessing.get_context('fork')
+        worker = ctx.Process(target=_metrics_worker, args=(path, 7))
+        worker.start()
+        worker.join()
+        snapshot = store.collect()
+        # 已退出的 worker 的计数仍计入总数，gauge 只计运行中的进程
+        self.assertEqual(snapshot['counters'][metrics.series_key('requests_total', (('route', '/api/stats'),))], 12)
+        self.assertEqual(snapshot['gauges'][metrics.series_key('pool_checked_out')], 1)
+        for name in os.listdir(path):
+            os.remove(os.path.join(path, name))
+        os.rmdir(path)
+
+
+@unittest.skipUnless(analytics.available(), '需要 numpy')
+class TestAnalytics(LedgerTestCase):
+    """ANALYTICS_MODE：统计接口从列式快照计算，结果与日汇总表一致"""
+
+    def setUp(self):
+        super().setUp()
+        app_module.api_cache = MemoryCache(maxsize=0)
+        app_module.columnar = analytics.ColumnarLedger(lambda: app_module.engine, background=False)
+        self.addCleanup(setattr, app_module, 'columnar', None)
+
+    def stats(self):
+        return [self.client.get(url).get_json() for url in (
+            '/api/stats?year=2025&month=2',
+            '/api/stats?start=2025-01-10&end=2025-03-05&year=2024&month=12',
+            '/api/year-stats?year=2025',
+            '/api/year-stats?year=2024',
+        )]
+
+    def assertMatchesSql(self):
+        columnar = self.stats()
+        snapshot, app_module.columnar = app_module.columnar, None
+        try:
+            expected = self.stats()
+        finally:
+            app_module.columnar = snapshot
+        self.assertEqual(columnar, expected)
+
+    def test_incremental_writes_match_sql(self):
+        rng = random.Random(7)
+        categories = ['餐饮', '交通', '工资', '房租']
+        ids = []
+        for _ in range(40):
+            data = self.client.post('/api/record', json={
+                'type': rng.choice(['income', 'expense']), 'amount': rng.randint(1, 50000) / 100,
+                'category': rng.choice(categories), 'date': f'2025-{rng.randint(1, 3):02d}-{rng.randint(1, 28):02d}',
+            }).get_json()
+            ids.append(data['id'])
+        self.assertMatchesSql()
+        for rid in rng.sample(ids, 10):
+            self.client.put(f'/api/record/{rid}', json={'amount': 12.34, 'date': '2024-12-31', 'category': '其他'})
+        for rid in rng.sample(ids, 15):
+            self.client.delete(f'/api/record/{rid}')
+        rows = [{'type': 'expense', 'amount': i, 'category': '购物', 'date': '2025-02-14'} for i in range(1, 30)]
+        self.client.post('/api/records/bulk', json=rows)
+        self.assertMatchesSql()
+        self.assertIsNotNone(app_module.columnar.version)
+
+    def test_writes_from_other_process(self):
+        self.client.post('/api/record', json={'type': 'income', 'amount': 100, 'category': '工资', 'date': '2025-02-01'})
+        self.assertEqual(self.stats()[0]['month_summary']['income'], '100.00')
+        # 其他 worker 或导入脚本直接写库，快照通过账本版本取回
+        session = get_session(self.engine)
+        ingest.insert_batch(session, [{'type': 'income', 'amount_cents': 5000, 'category': '工资',
+                                       'date': date(2025, 2, 2), 'note': ''}])
+        session.commit()
+        session.close()
+        self.assertEqual(self.stats()[0]['month_summary']['income'], '150.00')
+        self.assertMatchesSql()
+
+    def test_background_load_falls_back_to_sql(self):
+        self.client.post('/api/record', json={'type': 'expense', 'amount': 8, 'category': '餐饮', 'date': '2025-02-01'})
+        app_module.columnar = analytics.ColumnarLedger(lambda: app_module.engine)
+        self.assertIsNone(app_module.columnar.current())
+        app_module.columnar._loading.join()
+        self.assertIs(app_module.columnar.current(), app_module.columnar)
+        self.assertMatchesSql()
+
+    def test_out_of_order_ids_and_compaction(self):
+        ledger = analytics.ColumnarLedger(background=False)
+        row = lambda rid, day, cents: (rid, date(2025, 1, day), 'expense', 1, cents)
+        ledger._apply([row(1, 1, 100), row(5, 2, 200)], [])
+        ledger._apply([row(3, 2, 300)], [])
+        self.assertEqual(list(ledger.ids[:ledger.n]), [1, 3, 5])
+        ledger._apply([], [1, 3])
+        self.assertEqual(ledger.n, 1)
+        self.assertEqual(ledger.totals_by_type(date(2025, 1, 1), date(2025, 2, 1)), (0, 200))
+        by_category, daily = ledger.range_stats(None, None)
+        self.assertEqual(by_category, [(1, 'expense', 200)])
+        self.assertEqual(daily, {date(2025, 1, 2): {'expense': 200}})
+
+
+class TestSqliteMode(LedgerTestCase):
+    """SQLite 文件库：WAL 和连接级 PRAGMA，写请求通过单个写连接按顺序执行"""
+
+    def test_pragmas(self):
+        with self.engine.connect() as conn:
+            pragma = lambda name: conn.exec_driver_sql(f'PRAGMA {name}').scalar()
+            self.assertEqual(pragma('journal_mode'), 'wal')
+            self.assertEqual(pragma('synchronous'), 1)  # NORMAL
+            self.assertEqual(pragma('cache_size'), -64 * 1024)
+            self.assertEqual(pragma('busy_timeout'), 5000)
+
+    def test_writes_use_single_writer(self):
+        writer = writer_engine(self.engine)
+        self.assertIs(writer_engine(self.engine), writer)
+        self.assertEqual(writer.pool.size(), 1)
+        memory = get_engine('sqlite://')
+        self.assertIs(writer_engine(memory), memory)
+        for method, bind in (('GET', self.engine), ('POST', writer), ('PUT', writer), ('DELETE', writer)):
+            with app_module.app.test_request_context('/', method=method):
+                self.assertIs(app_module.request_session().get_bind(), bind)
+        self.client.post('/api/record', json={'type': 'expense', 'amount': 1, 'date': '2025-01-01'})
+        self.assertEqual(writer.pool.checkedin(), 1)
+
+    def test_concurrent_reads_and_writes(self):
+        app_module.api_cache = MemoryCache(maxsize=0)
+        statuses = []
+
+        def worker(n):
+            client = app_module.app.test_client()
+            for i in range(15):
+                resp = client.post('/api/record', json={
+                    'type': 'expense', 'amount': i + 1, 'category': f'分类{n}', 'date': f'2025-01-{i + 1:02d}'})
+                statuses.append(resp.status_code)
+                statuses.append(client.get('/api/stats?year=2025&month=1').status_code)
+                statuses.append(client.put(f"/api/record/{resp.get_json()['id']}", json={'amount': 2}).status_code)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(set(statuses)), [200, 201])
+        stats = self.client.get('/api/stats?year=2025&month=1').get_json()
+        self.assertEqual(stats['month_summary']['expense'], format_cents(8 * 15 * 200))
+
+
+class TestWriteBehind(LedgerTestCase):
+    """WRITE_BEHIND：POST /api/record 由后台线程组提交，提交后才返回"""
+
+    def setUp(self):
+        super().setUp()
+        self.gate = threading.Event()
+        self.gate.set()
+        self.writer = self.make_writer()
+        app_module.write_behind = self.writer
+        self.addCleanup(setattr, app_module, 'write_behind', None)
+
+    def make_writer(self, **options):
+        def bind():
+            self.gate.wait()
+            return writer_engine(app_module.engine)
+        writer = writebehind.GroupCommitWriter(bind, max_delay=0.01, on_commit=app_module.write_behind_committed,
+                                               **options)
+        self.addCleanup(writer.stop, 5)
+        return writer
+
+    def test_concurrent_posts_share_commits(self):
+        responses = []
+
+        def worker(n):
+            client = app_module.app.test_client()
+            for i in range(10):
+                resp = client.post('/api/record', json={
+                    'type': 'expense', 'amount': '1.50', 'category': f'分类{n % 3}', 'date': f'2025-03-{i + 1:02d}'})
+                responses.append((resp.status_code, resp.get_json()))
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual({status for status, _ in responses}, {201})
+        self.assertEqual(len({data['id'] for _, data in responses}), 80)
+        self.assertEqual(responses[0][1]['amount'], '1.50')
+        self.assertLess(self.writer.batches, 80)
+        self.assertEqual(self.writer.rows, 80)
+        self.assertEqual(len(self.client.get('/api/records').get_json()), 80)
+        maintained = self.daily_totals()
+        rollup.rebuild(self.engine)
+        self.assertEqual(maintained, self.daily_totals())
+
+    def test_queue_full_returns_503(self):
+        self.writer = app_module.write_behind = self.make_writer(max_batch=1, max_queue=1, put_timeout=0.01)
+        self.gate.clear()
+        payload = {'type': 'income', 'amount': 1, 'date': '2025-03-01'}
+        # 第一条被写入线程取走后阻塞在 bind()，第二条占满队列
+        first = self.writer.submit(ingest.parse_record(payload))
+        while self.writer.depth():
+            time.sleep(0.001)
+        second = self.writer.submit(ingest.parse_record(payload))
+        resp = self.client.post('/api/record', json=payload)
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'], '1')
+        self.gate.set()
+        self.assertNotEqual(first.result(5).id, second.result(5).id)
+
+    def test_failed_row_does_not_fail_batch(self):
+        self.gate.clear()
+        good = ingest.parse_record({'type': 'expense', 'amount': 2, 'date': '2025-03-02'})
+        futures = [self.writer.submit(dict(good)), self.writer.submit(dict(good, date='not a date')),
+                   self.writer.submit(dict(good))]
+        self.gate.set()
+        self.assertEqual(futures[0].result(5).amount_cents, 200)
+        self.assertEqual(futures[2].result(5).amount_cents, 200)
+        with self.assertRaises(Exception):
+            futures[1].result(5)
+        self.assertEqual(len(self.client.get('/api/records').get_json()), 2)
+
+
+class TestReplica(LedgerTestCase):
+    """只读副本：读请求查询副本，写入后的固定期内读主库；测试中用第二个 SQLite 文件充当副本"""
+
+    def setUp(self):
+        super().setUp()
+        fd, self.replica_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.replica = None
+        self.replicate()
+        self.replica = app_module.replica_engine = get_engine(f'sqlite:///{self.replica_path}')
+        self.addCleanup(os.remove, self.replica_path)
+        self.addCleanup(setattr, app_module, 'replica_engine', None)
+
+    def tearDown(self):
+        dispose_engine(self.replica)
+        super().tearDown()
+
+    def replicate(self):
+        """把主库完整复制到副本，模拟复制追上"""
+        if self.replica is not None:
+            dispose_engine(self.replica)
+        src, dst = sqlite3.connect(self.db_path), sqlite3.connect(self.replica_path)
+        src.backup(dst)
+        src.close()
+        dst.close()
+
+    def post(self, client, amount):
+        return client.post('/api/record', json={'type': 'expense', 'amount': amount, 'date': '2025-04-01'})
+
+    def test_reads_use_replica_until_written(self):
+        other = app_module.app.test_client()
+        resp = self.post(self.client, 1)
+        self.assertIn('Max-Age=5', resp.headers['Set-Cookie'])
+        # 写入的客户端固定到主库，其他客户端读副本（尚未复制）
+        self.assertEqual(len(self.client.get('/api/records').get_json()), 1)
+        self.assertEqual(other.get('/api/records').get_json(), [])
+        # 增量同步总是读主库
+        self.assertEqual(len(other.get('/api/changes?since=0').get_json()['records']), 1)
+        self.replicate()
+        self.assertEqual(len(other.get('/api/records').get_json()), 1)
+
+    def test_stale_replica_results_not_cached(self):
+        other = app_module.app.test_client()
+        self.post(self.client, 2)
+        stats = other.get('/api/year-stats?year=2025').get_json()
+        self.assertEqual(stats['expense'], '0.00')
+        self.assertNotIn(('year-stats', 2025), app_module.api_cache._data)
+        self.assertEqual(self.client.get('/api/year-stats?year=2025').get_json()['expense'], '2.00')
+        app_module.api_cache.clear()
+        self.replicate()
+        self.assertEqual(other.get('/api/year-stats?year=2025').get_json()['expense'], '2.00')
+        self.assertIn(('year-stats', 2025), app_module.api_cache._data)
+
+    def test_lagging_replica_not_revalidated(self):
+        other = app_module.app.test_client()
+        self.post(self.client, 5)
+        stale = other.get('/api/records')
+        self.assertEqual(stale.get_json(), [])
+        self.assertNotIn('ETag', stale.headers)
+        self.assertEqual(stale.headers['Cache-Control'], 'no-store')
+        # 客户端拿着主库的 ETag 向落后的副本确认，也不能得到 304
+        etag = self.client.get('/api/records').headers['ETag']
+        self.assertEqual(other.get('/api/records', headers={'If-None-Match': etag}).status_code, 200)
+        # 旧结果没有 ETag，副本追上后客户端只能无条件请求，拿到最新数据
+        self.replicate()
+        fresh = other.get('/api/records')
+        self.assertEqual(fresh.status_code, 200)
+        self.assertEqual(len(fresh.get_json()), 1)
+        self.assertEqual(fresh.headers['Cache-Control'], 'no-cache')
+        self.assertEqual(other.get('/api/records', headers={'If-None-Match': fresh.headers['ETag']}).status_code, 304)
+
+    def test_without_replica_reads_primary(self):
+        app_module.replica_engine = None
+        self.post(self.client, 3)
+        self.assertEqual(len(app_module.app.test_client().get('/api/records').get_json()), 1)
+        self.assertNotIn('Set-Cookie', self.post(self.client, 4).headers)
+
+
+class TestPartitions(LedgerTestCase):
+    """按年归档：记录移到 records_<年>，查询跨表拼接，归档年份只读，年度统计读冻结的汇总"""
+
+    def setUp(self):
+        super().setUp()
+        self.year = date.today().year
+        self.old, self.older = self.year - 1, self.year - 2
+        food = self.category_id('餐饮')
+        # 当年的记录最后写入，id 最大，归档后 SQLite 不会重用被移走的 id
+        self.add_records([
+            Record(type='expense', amount_cents=100 * (i + 1), category_id=food, date=date(y, 1 + i % 12, 1 + i % 28),
+                   version=1)
+            for y in (self.older, self.old, self.year) for i in range(10)
+        ])
+        self.before = {y: self.client.get(f'/api/year-stats?year={y}').get_json() for y in (self.older, self.old)}
+        self.ids = [r['id'] for r in self.client.get('/api/records').get_json()]
+        app_module.api_cache.clear()
+
+    def archive(self, year):
+        return partitions.archive_through(self.engine, year)
+
+    def test_archive_moves_records_and_freezes_totals(self):
+        self.assertEqual(self.archive(self.old), {self.older: 10, self.old: 10})
+        session = get_session(self.engine)
+        self.assertEqual(session.query(Record).count(), 10)
+        self.assertEqual([t.name for t in partitions.tables(session)],
+                         ['records', f'records_{self.old}', f'records_{self.older}'])
+        # 按日期范围裁剪到有交集的表
+        self.assertEqual([t.name for t in partitions.tables(session, date(self.old, 3, 1), date(self.old, 5, 1))],
+                         [f'records_{self.old}'])
+        session.close()
+        for y in (self.older, self.old):
+            self.assertEqual(self.client.get(f'/api/year-stats?year={y}').get_json(), self.before[y])
+        # 汇总表重建后归档年份的汇总不变
+        rollup.rebuild(self.engine)
+        app_module.api_cache.clear()
+        self.assertEqual(self.client.get(f'/api/year-stats?year={self.old}').get_json(), self.before[self.old])
+
+    def test_queries_span_archived_tables(self):
+        self.archive(self.old)
+        self.assertEqual([r['id'] for r in self.client.get('/api/records').get_json()], self.ids)
+        seen, cursor = [], None
+        while True:
+            page = self.client.get('/api/records?limit=7' + (f'&cursor={cursor}' if cursor else '')).get_json()
+            seen += [r['id'] for r in page['items']]
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, self.ids)
+        in_range = self.client.get(f'/api/records?start={self.old}-01-01&end={self.old}-12-31').get_json()
+        self.assertEqual(len(in_range), 10)
+        lines = self.client.get('/api/export?format=ndjson').get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], self.ids)
+        changes = self.client.get('/api/changes?since=0&limit=15').get_json()
+        self.assertEqual(len(changes['records']), 30)
+
+    def test_archived_years_are_read_only(self):
+        self.archive(self.old)
+        archived_id = self.client.get(f'/api/records?start={self.old}-01-01&end={self.old}-12-31').get_json()[0]['id']
+        live_id = self.ids[0]
+        resp = self.client.post('/api/record', json={'type': 'expense', 'amount': 1, 'date': f'{self.old}-06-01'})
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(self.client.put(f'/api/record/{archived_id}', json={'amount': 1}).status_code, 400)
+        self.assertEqual(self.client.delete(f'/api/record/{archived_id}').status_code, 400)
+        self.assertEqual(self.client.put(f'/api/record/{live_id}', json={'date': f'{self.older}-01-01'}).status_code, 400)
+        self.assertEqual(self.client.delete('/api/record/999999').status_code, 404)
+        resp = self.client.post('/api/records/bulk', json=[
+            {'type': 'expense', 'amount': 1, 'date': f'{self.old}-06-01'},
+            {'type': 'expense', 'amount': 2, 'date': f'{self.year}-01-01'},
+        ]).get_json()
+        self.assertEqual((resp['inserted'], [e['index'] for e in resp['errors']]), (1, [0]))
+        self.assertEqual(self.client.get(f'/api/year-stats?year={self.old}').get_json(), self.before[self.old])
+
+    def test_archive_rules(self):
+        with self.assertRaises(ValueError):
+            partitions.archive_year(self.engine, self.year)
+        with self.assertRaises(ValueError):
+            partitions.archive_year(self.engine, self.old)
+        self.assertEqual(self.archive(self.older), {self.older: 10})
+        self.assertEqual(self.archive(self.older), {})
+        # 移走的记录包含最大的 id 时拒绝归档，避免新记录重用这些 id
+        self.client.post('/api/record', json={'type': 'expense', 'amount': 1, 'date': f'{self.old}-12-31'})
+        with self.assertRaises(ValueError):
+            partitions.archive_year(self.engine, self.old)
+
+    @unittest.skipUnless(analytics.available(), '未安装 NumPy')
+    def test_columnar_snapshot_includes_archived(self):
+        self.archive(self.old)
+        columnar = analytics.ColumnarLedger(lambda: self.engine, background=False)
+        snapshot = columnar.current()
+        income, expense = snapshot.totals_by_type(date(self.older, 1, 1), date(self.year + 1, 1, 1))
+        self.assertEqual(expense, 3 * sum(100 * (i + 1) for i in range(10)))
+
+
+class TestSearch(LedgerTestCase):
+    """GET /api/records?q= 全文搜索：写入时维护的索引、中文切分、相关度排序与分页"""
+
+    def setUp(self):
+        super().setUp()
+        for note, category, day in [('地铁卡充值', '交通', '2025-01-03'), ('买书', '学习', '2025-01-05'),
+                                    ('午饭 午饭 又是午饭', '餐饮', '2025-02-01'), ('和同事吃午饭', '餐饮', '2025-02-02'),
+                                    ('Starbucks coffee', '餐饮', '2025-02-03'), ('书架', '家居', '2025-03-01')]:
+            self.client.post('/api/record', json={'type': 'expense', 'amount': 1, 'category': category,
+                                                  'date': day, 'note': note})
+
+    def search(self, q, **params):
+        resp = self.client.get('/api/records', query_string=dict(params, q=q))
+        self.assertEqual(resp.status_code, 200)
+        return resp.get_json()
+
+    def notes(self, q, **params):
+        return [r['note'] for r in self.search(q, **params)['items']]
+
+    def test_cjk_terms_match_substrings(self):
+        self.assertEqual(self.notes('买书'), ['买书'])
+        self.assertEqual(self.notes('卡充'), ['地铁卡充值'])
+        self.assertEqual(self.notes('地充'), [])
+        self.assertEqual(sorted(self.notes('书')), ['书架', '买书'])
+        self.assertEqual(self.notes('star'), ['Starbucks coffee'])
+        # 分类名称也在索引中，多个词需要全部出现
+        self.assertEqual(self.notes('交通'), ['地铁卡充值'])
+        self.assertEqual(self.notes('餐饮 同事'), ['和同事吃午饭'])
+
+    def test_ranked_and_combined_with_filters(self):
+        self.assertEqual(self.notes('午饭'), ['午饭 午饭 又是午饭', '和同事吃午饭'])
+        self.assertEqual(self.notes('午饭', start='2025-02-02'), ['和同事吃午饭'])
+        self.assertEqual(self.notes('书', category='学习'), ['买书'])
+
+    def test_pagination(self):
+        self.client.post('/api/records/bulk', json=[
+            {'type': 'expense', 'amount': 1, 'date': f'2025-04-{i + 1:02d}', 'note': f'午饭{i}'} for i in range(5)
+        ])
+        seen, cursor = [], None
+        while True:
+            page = self.search('午饭', limit=3, **({'cursor': cursor} if cursor else {}))
+            seen += [r['id'] for r in page['items']]
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+        self.assertEqual(self.client.get('/api/records?q=%20!!').status_code, 400)
+        self.assertEqual(self.client.get('/api/records?q=午饭&cursor=bad').status_code, 400)
+
+    def test_window_ranks_only_newest_matches(self):
+        # 没有日期范围时只在最新的 SEARCH_WINDOW 条匹配记录中按相关度排序；指定日期范围时不限制
+        app_module.app.config['SEARCH_WINDOW'] = 1
+        self.addCleanup(app_module.app.config.pop, 'SEARCH_WINDOW')
+        self.assertEqual(self.notes('午饭'), ['和同事吃午饭'])
+        self.assertEqual(self.notes('午饭', start='2025-01-01'), ['午饭 午饭 又是午饭', '和同事吃午饭'])
+        app_module.app.config['SEARCH_WINDOW'] = 2
+        self.assertEqual(self.notes('餐饮 午饭'), ['午饭 午饭 又是午饭', '和同事吃午饭'])
+
+    def test_index_follows_updates_and_deletes(self):
+        rid = self.search('买书')['items'][0]['id']
+        self.client.put(f'/api/record/{rid}', json={'note': '买文具'})
+        self.assertEqual(self.notes('买书'), [])
+        self.assertEqual(self.notes('文具'), ['买文具'])
+        self.client.put(f'/api/record/{rid}', json={'category': '办公用品'})
+        self.assertEqual(self.notes('办公 文具'), ['买文具'])
+        self.assertEqual(self.notes('学习'), [])
+        self.client.delete(f'/api/record/{rid}')
+        self.assertEqual(self.notes('文具'), [])
+
+    def test_migrate_backfills_existing_records(self):
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql('DROP TRIGGER records_fts_delete')
+            conn.exec_driver_sql('DROP TABLE records_fts')
+        search._indexed.clear()
+        migrate(self.engine)
+        self.assertEqual(self.notes('地铁'), ['地铁卡充值'])
+        self.client.post('/api/record', json={'type': 'expense', 'amount': 1, 'date': '2025-05-01', 'note': '地铁'})
+        self.assertEqual(len(self.notes('地铁')), 2)
+
+    def test_external_writes(self):
+        # 没有注册任何自定义函数的连接（sqlite3 命令行、备份工具）可以写 records，重新执行迁移后可以搜索到
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("INSERT INTO records (type, amount_cents, category_id, date, note, version) "
+                     "VALUES ('expense', 100, ?, '2025-05-02', '外部导入的书', 0)", (self.category_id('餐饮'),))
+        conn.execute("UPDATE records SET note = note || '!' WHERE note = '书架'")
+        conn.commit()
+        conn.close()
+        self.assertEqual(self.notes('外部'), [])
+        migrate(self.engine)
+        app_module.api_cache.clear()
+        self.assertEqual(self.notes('外部'), ['外部导入的书'])
+        rid = self.search('外部')['items'][0]['id']
+        self.client.delete(f'/api/record/{rid}')
+        self.assertEqual(self.notes('外部'), [])
+
+    def test_archived_records_stay_searchable(self):
+        old = 2020
+        self.client.post('/api/record', json={'type': 'expense', 'amount': 1, 'date': f'{old}-06-01', 'note': '旧书'})
+        self.client.post('/api/record', json={'type': 'expense', 'amount': 1, 'date': date.today().isoformat(),
+                                              'note': '新书'})
+        partitions.archive_through(self.engine, old)
+        app_module.api_cache.clear()
+        self.assertEqual(sorted(self.notes('书')), ['书架', '买书', '新书', '旧书'])
+        self.assertEqual(self.notes('书', start=f'{old}-01-01', end=f'{old}-12-31'), ['旧书'])
+        self.assertEqual(len(self.search('书', limit=1)['items']), 1)
+
+
+class TestDashboard(LedgerTestCase):
+    """/api/dashboard 一次返回首页需要的全部数据"""
+
+    def setUp(self):
+        super().setUp()
+        self.add_records([
+            Record(type='income', amount_cents=500000, category_id=self.category_id('工资'), date=date(2025, 1, 5)),
+            Record(type='expense', amount_cents=5000, category_id=self.category_id('餐饮'), date=date(2025, 1, 6)),
+            Record(type='expense', amount_cents=3000, category_id=self.category_id('交通'), date=date(2024, 12, 30)),
+        ])
+
+    def test_matches_individual_endpoints(self):
+        data = self.client.get('/api/dashboard?start=2025-01-01&end=2025-01-31&month=2024-12&year=2025&limit=1').get_json()
+        stats = self.client.get('/api/stats?start=2025-01-01&end=2025-01-31&year=2024&month=12').get_json()
+        self.assertEqual(data['by_category'], stats['by_category'])
+        self.assertEqual(data['daily_stats'], stats['daily_stats'])
+        self.assertEqual(data['month_summary'], stats['month_summary'])
+        self.assertEqual(data['year_stats'], self.client.get('/api/year-stats?year=2025').get_json())
+        self.assertEqual(len(data['records']['items']), 1)
+        self.assertIsNotNone(data['records']['next_cursor'])
+
+    def test_month_in_selected_year_reuses_year_stats(self):
+        data = self.client.get('/api/dashboard?month=2025-01&year=2025').get_json()
+        self.assertEqual(data['month_summary'],
+                         {'year': 2025, 'month': 1, 'income': '5000.00', 'expense': '50.00', 'balance': '4950.00'})
+        self.assertNotIn(('month-summary', 2025, 1), app_module.api_cache._data)
+
+    def test_invalid_month(self):
+        self.assertEqual(self.client.get('/api/dashboard?month=2025-13').status_code, 400)
+
+
+class TestApiCache(LedgerTestCase):
+    """接口缓存：LRU + TTL，按日期范围选择性失效"""
+
+    def test_lru_eviction_and_ttl(self):
+        cache = MemoryCache(maxsize=2, ttl=0.05)
+        cache.set('a', 1, [(None, None)])
+        cache.set('b', 2, [(None, None)])
+        cache.get('a')
+        cache.set('c', 3, [(None, None)])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        time.sleep(0.06)
+        self.assertIsNone(cache.get('c'))
+        stats = cache.stats()
+        self.assertEqual((stats['evictions'], stats['expirations']), (1, 1))
+
+    def test_write_invalidates_only_overlapping_ranges(self):
+        self.client.get('/api/year-stats?year=2024')
+        self.client.get('/api/year-stats?year=2025')
+        self.client.get('/api/stats?start=2025-01-01&end=2025-01-31&year=2025&month=1')
+        # /api/stats 的区间统计和月度结余分别缓存
+        before = self.client.get('/api/cache-stats').get_json()
+        self.assertEqual((before['size'], before['misses']), (4, 4))
+
+        self.client.post('/api/record', json={'type': 'expense', 'amount': 8, 'category': '餐饮', 'date': '2025-01-10'})
+        after = self.client.get('/api/cache-stats').get_json()
+        self.assertEqual((after['size'], after['invalidations']), (1, 3))
+
+        # 2024 年的缓存仍然命中，2025 年重新计算并包含新记录
+        self.client.get('/api/year-stats?year=2024')
+        year = self.client.get('/api/year-stats?year=2025').get_json()
+        self.assertEqual(year['expense'], '8.00')
+        final = self.client.get('/api/cache-stats').get_json()
+        self.assertEqual((final['hits'], final['misses']), (1, 5))
+
+    def test_records_page_cached_and_invalidated(self):
+        url = '/api/records?limit=10&start=2025-01-01&end=2025-01-31'
+        self.assertEqual(self.client.get(url).get_json()['items'], [])
+        self.client.get(url)
+        self.assertEqual(app_module.api_cache.hits, 1)
+        self.client.post('/api/record', json={'type': 'expense', 'amount': 8, 'category': '餐饮', 'date': '2025-01-10'})
+        self.assertEqual(len(self.client.get(url).get_json()['items']), 1)
+
+    def test_result_computed_across_invalidation_is_not_stored(self):
+        cache = MemoryCache()
+        generation = cache.generation()
+        cache.invalidate(date(2025, 1, 1))
+        cache.set('k', 1, [(None, None)], generation)
+        self.assertIsNone(cache.get('k'))
+
+    def test_invalidation_during_set_is_not_lost(self):
+        # 在比较代数之后、写入之前到达的失效，不能让旧结果以新的代数留在缓存中
+        cache = MemoryCache()
+        generation = cache.generation()
+        original, threads = cache.generation, []
+
+        def generation_then_invalidate():
+            value = original()
+            t = threading.Thread(target=cache.invalidate, args=(date(2025, 1, 1),))
+            t.start()
+            t.join(0.05)
+            threads.append(t)
+            return value
+        cache.generation = generation_then_invalidate
+        cache.set('k', 1, [(None, None)], generation)
+        for t in threads:
+            t.join()
+        self.assertIsNone(cache.get('k'))
+
+
+class TestConditionalGet(LedgerTestCase):
+    """读接口的 ETag / 304"""
+
+    URLS = ['/api/records?limit=10', '/api/stats?year=2025&month=1',
+            '/api/year-stats?year=2025', '/api/dashboard?year=2025']
+
+    def setUp(self):
+        super().setUp()
+        self.add_records([Record(type='expense', amount_cents=1000, category_id=self.category_id('餐饮'), date=date(2025, 1, 5))])
+
+    def revalidate(self, url, etag):
+        return self.client.get(url, headers={'If-None-Match': etag})
+
+    def test_not_modified_until_write(self):
+        etags = {}
+        for url in self.URLS:
+            resp = self.client.get(url)
+            self.assertEqual(resp.headers['Cache-Control'], 'no-cache')
+            etags[url] = resp.headers['ETag']
+        self.assertEqual(len(set(etags.values())), len(self.URLS))
+
+        for url, etag in etags.items():
+            resp = self.revalidate(url, etag)
+            self.assertEqual(resp.status_code, 304, url)
+            self.assertEqual(resp.data, b'')
+            self.assertEqual(resp.headers['ETag'], etag)
+
+        # 任何写操作之后都重新返回完整结果
+        self.client.post('/api/record', json={'type': 'income', 'amount': 1, 'date': '2020-01-01'})
+        for url, etag in etags.items():
+            resp = self.revalidate(url, etag)
+            self.assertEqual(resp.status_code, 200, url)
+            self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_304_only_reads_version(self):
+        etag = self.client.get('/api/dashboard?year=2025').headers['ETag']
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(app_module.engine, 'before_cursor_execute', count)
+        self.addCleanup(event.remove, app_module.engine, 'before_cursor_execute', count)
+        self.assertEqual(self.revalidate('/api/dashboard?year=2025', etag).status_code, 304)
+        self.assertEqual(len(statements), 1)
+        self.assertIn('ledger_meta', statements[0])
+
+    def test_write_from_other_process_changes_etag(self):
+        # 不经过本进程的写入（另一个 worker、命令行导入）同样改变 ETag，并使本进程接口缓存中受影响的结果失效
+        etags = {url: self.client.get(url).headers['ETag'] for url in self.URLS + ['/api/changes?since=0']}
+        other = get_engine(f'sqlite:///{self.db_path}')
+        session = get_session(other)
+        ingest.insert_batch(session, [{'type': 'income', 'amount_cents': 500, 'category': '工资', 'date': date(2025, 1, 20)}])
+        session.commit()
+        session.close()
+        dispose_engine(other)
+        for url, etag in etags.items():
+            self.assertEqual(self.revalidate(url, etag).status_code, 200, url)
+        # 接口缓存中的结果也随之失效
+        self.assertEqual(len(self.client.get('/api/records?limit=10').get_json()['items']), 2)
+        self.assertEqual(self.client.get('/api/year-stats?year=2025').get_json()['income'], '5.00')
+        changes = self.revalidate('/api/changes?since=0', etags['/api/changes?since=0']).get_json()
+        # setUp 的记录版本为 0，since=0 只返回另一个进程写入的记录
+        self.assertEqual(len(changes['records']), 1)
+
+    def test_errors_have_no_etag(self):
+        resp = self.client.get('/api/records?cursor=xxx')
+        self.assertEqual(resp.status_code, 400)
+        self.assertNotIn('ETag', resp.headers)
+
+
+class TestSharedCache(unittest.TestCase):
+    """shared 后端：一个进程的写操作使所有进程的缓存失效"""
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        # 两个实例共享同一个文件，模拟两个 gunicorn worker
+        self.worker_a = SharedCache(path=self.path)
+        self.worker_b = SharedCache(path=self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_invalidation_propagates(self):
+        jan, feb = (date(2025, 1, 1), date(2025, 1, 31)), (date(2025, 2, 1), date(2025, 2, 28))
+        for worker in (self.worker_a, self.worker_b):
+            worker.set('jan', 'j', [jan])
+            worker.set('feb', 'f', [feb])
+        self.worker_a.invalidate(date(2025, 1, 15))
+        self.assertIsNone(self.worker_a.get('jan'))
+        self.assertIsNone(self.worker_b.get('jan'))
+        self.assertEqual(self.worker_b.get('feb'), 'f')
+        self.assertEqual(self.worker_a.generation(), self.worker_b.generation())
+
+    def test_truncated_log_clears_local_cache(self):
+        self.worker_b.set('feb', 'f', [(date(2025, 2, 1), date(2025, 2, 28))])
+        self.worker_a.LOG_SIZE = 2
+        for day in range(1, 6):
+            self.worker_a.invalidate(date(2025, 1, day))
+        self.assertIsNone(self.worker_b.get('feb'))
+
+
+if __name__ == '__main__':
+    unittest.main()
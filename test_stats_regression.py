@@ -0,0 +1,135 @@
+"""
+统计接口回归测试：SQL 聚合结果必须与原先逐行 Python 求和的实现一致
+金额按整数分求和，两边的结果应当完全相等，而不只是近似相等。
+默认生成 100 万条记录，可通过环境变量 LEDGER_REGRESSION_ROWS 调整规模：
+    LEDGER_REGRESSION_ROWS=50000 python -m pytest -q test_stats_regression.py
+"""
+import os
+import random
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import insert
+
+import app as app_module
+import rollup
+from money import format_cents
+from models import Base, Category, Record, dispose_engine, get_engine, get_session
+
+ROWS = int(os.getenv('LEDGER_REGRESSION_ROWS', 1_000_000))
+YEARS = (2023, 2024, 2025)
+CATEGORIES = ['餐饮', '交通', '购物', '工资', '兼职', '娱乐', '医疗']
+
+
+def legacy_month_summary(session, year, month):
+    """原 /api/stats 中 month_summary 的实现：加载整月记录后在 Python 中求和"""
+    start_m = datetime(year, month, 1).date()
+    if month == 12:
+        next_first = datetime(year+1, 1, 1).date()
+    else:
+        next_first = datetime(year, month+1, 1).date()
+    month_rows = session.query(Record).filter(Record.date >= start_m, Record.date < next_first).all()
+    income = sum(r.amount_cents for r in month_rows if r.type == 'income')
+    expense = sum(r.amount_cents for r in month_rows if r.type == 'expense')
+    return {'year': year, 'month': month, 'income': income, 'expense': expense, 'balance': income - expense}
+
+
+def legacy_year_stats(session, year):
+    """原 /api/year-stats 的实现：加载全年记录后按月循环过滤"""
+    year_rows = session.query(Record).filter(
+        Record.date >= datetime(year, 1, 1).date(),
+        Record.date <= datetime(year, 12, 31).date()
+    ).all()
+    income = sum(r.amount_cents for r in year_rows if r.type == 'income')
+    expense = sum(r.amount_cents for r in year_rows if r.type == 'expense')
+    monthly_stats = {}
+    for m in range(1, 13):
+        if m == 12:
+            next_first = datetime(year+1, 1, 1).date()
+        else:
+            next_first = datetime(year, m+1, 1).date()
+        start_m = datetime(year, m, 1).date()
+        month_rows = [r for r in year_rows if start_m <= r.date < next_first]
+        m_income = sum(r.amount_cents for r in month_rows if r.type == 'income')
+        m_expense = sum(r.amount_cents for r in month_rows if r.type == 'expense')
+        monthly_stats[str(m)] = {'income': m_income, 'expense': m_expense, 'balance': m_income - m_expense}
+    return {'year': year, 'income': income, 'expense': expense,
+            'balance': income - expense, 'monthly_stats': monthly_stats}
+
+
+def generate_rows(n, seed=42):
+    rnd = random.Random(seed)
+    first = date(YEARS[0], 1, 1)
+    days = (date(YEARS[-1], 12, 31) - first).days + 1
+    for _ in range(n):
+        t = 'income' if rnd.random() < 0.2 else 'expense'
+        yield {
+            'type': t,
+            'amount_cents': rnd.randint(1, 500000),
+            'category_id': CATEGORIES.index(rnd.choice(CATEGORIES)) + 1,
+            'date': first + timedelta(days=rnd.randrange(days)),
+            'note': None,
+        }
+
+
+class TestStatsRegression(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        fd, cls.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        cls.engine = get_engine(f'sqlite:///{cls.db_path}')
+        Base.metadata.create_all(cls.engine)
+        batch = []
+        app_module.category_cache.clear()
+        with cls.engine.begin() as conn:
+            conn.execute(insert(Category), [{'id': i + 1, 'name': name} for i, name in enumerate(CATEGORIES)])
+            for row in generate_rows(ROWS):
+                batch.append(row)
+                if len(batch) == 50000:
+                    conn.execute(insert(Record), batch)
+                    batch = []
+            if batch:
+                conn.execute(insert(Record), batch)
+        # 统计接口读取日汇总表，批量写入后需要回填
+        rollup.rebuild(cls.engine)
+        cls._orig_engine = app_module.engine
+        app_module.engine = cls.engine
+        app_module.api_cache.clear()
+        cls.client = app_module.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        app_module.engine = cls._orig_engine
+        dispose_engine(cls.engine)
+        os.remove(cls.db_path)
+
+    def assertTotalsEqual(self, actual, expected):
+        for key in ('income', 'expense', 'balance'):
+            self.assertEqual(actual[key], format_cents(expected[key]), msg=key)
+
+    def test_year_stats_matches_legacy(self):
+        session = get_session(self.engine)
+        for year in YEARS + (YEARS[-1] + 1,):
+            expected = legacy_year_stats(session, year)
+            actual = self.client.get(f'/api/year-stats?year={year}').get_json()
+            self.assertEqual(actual['year'], year)
+            self.assertTotalsEqual(actual, expected)
+            self.assertEqual(set(actual['monthly_stats']), set(expected['monthly_stats']))
+            for m, totals in expected['monthly_stats'].items():
+                self.assertTotalsEqual(actual['monthly_stats'][m], totals)
+        session.close()
+
+    def test_month_summary_matches_legacy(self):
+        session = get_session(self.engine)
+        for year, month in [(2023, 1), (2024, 2), (2024, 12), (2025, 6), (2026, 1)]:
+            expected = legacy_month_summary(session, year, month)
+            actual = self.client.get(f'/api/stats?year={year}&month={month}').get_json()['month_summary']
+            self.assertEqual((actual['year'], actual['month']), (year, month))
+            self.assertTotalsEqual(actual, expected)
+        session.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+"""
+新增记录的后台写入与组提交（WRITE_BEHIND=1 开启）
+POST /api/record 校验后把记录放入队列，由后台线程合并写入：取到第一条后最多再等
+WRITE_BEHIND_DELAY_MS 毫秒或凑满 WRITE_BEHIND_BATCH 条，一个事务写入整批并提交一次。
+请求线程在所属批次提交成功后才返回 201，返回给客户端的持久性与逐条提交相同，
+每次提交（fsync）的开销由整批分摊。
+
+队列最多 WRITE_BEHIND_QUEUE 条，满了之后新请求最多等待 WRITE_BEHIND_PUT_TIMEOUT 秒，
+仍然放不进去时返回 503，由客户端稍后重试。整批提交失败时逐条重试，只有出错的那条请求返回错误。
+"""
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+
+import categories
+import changelog
+import partitions
+import rollup
+import search
+from models import Record, get_session
+
+class QueueFull(Exception):
+    """写入队列已满"""
+
+class GroupCommitWriter:
+    """bind() 返回写入使用的引擎；on_commit(span) 在每次提交后调用，span 为 (最早日期, 最晚日期)"""
+
+    def __init__(self, bind, max_batch=200, max_delay=0.002, max_queue=10000, put_timeout=1.0, on_commit=None):
+        self.bind = bind
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.put_timeout = put_timeout
+        self.on_commit = on_commit
+        self.batches = 0
+        self.rows = 0
+        self._queue = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """启动写入线程；gunicorn fork 出的 worker 中第一次调用时启动自己的线程"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """写完队列中已有的记录后停止线程"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def submit(self, values):
+        """放入一条 parse_record() 校验过的记录，返回 Future，提交后结果为已分离的 Record"""
+        self.start()
+        future = Future()
+        try:
+            self._queue.put((values, future), timeout=self.put_timeout)
+        except queue.Full:
+            raise QueueFull(f'写入队列已满（{self._queue.maxsize} 条）')
+        return future
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch):
+        try:
+            records, span = self._write([values for values, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # 整批失败（如某条备注超长）时逐条提交，不连累同批的其他请求
+            for item in batch:
+                self._commit([item])
+            return
+        self.batches += 1
+        self.rows += len(records)
+        if self.on_commit is not None:
+            try:
+                self.on_commit(span)
+            except Exception as e:
+                print(f'✗ 组提交回调失败: {e}')
+        for (_, future), rec in zip(batch, records):
+            future.set_result(rec)
+
+    def _write(self, rows):
+        """一个事务写入整批，整批共用一个账本版本；返回 (Record 列表, 日期范围)"""
+        session = get_session(self.bind())
+        # 提交后请求线程还要读取记录的字段
+        session.expire_on_commit = False
+        try:
+            partitions.check_writable(session, *{values['date'] for values in rows})
+            category_ids = categories.cache.ids(session, {values['category'] for values in rows})
+            version = changelog.next_version(session)
+            records = []
+            deltas = defaultdict(lambda: [0, 0])
+            for values in rows:
+                values = dict(values)
+                category_id = category_ids[values.pop('category')]
+                rec = Record(**values, category_id=category_id, version=version)
+                records.append(rec)
+                delta = deltas[(rec.date, rec.type, category_id)]
+                delta[0] += rec.amount_cents
+                delta[1] += 1
+            session.add_all(records)
+            rollup.apply_deltas(session, deltas)
+            session.flush()
+            names = {cid: name for name, cid in category_ids.items()}
+            search.add_to_index(session, [(rec.id, rec.note, names[rec.category_id]) for rec in records])
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        dates = [rec.date for rec in records]
+        return records, (min(dates), max(dates))
@@ -1,5 +1,9 @@
 """
 WSGI 入口文件，用于生产环境部署
+/api/events 的 SSE 连接会长时间占用处理线程，请使用线程 worker，例如：
+    gunicorn -w 4 -k gthread --threads 50 wsgi:app
+多 worker 时设置 CACHE_BACKEND=shared，使各 worker 的接口缓存同步失效；
+设置 METRICS_DIR（如 /tmp/ledger_metrics，启动前清空），/metrics 返回所有 worker 的合计。
 """
 from app import app
 